@@ -1,20 +1,17 @@
 import json
-import datetime
 import logging
 import re
 import time
 
 
+import polling
+from polling import TimeoutError
 from restclient import RestClient
 
 
 LOG = logging.getLogger(__name__)
 
 
-class TimeoutError(Exception):
-    """Time out exceptions"""
-
-
 class OMSError(Exception):
     """OMS error"""
 
@@ -359,16 +356,13 @@ class OmsController(object):
             return task_id
 
     def wait_for_task_completed(self, task_id, interval=60, timeout=3600):
-        begin_poll = datetime.datetime.now()
-        status_list = ['COMPLETED', 'STOPPING', 'STOPPED', 'FAILED']
-        while (datetime.datetime.now() - begin_poll).seconds < timeout:
-            task = self.get_task(task_id)
-            if task['status'] in status_list:
-                LOG.debug('Task %s status: %s', task_id, task['status'])
-                return task['status'], task['errorMessage']
-            time.sleep(interval)
-        raise TimeoutError('Waited %s seconds for task %s' % (timeout,
-                                                              task_id))
+        """Wait for a task to finish, polling at most every interval seconds
+
+        The first poll happens at once and the wait between polls grows
+        with jittered backoff, or follows the progress of the task.
+        """
+        return polling.wait_for_task(self.get_task, task_id, timeout,
+                                     max_interval=interval)
 
     def _validate_task(self, task_name, resp, interval=60, timeout=3600):
         start = time.time()
@@ -0,0 +1,127 @@
+"""Adaptive polling of long running OMS tasks"""
+
+import logging
+import random
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+EXPONENTIAL = 'exponential'
+DECORRELATED_JITTER = 'decorrelated'
+# Seconds between the first and second poll, the first poll happens at once
+INITIAL_DELAY = 2
+MULTIPLIER = 2
+FINAL_STATES = ['COMPLETED', 'STOPPING', 'STOPPED', 'FAILED']
+
+
+class TimeoutError(Exception):
+    """Time out exceptions"""
+
+
+class Backoff(object):
+    """Delays between polls of something that takes unknown time
+
+    Delays grow from initial to max_interval, by multiplier per poll with
+    EXPONENTIAL, or randomly between initial and three times the previous
+    delay with DECORRELATED_JITTER, so that many pollers do not hit the
+    server in lockstep. While the polled progress advances, the delay
+    follows the estimated time left instead, so a task is seen shortly
+    after it finished and a task that stalled is polled less and less.
+    """
+
+    def __init__(self, max_interval=60, initial=INITIAL_DELAY,
+                 multiplier=MULTIPLIER, strategy=DECORRELATED_JITTER):
+        if strategy not in (EXPONENTIAL, DECORRELATED_JITTER):
+            raise ValueError('Unknown backoff strategy %s' % strategy)
+        self.max_interval = max_interval
+        self.initial = min(initial, max_interval)
+        self.multiplier = multiplier
+        self.strategy = strategy
+        self.delay = None
+        self.last_progress = None
+
+    def _grow(self):
+        if self.delay is None:
+            return self.initial
+        if self.strategy == EXPONENTIAL:
+            return self.delay * self.multiplier
+        return random.uniform(self.initial, self.delay * 3)
+
+    def next_delay(self, progress=None):
+        """Return seconds to wait before the next poll.
+
+        :param progress: percentage of the work done, if known.
+        """
+        now = time.time()
+        delay = None
+        if progress is not None:
+            if self.last_progress is not None and \
+                    progress > self.last_progress[1]:
+                last_time, last_progress = self.last_progress
+                rate = (progress - last_progress) / (now - last_time)
+                delay = max(self.initial, (100 - progress) / rate)
+            self.last_progress = (now, float(progress))
+        if delay is None:
+            delay = self._grow()
+        self.delay = min(delay, self.max_interval)
+        return self.delay
+
+
+def poll(func, done, timeout, backoff=None, progress=None, name=None):
+    """Call func until done(result) is true or timeout seconds passed
+
+    The first call happens at once and the last one at the deadline.
+
+    :param func: function polled without arguments.
+    :param done: function telling from a result of func if polling ends.
+    :param backoff: Backoff pacing the calls, a default one if None.
+    :param progress: function returning the percentage done from a result
+                     of func, or None if unknown.
+    :param name: what is polled, for logs and errors.
+    :returns: the last result of func.
+    :raises: TimeoutError
+    """
+    backoff = backoff or Backoff()
+    name = name or func.__name__
+    start = time.time()
+    deadline = start + timeout
+    polls = 0
+    while True:
+        result = func()
+        polls += 1
+        if done(result):
+            LOG.debug('%s done after %d polls in %.1f seconds', name, polls,
+                      time.time() - start)
+            return result
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError('Waited %s seconds for %s' % (timeout, name))
+        delay = backoff.next_delay(progress(result) if progress else None)
+        delay = min(delay, remaining)
+        LOG.debug('%s not done, poll again in %.1f seconds', name, delay)
+        time.sleep(delay)
+
+
+def _task_progress(task):
+    progress = task.get('progress')
+    if isinstance(progress, (int, long, float)):
+        return progress
+    return None
+
+
+def wait_for_task(get_task, task_id, timeout, max_interval=60,
+                  strategy=DECORRELATED_JITTER):
+    """Poll an OMS task until it reached a final state.
+
+    :param get_task: function returning the task dict of a task id.
+    :param max_interval: longest wait between two polls.
+    :returns: status and error message of the task.
+    :raises: TimeoutError
+    """
+    task = poll(lambda: get_task(task_id),
+                lambda task: task['status'] in FINAL_STATES, timeout,
+                Backoff(max_interval, strategy=strategy), _task_progress,
+                'task %s' % task_id)
+    LOG.debug('Task %s status: %s', task_id, task['status'])
+    return task['status'], task['errorMessage']
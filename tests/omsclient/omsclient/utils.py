@@ -1,14 +1,11 @@
-import datetime
 import logging
 import re
-import time
 
-
-LOG = logging.getLogger(__name__)
+import polling
+from polling import TimeoutError
 
 
-class TimeoutError(Exception):
-    """Time out exceptions"""
+LOG = logging.getLogger(__name__)
 
 
 class NotFoundError(Exception):
@@ -32,16 +29,9 @@ def get_task_id(url):
 
 
 def wait_for_task_completed(oms_ctl, task_id, delay=30, timeout=1200):
-    begin_poll = datetime.datetime.now()
-    status_list = ['COMPLETED', 'STOPPING', "STOPPED", 'FAILED']
-    while (datetime.datetime.now() - begin_poll).seconds < timeout:
-        task = oms_ctl.get_task(task_id)
-        if task['status'] in status_list:
-            LOG.debug('Task %s status: %s', task_id, task['status'])
-            return task['status'], task['errorMessage']
-        time.sleep(delay)
-        timeout -= delay
-    raise TimeoutError('Waited %s seconds for task %s' % (timeout, task_id))
+    """Wait for a task to finish, polling at most every delay seconds."""
+    return polling.wait_for_task(oms_ctl.get_task, task_id, timeout,
+                                 max_interval=delay)
 
 
 def validate_task_succeeded(oms_ctl, task_name, resp, delay=30, timeout=1200):
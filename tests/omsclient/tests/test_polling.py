@@ -0,0 +1,122 @@
+import random
+import unittest
+
+import mock
+
+from omsclient import oms_controller
+from omsclient import polling
+from omsclient import utils
+
+
+class FakeClock(object):
+    """Replaces the time module, sleep() only moves the clock on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ClockTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(polling, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        random.seed(42)
+
+
+class BackoffTest(ClockTest):
+    def test_exponential(self):
+        backoff = polling.Backoff(max_interval=20, initial=2,
+                                  strategy=polling.EXPONENTIAL)
+        self.assertEqual([backoff.next_delay() for _ in range(6)],
+                         [2, 4, 8, 16, 20, 20])
+
+    def test_decorrelated_jitter_bounds(self):
+        backoff = polling.Backoff(max_interval=60, initial=2)
+        previous = None
+        for _ in range(200):
+            delay = backoff.next_delay()
+            if previous is None:
+                self.assertEqual(delay, 2)
+            else:
+                self.assertGreaterEqual(delay, 2)
+                self.assertLessEqual(delay, min(previous * 3, 60))
+            previous = delay
+
+    def test_initial_capped(self):
+        backoff = polling.Backoff(max_interval=1, initial=5)
+        self.assertEqual(backoff.next_delay(), 1)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, polling.Backoff, strategy='linear')
+
+    def test_follows_progress(self):
+        backoff = polling.Backoff(max_interval=600, initial=2,
+                                  strategy=polling.EXPONENTIAL)
+        self.assertEqual(backoff.next_delay(progress=10), 2)
+        self.clock.now += 10
+        # 10% in 10 seconds, the remaining 80% take 80 seconds
+        self.assertEqual(backoff.next_delay(progress=20), 80)
+
+    def test_stalled_progress_backs_off(self):
+        backoff = polling.Backoff(max_interval=600, initial=2,
+                                  strategy=polling.EXPONENTIAL)
+        backoff.next_delay(progress=50)
+        self.clock.now += 10
+        self.assertEqual(backoff.next_delay(progress=50), 4)
+        self.assertEqual(backoff.next_delay(progress=50), 8)
+
+
+class PollTest(ClockTest):
+    def test_first_poll_at_once(self):
+        results = iter([False, False, True])
+        self.assertTrue(polling.poll(lambda: next(results), bool, 60))
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertEqual(self.clock.sleeps[0], polling.INITIAL_DELAY)
+
+    def test_last_poll_at_deadline(self):
+        calls = []
+
+        def func():
+            calls.append(self.clock.now)
+            return False
+
+        backoff = polling.Backoff(max_interval=7,
+                                  strategy=polling.EXPONENTIAL)
+        with self.assertRaises(polling.TimeoutError):
+            polling.poll(func, bool, 30, backoff)
+        self.assertEqual(calls[0], 1000)
+        self.assertEqual(calls[-1], 1030)
+        self.assertTrue(all(d <= 7 for d in self.clock.sleeps))
+
+    def test_timeout_error_reexported(self):
+        self.assertIs(utils.TimeoutError, polling.TimeoutError)
+        self.assertIs(oms_controller.TimeoutError, polling.TimeoutError)
+
+    def test_wait_for_task(self):
+        tasks = iter([{'status': 'RUNNING', 'progress': 50},
+                      {'status': 'COMPLETED', 'progress': 100,
+                       'errorMessage': None}])
+        get_task = mock.Mock(side_effect=lambda task_id: next(tasks))
+        self.assertEqual(polling.wait_for_task(get_task, '7', 60),
+                         ('COMPLETED', None))
+        get_task.assert_called_with('7')
+
+    def test_wait_for_task_times_out(self):
+        get_task = mock.Mock(return_value={'status': 'RUNNING',
+                                           'progress': 'unknown'})
+        with self.assertRaises(polling.TimeoutError):
+            polling.wait_for_task(get_task, '7', 100, max_interval=10)
+        self.assertEqual(self.clock.now, 1100)
+
+
+if __name__ == '__main__':
+    unittest.main()
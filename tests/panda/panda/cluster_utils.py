@@ -149,14 +149,14 @@ def add_compute_vc(oms_ctl, ssh_client, vcenter_insecure, vcenter_ip, user,
 
 
 def get_cluster_moid(vc_host, vc_user, vc_pwd, datacenter, cluster):
-    with VirtualCenter(vc_host, vc_user, vc_pwd) as vc:
+    with VirtualCenter(vc_host, vc_user, vc_pwd, pooled=True) as vc:
         dc_mor = vc.get_datacenter(datacenter)
         return dc_mor.get_cluster(cluster).moid
 
 
 def get_moids(vc_host, vc_user, vc_pwd, datacenter, mgmt_cluster,
               compute_clusters, datastore):
-    with VirtualCenter(vc_host, vc_user, vc_pwd) as vc:
+    with VirtualCenter(vc_host, vc_user, vc_pwd, pooled=True) as vc:
         dc_mor = vc.get_datacenter(datacenter)
         mgmt_moid = dc_mor.get_cluster(mgmt_cluster).moid
         compute_moids = []
@@ -188,7 +188,7 @@ def refresh_nsxv_config(cluster_spec, nsxv_ip, nsxv_user, nsxv_pwd):
 
 def refresh_mgmt_moid(cluster_spec, vc_host, vc_user, vc_pwd, datacenter,
                       mgmt_cluster):
-    with VirtualCenter(vc_host, vc_user, vc_pwd) as vc:
+    with VirtualCenter(vc_host, vc_user, vc_pwd, pooled=True) as vc:
         dc_mor = vc.get_datacenter(datacenter)
         mgmt_cls_moid = dc_mor.get_cluster(mgmt_cluster).moid
     LOG.debug('Management dc: %s, MOID: %s', datacenter, dc_mor.moid)
@@ -201,7 +201,7 @@ def refresh_nodegroup_nsxv_moid(cluster_spec, vc_host, vc_user, vc_pwd,
                                 datacenter, compute_clusters, glance_ds,
                                 nsxv_edge_dvs, nsxv_edge_cluster):
     ctl_attrs = get_controller_attrs(cluster_spec)
-    with VirtualCenter(vc_host, vc_user, vc_pwd) as vc:
+    with VirtualCenter(vc_host, vc_user, vc_pwd, pooled=True) as vc:
         dc_mor = vc.get_datacenter(datacenter)
         LOG.debug('Compute dc: %s, MOID: %s', datacenter, dc_mor.moid)
         compute_moids = []
@@ -234,7 +234,7 @@ def refresh_nodegroup_nsxv_moid(cluster_spec, vc_host, vc_user, vc_pwd,
 
 def refresh_nodegroup_dvs_moid(cluster_spec, vc_host, vc_user, vc_pwd,
                                datacenter, compute_clusters, dvs):
-    with VirtualCenter(vc_host, vc_user, vc_pwd) as vc:
+    with VirtualCenter(vc_host, vc_user, vc_pwd, pooled=True) as vc:
         dc_mor = vc.get_datacenter(datacenter)
         compute_moids = []
         for compute in compute_clusters:
@@ -89,23 +89,29 @@ def deploy_vapp(vc_host, vc_user, vc_password, dc, cluster, ds, network,
 
 def check_vapp_exists(vc_host, vc_user, vc_password,
                       name_regex=r'^VMware-OpenStack.*\d$'):
-    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password) as vc:
+    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password,
+                                  pooled=True) as vc:
         vapp = vc.get_entity_by_regex(vmwareapi.Vapp, name_regex)
     return True if vapp else False
 
 
+def _set_omjs_cmd(key, value, path=OMJS_PATH):
+    return 'sed -i "s|%s.*|%s = %s|g" %s' % (key, key, value, path)
+
+
 def set_omjs_value(ssh_client, key, value, path=OMJS_PATH):
-    ssh_client.run('sed -i "s|%s.*|%s = %s|g" %s' %
-                   (key, key, value, path), sudo=True, raise_error=True)
+    ssh_client.run(_set_omjs_cmd(key, value, path), sudo=True,
+                   raise_error=True)
 
 
 def config_omjs(ip, vc_user, vc_password, properties, user='viouser',
                 password='vmware'):
     LOG.info('Update omjs.properties: %s', properties)
-    ssh_client = RemoteClient(ip, user, password)
-    for key in properties:
-        set_omjs_value(ssh_client, key, properties[key])
-    ssh_client.run('restart oms', sudo=True, raise_error=True)
+    ssh_client = RemoteClient(ip, user, password, pooled=True)
+    cmds = [_set_omjs_cmd(key, properties[key]) for key in properties]
+    cmds.append('restart oms')
+    ssh_client.run_batch(cmds, sudo=True, raise_error=True,
+                         stop_on_error=True)
     wait_for_mgmt_service(ip, vc_user, vc_password)
 
 
@@ -118,7 +124,8 @@ def config_omjs_for_release_build(ip, vc_user, vc_password):
 
 
 def remove_vapp(vc_host, vc_user, vc_password, name_regex):
-    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password) as vc:
+    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password,
+                                  pooled=True) as vc:
         vapp = vc.get_entity_by_regex(vmwareapi.Vapp, name_regex)
         if vapp:
             LOG.info("Start to remove %s" % vapp.name)
@@ -131,13 +138,18 @@ def remove_vapp(vc_host, vc_user, vc_password, name_regex):
 
 
 def get_vapp_version(vc_host, vc_user, vc_password, name_regex):
-    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password) as vc:
+    with vmwareapi.VirtualCenter(vc_host, vc_user, vc_password,
+                                  pooled=True) as vc:
         vapp = vc.get_entity_by_regex(vmwareapi.Vapp, name_regex)
         return vapp.version if vapp else None
 
 
 def get_patch_info(ssh_client, patch_version):
     output = ssh_client.run('viopatch list', sudo=True, raise_error=True)
+    return parse_patch_info(output, patch_version)
+
+
+def parse_patch_info(output, patch_version):
     lines = output.split('\n')
     if len(lines) > 2:
         lines = lines[2:]
@@ -156,7 +168,7 @@ def apply_patch(ip, file_path, user='viouser', password='vmware'):
     file_name = os.path.basename(file_path)
     patch_name, patch_version = file_name.split('_')[0:2]
     # Check if patch has already been installed
-    ssh_client = RemoteClient(ip, user, password)
+    ssh_client = RemoteClient(ip, user, password, pooled=True)
     patch_info = get_patch_info(ssh_client, patch_version)
     if patch_info and patch_info['Installed'] == 'Yes':
         LOG.info('Patch %s has already been installed, Skip installing it.',
@@ -166,18 +178,20 @@ def apply_patch(ip, file_path, user='viouser', password='vmware'):
         LOG.info('Adding patch %s' % file_name)
         remote_path = os.path.join('/tmp', file_name)
         ssh_client.scp(file_name, '/tmp')
-        ssh_client.run('viopatch add -l %s' % remote_path, sudo=True,
-                       raise_error=True)
         # Clean up patch file in case oms disk becomes full
-        ssh_client.run('rm -f %s' % remote_path)
-    patch_info = get_patch_info(ssh_client, patch_version)
+        results = ssh_client.run_batch(
+            ['viopatch add -l %s' % remote_path,
+             'rm -f %s' % remote_path,
+             'viopatch list'], sudo=True, raise_error=True)
+        patch_info = parse_patch_info(results[-1][1], patch_version)
     if not patch_info:
         raise NotSupportedError('Failed to add Patch %s' % file_name)
     LOG.info('Start to install patch %s' % file_name)
-    ssh_client.run('viopatch install --patch %s --version %s --as-infra' %
-                   (patch_name, patch_version), sudo=True, raise_error=True,
-                   feed_input='Y')
-    patch_info = get_patch_info(ssh_client, patch_version)
+    results = ssh_client.run_batch(
+        ['echo Y | viopatch install --patch %s --version %s --as-infra' %
+         (patch_name, patch_version),
+         'viopatch list'], sudo=True, raise_error=True, stop_on_error=True)
+    patch_info = parse_patch_info(results[-1][1], patch_version)
     if patch_info['Installed'] != 'Yes':
         LOG.error('Failed to install patch %s' % patch_info)
         raise NotCompletedError('Failed to install patch %s.' % file_name)
@@ -168,7 +168,8 @@ class VIO(Openstack):
             # TODO(xiaoy): Remove provision failed cluster
             # Add compute VC if multiple VC
             attrs = cluster_utils.get_controller_attrs(self.cluster_spec)
-            ssh_client = RemoteClient(self.oms_ip, self.oms_user, self.oms_pwd)
+            ssh_client = RemoteClient(self.oms_ip, self.oms_user, self.oms_pwd,
+                                      pooled=True)
             if attrs['vcenter_ip'] != self.vc_host:
                 LOG.debug('Managment VC: %s, Compute VC: %s. This is multi-vc',
                           self.vc_host, attrs['vcenter_ip'])
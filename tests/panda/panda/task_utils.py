@@ -32,9 +32,9 @@ def wait_for(func, timeout, delay, *args, **kargs):
 
 
 def safe_run(cmd, msg, sleep_time=180):
-    exit_code = shell.local(cmd)[0]
+    exit_code = shell.local_stream(cmd).wait()
     if exit_code:
         LOG.warning('Failed to %s. Retry it after %s seconds' %
                     (msg, sleep_time))
         time.sleep(sleep_time)
-        shell.local(cmd, raise_error=True)
+        shell.local_stream(cmd, raise_error=True).wait()
@@ -60,21 +60,21 @@ def install_tempest(repository='github.com/openstack/tempest.git',
                     nsx_branch='stable/mitaka',
                     protocol='http',
                     conf_template=None):
+    clones = []
     if os.path.exists(TEMPEST_DIR):
         LOG.info('Tempest already exists, skip cloning.')
     else:
         LOG.info('Clone tempest from repository.')
         clone_url = '%s://%s' % (protocol, repository)
-        shell.local('%s -b %s %s' % (GIT_CLONE, branch, clone_url),
-                    raise_error=True)
+        clones.append('%s -b %s %s' % (GIT_CLONE, branch, clone_url))
     # Get vmware_nsx plugin
     if os.path.exists(VMWARE_NSX_DIR):
         LOG.info('vmware-nsx already exists, skip cloning.')
     else:
         LOG.info('Clone vmware-nsx from repository.')
         clone_url = '%s://%s' % (protocol, nsx_repo)
-        shell.local('%s -b %s %s' % (GIT_CLONE, nsx_branch, clone_url),
-                    raise_error=True)
+        clones.append('%s -b %s %s' % (GIT_CLONE, nsx_branch, clone_url))
+    shell.run_parallel(clones, raise_error=True)
     with shell.cd(TEMPEST_DIR):
         shell.local("sed -i 's/-500/-1500/g' .testr.conf")
         LOG.info('Copy template to etc/tempest.conf')
@@ -437,12 +437,13 @@ def generate_run_list(neutron_backend):
     with shell.cd(TEMPEST_DIR):
         if not os.path.exists('%s/.testrepository' % TEMPEST_DIR):
             shell.local('./tools/with_venv.sh testr init', raise_error=True)
-        lines = shell.local('./tools/with_venv.sh testr list-tests',
-                            raise_error=True)[1]
-    # Obtain all tests into a dict {test_name: test_id}
-    all_tests = dict([split_name_and_id(line) for line in lines.split('\n')
-                     if line.startswith('tempest.') or
-                     line.startswith('vmware_nsx_tempest.')])
+        lines = shell.local_stream('./tools/with_venv.sh testr list-tests',
+                                   raise_error=True)
+        # Obtain all tests into a dict {test_name: test_id}
+        all_tests = dict([split_name_and_id(line.rstrip('\n'))
+                          for line in lines
+                          if line.startswith('tempest.') or
+                          line.startswith('vmware_nsx_tempest.')])
 
     # Get excluded tests into a list [test_name]
     exclude_file = '%s/%s-excluded-tests.txt' % (get_data_path(),
@@ -491,15 +492,22 @@ def generate_run_list(neutron_backend):
 def make_reports(report_dir, suite_name):
     subunit = '/tmp/%s-subunit.txt' % suite_name
     junit_xml = os.path.join(report_dir, '%s_results.xml' % suite_name)
-    shell.local('./tools/with_venv.sh testr last --subunit > %s' % subunit)
-    shell.local('subunit2junitxml --output-to=%s < %s' % (junit_xml, subunit))
     html_report_file = os.path.join(report_dir, '%s_results.html' % suite_name)
-    try:
-        shell.local('subunit2html %s %s' % (subunit, html_report_file),
-                    raise_error=True)
+    # Read the subunit stream once and convert it to both reports at once
+    source, junit, html = shell.tee(
+        shell.Command('./tools/with_venv.sh testr last --subunit',
+                      capture=False),
+        ['subunit2junitxml --output-to=%s' % junit_xml,
+         'subunit2html /dev/stdin %s' % html_report_file],
+        files=[subunit])
+    if not junit.succeeded:
+        LOG.warning('Failed to generate report to %s: %s' %
+                    (junit_xml, junit.output))
+    if html.succeeded:
         LOG.info('Generated report to %s.' % html_report_file)
-    except Exception:
-        LOG.exception('Failed to generate report to %s.' % html_report_file)
+    else:
+        LOG.error('Failed to generate report to %s: %s' %
+                  (html_report_file, html.output))
 
 
 def run_test(component, report_dir, parallel=False, rerun_failed=False):
@@ -0,0 +1,185 @@
+"""Benchmarks of pyVmomiwrapper against the in-memory fake vCenter
+
+Every scenario reports wall time and SOAP round-trips. Round-trips do not
+depend on the machine, so a saved baseline catches regressions reliably::
+
+    python -m pyVmomiwrapper.benchmark --vms 10000 --save baseline.json
+    python -m pyVmomiwrapper.benchmark --vms 10000 --baseline baseline.json
+
+With --baseline the exit status is 1 if any scenario needs more
+round-trips than recorded.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+import fake
+import task
+import vmwareapi
+
+
+LOG = logging.getLogger(__name__)
+
+SCENARIOS = []
+
+
+def scenario(func):
+    SCENARIOS.append(func)
+    return func
+
+
+def _vm_name(n):
+    return 'vm-%05d' % n
+
+
+def _vms_in_range(dc, first, count):
+    names = set(_vm_name(n) for n in range(first, first + count))
+    return [vm for vm in dc.get_vms(regex=r'^vm-') if vm.name in names]
+
+
+@scenario
+def lookup_by_name(vc, args):
+    """Look up VMs one by one by name."""
+    for n in range(0, args.vms, max(args.vms // args.lookups, 1)):
+        vc.get_entity_by_name(vmwareapi.VM, _vm_name(n))
+
+
+@scenario
+def lookup_by_regex(vc, args):
+    """Select a tenth of all VMs by regular expression."""
+    vc.get_entities_by_regex(vmwareapi.VM, r'^vm-\d*1$')
+
+
+@scenario
+def lookup_clusters(vc, args):
+    """Resolve the datacenter and every cluster by name."""
+    for c in range(args.clusters):
+        vc.get_datacenter('dc-0').get_cluster('cluster-0-%d' % c)
+
+
+@scenario
+def lookup_cached(vc, args):
+    """Look up VMs and clusters through the inventory cache."""
+    vc.enable_cache()
+    try:
+        dc = vc.get_datacenter('dc-0')
+        for n in range(0, args.vms, max(args.vms // args.lookups, 1)):
+            dc.get_entity_by_name(vmwareapi.VM, _vm_name(n))
+        for c in range(args.clusters):
+            dc.get_cluster('cluster-0-%d' % c)
+    finally:
+        vc.disable_cache()
+
+
+@scenario
+def prefetch_states(vc, args):
+    """Read name, power state and IP of a batch of VMs."""
+    vms = vc.get_datacenter('dc-0').get_vms(regex=r'^vm-')[:args.batch]
+    vmwareapi.prefetch(vms, ['summary.guest.ipAddress'])
+    for vm in vms:
+        vm.name, vm.get_state(), vm.ip
+
+
+@scenario
+def poweroff_batch(vc, args):
+    """Power off a batch of VMs through one multi-task waiter."""
+    dc = vc.get_datacenter('dc-0')
+    vmwareapi.poweroff_all(_vms_in_range(dc, 0, args.batch))
+
+
+@scenario
+def add_nics_async(vc, args):
+    """Add all portgroups to a batch of VMs with futures."""
+    dc = vc.get_datacenter('dc-0')
+    pgs = dc.get_entities_by_regex(vmwareapi.DistributedVirtualPortgroup,
+                                   r'^dvpg-')
+    vms = _vms_in_range(dc, args.batch, args.batch)
+    for future in [vm.add_nics_async(pgs) for vm in vms]:
+        future.result()
+
+
+@scenario
+def destroy_capped(vc, args):
+    """Power off and destroy a batch of VMs with a concurrency cap."""
+    dc = vc.get_datacenter('dc-0')
+    vmwareapi.cleanup_vms(_vms_in_range(dc, 2 * args.batch, args.batch),
+                          max_concurrent=args.concurrency)
+
+
+def run(args):
+    LOG.info('Build inventory with %d VMs', args.vms)
+    si = fake.create_service_instance(
+        clusters=args.clusters, hosts_per_cluster=args.hosts_per_cluster,
+        vms=args.vms, latency=args.latency, task_latency=args.task_latency)
+    stub = si._stub
+    vc = vmwareapi.VirtualCenter('fake', 'user', 'pwd')
+    vc.si = si
+    results = {}
+    for func in SCENARIOS:
+        if args.only and func.__name__ not in args.only:
+            continue
+        round_trips = stub.round_trips
+        start = time.time()
+        func(vc, args)
+        results[func.__name__] = {
+            'seconds': round(time.time() - start, 3),
+            'round_trips': stub.round_trips - round_trips}
+        print '%-20s %8.3fs %8d round-trips' % (
+            func.__name__, results[func.__name__]['seconds'],
+            results[func.__name__]['round_trips'])
+    task.StopTaskMonitor(si)
+    return results
+
+
+def compare(results, baseline):
+    """Return names of scenarios that need more round-trips than baseline."""
+    regressed = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name, {}).get('round_trips')
+        if expected is not None and result['round_trips'] > expected:
+            print '%s regressed: %d round-trips, baseline %d' % (
+                name, result['round_trips'], expected)
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vms', type=int, default=10000)
+    parser.add_argument('--clusters', type=int, default=10)
+    parser.add_argument('--hosts-per-cluster', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=500,
+                        help='VMs touched by bulk scenarios')
+    parser.add_argument('--lookups', type=int, default=5,
+                        help='single VM lookups per lookup scenario')
+    parser.add_argument('--concurrency', type=int,
+                        default=vmwareapi.DESTROY_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated seconds per round-trip')
+    parser.add_argument('--task-latency', type=float, default=0.0,
+                        help='simulated seconds until a task completes')
+    parser.add_argument('--only', nargs='*',
+                        help='names of scenarios to run')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    args = parser.parse_args(argv)
+    if args.vms < 3 * args.batch:
+        parser.error('--vms must be at least 3 times --batch')
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f)):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Parallel, resumable HTTP downloads from vCenter and ESXi"""
+
+import logging
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+PARTIAL_SUFFIX = '.part'
+
+
+class DownloadResult(object):
+    """Outcome of downloading one URL."""
+
+    def __init__(self, name, url, path):
+        self.name = name
+        self.url = url
+        self.path = path
+        self.size = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    @property
+    def throughput(self):
+        """Bytes per second received by this download."""
+        if not self.seconds:
+            return 0.0
+        return self.size / self.seconds
+
+    def __repr__(self):
+        return '<DownloadResult %s %d bytes %.1f MB/s%s>' % (
+            self.name, self.size, self.throughput / MB,
+            ' error: %s' % self.error if self.error else '')
+
+
+def session_cookie(si):
+    """Return the SOAP session cookie of a ServiceInstance.
+
+    vCenter accepts it for /diagnostics and other file URLs.
+    """
+    stub = si._stub
+    # VimSessionOrientedStub wraps the SoapStubAdapter
+    stub = getattr(stub, 'soapStub', stub)
+    return stub.cookie
+
+
+def _fetch(http, url, part, timeout):
+    """Append the rest of url to part."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+    resp = http.get(url, headers=headers, stream=True, timeout=timeout)
+    try:
+        if resp.status_code == 416:
+            # Nothing left to read
+            return
+        resp.raise_for_status()
+        if offset and resp.status_code != 206:
+            LOG.debug('%s does not support ranges, restart', url)
+            offset = 0
+        received = 0
+        with open(part, 'ab' if offset else 'wb') as f:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+        expected = resp.headers.get('Content-Length')
+        if expected is not None and received < int(expected):
+            raise IOError('Connection closed after %d of %s bytes' %
+                          (received, expected))
+    finally:
+        resp.close()
+
+
+def download(url, path, name=None, cookie=None, verify=True,
+             retries=DEFAULT_RETRIES, timeout=300):
+    """Stream url to path, resuming with ranged GETs after failures.
+
+    Data is written to path + '.part' first and renamed when complete, so
+    a download interrupted in an earlier run is resumed as well.
+
+    :param name: label used in logs and the result, defaults to path.
+    :param cookie: Cookie header to send, e.g. session_cookie(si).
+    :param retries: number of times an interrupted transfer is resumed.
+    :param timeout: seconds to wait for the server to send data.
+    :returns: DownloadResult instance.
+    """
+    result = DownloadResult(name or path, url, path)
+    part = path + PARTIAL_SUFFIX
+    http = requests.Session()
+    http.verify = verify
+    if cookie:
+        http.headers['Cookie'] = cookie
+    resumed = os.path.getsize(part) if os.path.exists(part) else 0
+    if resumed:
+        LOG.info('Resume download of %s at %d bytes', result.name, resumed)
+    start = time.time()
+    try:
+        for attempt in range(retries + 1):
+            try:
+                _fetch(http, url, part, timeout)
+                break
+            except (requests.ConnectionError, requests.Timeout, IOError) \
+                    as e:
+                if isinstance(e, requests.HTTPError) or attempt == retries:
+                    raise
+                LOG.warning('Download of %s interrupted, resume: %s',
+                            result.name, e)
+        result.size = max(os.path.getsize(part) - resumed, 0)
+        os.rename(part, path)
+    except Exception as e:
+        result.error = e
+        LOG.error('Download of %s failed: %s', result.name, e)
+    finally:
+        http.close()
+        result.seconds = time.time() - start
+    if result.succeeded:
+        LOG.info('Downloaded %s: %.1f MB in %.1fs, %.2f MB/s', result.name,
+                 float(result.size) / MB, result.seconds,
+                 result.throughput / MB)
+    return result
+
+
+def download_all(targets, dest_dir, workers=DEFAULT_WORKERS, **kwargs):
+    """Download many URLs concurrently into a directory.
+
+    :param targets: list of (name, url) pairs. Files are named after the
+                    last path segment of the url.
+    :param dest_dir: directory to write files to, created if missing.
+    :param workers: maximum number of concurrent downloads.
+    :param kwargs: passed on to download().
+    :returns: list of DownloadResult in the order of targets.
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+
+    def run(target):
+        name, url = target
+        filename = url.rstrip('/').rsplit('/', 1)[-1]
+        return download(url, os.path.join(dest_dir, filename), name=name,
+                        **kwargs)
+
+    if not targets:
+        return []
+    pool = ThreadPool(min(workers, len(targets)))
+    try:
+        results = pool.map(run, targets)
+    finally:
+        pool.close()
+        pool.join()
+    size = sum(r.size for r in results)
+    failed = [r.name for r in results if not r.succeeded]
+    LOG.info('Downloaded %d files, %.1f MB, %d failed %s', len(results),
+             float(size) / MB, len(failed), failed or '')
+    return results
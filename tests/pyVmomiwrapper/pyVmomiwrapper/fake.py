@@ -0,0 +1,624 @@
+"""In-memory vSphere stand-in for exercising pyVmomiwrapper offline.
+
+FakeStub plays the role of pyVmomi's SoapStubAdapter. Managed object
+references created through it are genuine pyVmomi objects, so isinstance
+checks and method dispatch behave as they do against a real vCenter, but
+every method call and property read is answered from an in-memory
+inventory. Each answer counts as one round-trip and optionally sleeps for
+a simulated latency, and tasks complete after a simulated task latency.
+
+Usage::
+
+    si = fake.create_service_instance(clusters=10, hosts_per_cluster=20,
+                                      vms=10000, latency=0.002)
+    vc = vmwareapi.VirtualCenter('fake', 'user', 'pwd')
+    vc.si = si
+    vc.get_entity_by_name(vmwareapi.VM, 'vm-00042')
+    print si._stub.round_trips
+
+See benchmark.py for timed scenarios built on it.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+from pyVmomi.SoapAdapter import StubAdapterBase
+
+import metrics
+
+
+LOG = logging.getLogger(__name__)
+
+VERSION = 'vim.version.version6'
+PC = vmodl.query.PropertyCollector
+
+
+class FakeStub(StubAdapterBase):
+    """Stub adapter serving vSphere API calls from an in-memory inventory.
+
+    :param latency: seconds to sleep for every round-trip.
+    :param task_latency: seconds before a submitted task completes.
+    """
+
+    def __init__(self, latency=0.0, task_latency=0.0):
+        StubAdapterBase.__init__(self, version=VERSION)
+        self.latency = latency
+        self.task_latency = task_latency
+        self.round_trips = 0
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.props = {}
+        self.children = {}
+        self.mors = {}
+        self.seq = 0
+        self.changes = []
+        self.collectors = {}
+        self.cancelled = set()
+        self.filters = {}
+        self.results = {}
+        self.counters = {}
+        self.content = None
+        self.root = None
+        self.sessions = 0
+        self.authenticated = True
+        self.cookie = 'vmware_soap_session="fake"'
+        # URL pattern of generated log bundles, '*' stands for the server
+        self.bundle_url = 'https://*/downloads/%s.tgz'
+
+    # Inventory management
+
+    def new_moid(self, prefix):
+        with self.lock:
+            count = self.counters.get(prefix, 0) + 1
+            self.counters[prefix] = count
+        return '%s-%d' % (prefix, count)
+
+    def add(self, vim_type, prefix, parent=None, **props):
+        """Add a managed object to the inventory and return its reference."""
+        mor = vim_type(self.new_moid(prefix), self)
+        with self.lock:
+            props['parent'] = parent
+            self.props[mor._moId] = props
+            self.mors[mor._moId] = mor
+            self.children[mor._moId] = []
+            if parent is not None:
+                self.children[parent._moId].append(mor)
+            self._record(mor, 'enter', props.keys())
+        return mor
+
+    def remove(self, mor):
+        with self.lock:
+            for child in list(self.children.get(mor._moId, [])):
+                self.remove(child)
+            parent = self.props[mor._moId].get('parent')
+            if parent is not None:
+                self.children[parent._moId].remove(mor)
+            del self.props[mor._moId]
+            del self.children[mor._moId]
+            self._record(mor, 'leave', [])
+
+    def update(self, mor, **props):
+        with self.lock:
+            self.props[mor._moId].update(props)
+            self._record(mor, 'modify', props.keys())
+
+    def _record(self, mor, kind, names):
+        self.seq += 1
+        self.changes.append((self.seq, mor, kind, list(names)))
+        self.changed.notify_all()
+
+    def descendants(self, mor, vim_types):
+        found = []
+        seen = set()
+        stack = list(self.children.get(mor._moId, []))
+        while stack:
+            child = stack.pop()
+            if child._moId in seen or child._moId not in self.props:
+                continue
+            seen.add(child._moId)
+            if any(isinstance(child, t) for t in vim_types):
+                found.append(child)
+            stack.extend(self.children.get(child._moId, []))
+            # VMs are reachable through the hosts they run on as well
+            stack.extend(self.props[child._moId].get('vm') or [])
+        return found
+
+    def get_property(self, mor, path):
+        with self.lock:
+            props = self.props.get(mor._moId)
+            if props is None:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mor)
+            head, _, rest = path.partition('.')
+            if head == 'childEntity':
+                value = list(self.children[mor._moId])
+            elif head == 'view' and 'container' in props:
+                value = self.descendants(props['container'], props['type'])
+            else:
+                value = props.get(head)
+        for attr in rest.split('.') if rest else []:
+            if value is None:
+                break
+            value = getattr(value, attr)
+        return value
+
+    # Stub adapter interface
+
+    def _round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if metrics.is_enabled():
+            metrics.registry.count('soap_calls')
+        if self.latency:
+            time.sleep(self.latency)
+
+    def InvokeAccessor(self, mo, info):
+        self._round_trip()
+        return self.get_property(mo, info.name)
+
+    def InvokeMethod(self, mo, info, args, outerStub=None):
+        """Dispatch a method call to its _do_<wsdlName> handler.
+
+        Like SoapStubAdapter, an outerStub such as a SessionOrientedStub
+        gets an (HTTP status, result or fault) tuple back.
+        """
+        self._round_trip()
+        try:
+            if not self.authenticated and info.wsdlName not in (
+                    'RetrieveServiceContent', 'Login'):
+                raise vim.fault.NotAuthenticated(object=mo)
+            handler = getattr(self, '_do_%s' % info.wsdlName, None)
+            if handler is None:
+                raise vmodl.fault.NotImplemented(
+                    msg='%s is not simulated' % info.wsdlName)
+            result = handler(mo, *args)
+        except vmodl.MethodFault as e:
+            if outerStub is None:
+                raise
+            return 500, e
+        return result if outerStub is None else (200, result)
+
+    def expire_sessions(self):
+        """Make every call fail with NotAuthenticated until the next Login."""
+        self.authenticated = False
+
+    # ServiceInstance and SessionManager
+
+    def _do_RetrieveServiceContent(self, mo):
+        return self.content
+
+    def _do_Login(self, mo, userName, password, locale):
+        self.authenticated = True
+        self.sessions += 1
+        session = vim.UserSession(key='session-%d' % self.sessions,
+                                  userName=userName)
+        self.update(mo, currentSession=session)
+        return session
+
+    def _do_Logout(self, mo):
+        self.update(mo, currentSession=None)
+
+    def _do_SessionIsActive(self, mo, sessionID, userName):
+        session = self.get_property(mo, 'currentSession')
+        return session is not None and session.key == sessionID
+
+    # ViewManager
+
+    def _do_CreateContainerView(self, mo, container, type, recursive):
+        return self.add(vim.view.ContainerView, 'session[fake]view',
+                        container=container, type=type)
+
+    def _do_CreateListView(self, mo, obj):
+        obj = obj or []
+        return self.add(vim.view.ListView, 'session[fake]listview',
+                        view=[o for o in obj if o._moId in self.props])
+
+    def _do_ModifyListView(self, mo, add, remove):
+        with self.lock:
+            removed = set(o._moId for o in remove or [])
+            view = [o for o in self.props[mo._moId]['view']
+                    if o._moId not in removed]
+            unresolved = [o for o in add or [] if o._moId not in self.props]
+            view.extend(o for o in add or [] if o._moId in self.props)
+            self.update(mo, view=view)
+        return unresolved
+
+    def _do_DestroyView(self, mo):
+        self.remove(mo)
+
+    # PropertyCollector
+
+    def _objects_for(self, spec):
+        objects = []
+        for obj_spec in spec.objectSet:
+            if not obj_spec.skip:
+                objects.append(obj_spec.obj)
+            for select in obj_spec.selectSet or []:
+                if select.path == 'view':
+                    objects.extend(self.get_property(obj_spec.obj, 'view'))
+        return objects
+
+    def _content_for(self, obj, prop_specs):
+        content = PC.ObjectContent(obj=obj, propSet=[], missingSet=[])
+        for prop_spec in prop_specs:
+            if not isinstance(obj, prop_spec.type):
+                continue
+            paths = prop_spec.pathSet
+            if prop_spec.all:
+                paths = self.props[obj._moId].keys()
+            for path in paths:
+                content.propSet.append(vmodl.DynamicProperty(
+                    name=path, val=self.get_property(obj, path)))
+        return content
+
+    def _retrieve(self, specSet):
+        with self.lock:
+            result = []
+            for spec in specSet:
+                for obj in self._objects_for(spec):
+                    if obj._moId in self.props:
+                        result.append(self._content_for(obj, spec.propSet))
+            return result
+
+    def _page(self, objects, max_objects):
+        if not objects:
+            return None
+        token = None
+        if max_objects and len(objects) > max_objects:
+            token = self.new_moid('token')
+            self.results[token] = objects[max_objects:]
+            objects = objects[:max_objects]
+        return PC.RetrieveResult(objects=objects, token=token)
+
+    def _do_RetrieveProperties(self, mo, specSet):
+        return self._retrieve(specSet)
+
+    def _do_RetrievePropertiesEx(self, mo, specSet, options):
+        return self._page(self._retrieve(specSet), options.maxObjects)
+
+    def _do_ContinueRetrievePropertiesEx(self, mo, token):
+        return self._page(self.results.pop(token), len(self.props))
+
+    def _do_CancelRetrievePropertiesEx(self, mo, token):
+        self.results.pop(token, None)
+
+    def _do_CreatePropertyCollector(self, mo):
+        pc = self.add(vim.PropertyCollector, 'session[fake]pc')
+        self.collectors[pc._moId] = []
+        return pc
+
+    def _do_DestroyPropertyCollector(self, mo):
+        for filter_ in self.collectors.pop(mo._moId, []):
+            self.filters.pop(filter_._moId, None)
+        self.remove(mo)
+
+    def _do_CreateFilter(self, mo, spec, partialUpdates):
+        filter_ = self.add(vmodl.query.PropertyCollector.Filter,
+                           'session[fake]filter')
+        with self.lock:
+            self.filters[filter_._moId] = (spec, {})
+            self.collectors.setdefault(mo._moId, []).append(filter_)
+        return filter_
+
+    def _do_DestroyPropertyFilter(self, mo):
+        with self.lock:
+            self.filters.pop(mo._moId, None)
+            for filters in self.collectors.values():
+                if mo in filters:
+                    filters.remove(mo)
+        self.remove(mo)
+
+    def _filter_update(self, filter_, since):
+        spec, seen = self.filters[filter_._moId]
+        current = dict((o._moId, o) for o in self._objects_for(spec)
+                       if o._moId in self.props)
+        modified = {}
+        for seq, mor, kind, names in self.changes[since:]:
+            if kind == 'modify' and mor._moId in seen:
+                modified.setdefault(mor._moId, set()).update(names)
+        updates = []
+        for moid, obj in current.items():
+            if moid not in seen:
+                content = self._content_for(obj, spec.propSet)
+                changes = [PC.Change(name=p.name, op='assign', val=p.val)
+                           for p in content.propSet]
+                updates.append(PC.ObjectUpdate(kind='enter', obj=obj,
+                                               changeSet=changes))
+            elif moid in modified:
+                content = self._content_for(obj, spec.propSet)
+                changes = [PC.Change(name=p.name, op='assign', val=p.val)
+                           for p in content.propSet
+                           if p.name.split('.')[0] in modified[moid]]
+                if changes:
+                    updates.append(PC.ObjectUpdate(kind='modify', obj=obj,
+                                                   changeSet=changes))
+        for moid in set(seen) - set(current):
+            updates.append(PC.ObjectUpdate(kind='leave', obj=seen[moid],
+                                           changeSet=[]))
+        self.filters[filter_._moId] = (spec, current)
+        if updates:
+            return PC.FilterUpdate(filter=filter_, objectSet=updates)
+
+    def _do_WaitForUpdatesEx(self, mo, version, options):
+        max_wait = options.maxWaitSeconds if options else None
+        deadline = None if max_wait is None else time.time() + max_wait
+        since = int(version) if version else 0
+        with self.lock:
+            while True:
+                if mo._moId in self.cancelled:
+                    self.cancelled.discard(mo._moId)
+                    raise vmodl.fault.RequestCanceled()
+                filter_updates = []
+                for filter_ in self.collectors.get(mo._moId, []):
+                    update = self._filter_update(filter_, since)
+                    if update:
+                        filter_updates.append(update)
+                if filter_updates:
+                    return PC.UpdateSet(version=str(self.seq),
+                                        filterSet=filter_updates)
+                since = self.seq
+                remaining = None if deadline is None \
+                    else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.changed.wait(remaining if remaining is not None
+                                  else 1.0)
+
+    def _do_CancelWaitForUpdates(self, mo):
+        with self.lock:
+            self.cancelled.add(mo._moId)
+            self.changed.notify_all()
+
+    def _do_WaitForUpdates(self, mo, version):
+        return self._do_WaitForUpdatesEx(mo, version, None)
+
+    # Tasks
+
+    def _start_task(self, entity, action=None, result=None):
+        task = self.add(vim.Task, 'task')
+        if not isinstance(entity, vim.ManagedEntity):
+            entity = None
+        info = vim.TaskInfo(key=task._moId, task=task, entity=entity,
+                            state='running', progress=0,
+                            descriptionId=action.__name__ if action else '')
+        self.update(task, info=info)
+
+        def complete():
+            try:
+                value = action() if action else result
+                done = vim.TaskInfo(key=info.key, task=task, entity=entity,
+                                    state='success', progress=100,
+                                    result=value,
+                                    descriptionId=info.descriptionId)
+            except vmodl.MethodFault as e:
+                done = vim.TaskInfo(key=info.key, task=task, entity=entity,
+                                    state='error', error=e,
+                                    descriptionId=info.descriptionId)
+            self.update(task, info=done)
+
+        if self.task_latency:
+            timer = threading.Timer(self.task_latency, complete)
+            timer.daemon = True
+            timer.start()
+        else:
+            complete()
+        return task
+
+    def _set_power_state(self, mo, state):
+        def power():
+            host = self.get_property(mo, 'runtime.host')
+            runtime = vim.vm.RuntimeInfo(powerState=state, host=host)
+            guest = self.get_property(mo, 'summary.guest')
+            summary = vim.vm.Summary(guest=guest, runtime=runtime)
+            self.update(mo, runtime=runtime, summary=summary)
+        return self._start_task(mo, power)
+
+    def _do_PowerOnVM_Task(self, mo, host=None):
+        return self._set_power_state(mo, 'poweredOn')
+
+    def _do_PowerOffVM_Task(self, mo):
+        return self._set_power_state(mo, 'poweredOff')
+
+    def _do_PowerOnVApp_Task(self, mo):
+        def power():
+            summary = self.get_property(mo, 'summary')
+            summary.vAppState = 'started'
+            self.update(mo, summary=summary)
+        return self._start_task(mo, power)
+
+    def _do_PowerOffVApp_Task(self, mo, force):
+        def power():
+            summary = self.get_property(mo, 'summary')
+            summary.vAppState = 'stopped'
+            self.update(mo, summary=summary)
+        return self._start_task(mo, power)
+
+    def _do_Destroy_Task(self, mo):
+        def destroy():
+            if mo._moId not in self.props:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            if isinstance(mo, vim.VirtualMachine) and self.get_property(
+                    mo, 'runtime.powerState') == 'poweredOn':
+                raise vim.fault.InvalidPowerState(
+                    existingState='poweredOn')
+            self.remove(mo)
+        return self._start_task(mo, destroy)
+
+    def _do_Rename_Task(self, mo, newName):
+        return self._start_task(mo, lambda: self.update(mo, name=newName))
+
+    def _do_ReconfigVM_Task(self, mo, spec):
+        def reconfig():
+            config = self.get_property(mo, 'config')
+            for change in spec.deviceChange or []:
+                config.hardware.device.append(change.device)
+            self.update(mo, config=config)
+        return self._start_task(mo, reconfig)
+
+    def _do_AddHost_Task(self, mo, spec, asConnected, resourcePool=None,
+                         license=None):
+        return self._start_task(mo, lambda: add_host(self, mo,
+                                                     spec.hostName))
+
+    def _do_ReconfigureCluster_Task(self, mo, spec, modify):
+        return self._start_task(mo)
+
+    def _do_CreateDVS_Task(self, mo, spec):
+        def create():
+            return add_dvs(self, mo, spec.configSpec.name)
+        return self._start_task(mo, create)
+
+    def _do_GenerateLogBundles_Task(self, mo, includeDefault, host=None,
+                                    supportOptions=None):
+        def generate():
+            systems = list(host or [])
+            if includeDefault:
+                systems.insert(0, None)
+            return vim.DiagnosticManager.BundleInfo.Array([
+                vim.DiagnosticManager.BundleInfo(
+                    system=h, url=self.bundle_url % (
+                        h._moId if h else 'vc'))
+                for h in systems])
+        return self._start_task(mo, generate)
+
+    # Datacenter and Folder
+
+    def _do_CreateDatacenter(self, mo, name):
+        return add_datacenter(self, mo, name)
+
+    def _do_CreateClusterEx(self, mo, name, spec):
+        return add_cluster(self, mo, name)
+
+    # OptionManager
+
+    def _do_QueryOptions(self, mo, name=None):
+        settings = self.get_property(mo, 'setting') or []
+        return [s for s in settings if name is None or s.key == name]
+
+    def _do_UpdateOptions(self, mo, changedValue):
+        settings = dict((s.key, s) for s in
+                        self.get_property(mo, 'setting') or [])
+        for value in changedValue:
+            settings[value.key] = value
+        self.update(mo, setting=settings.values())
+
+
+def add_datacenter(stub, folder, name):
+    dc = stub.add(vim.Datacenter, 'datacenter', folder, name=name)
+    for attr, prefix in (('vmFolder', 'group-v'), ('hostFolder', 'group-h'),
+                         ('datastoreFolder', 'group-s'),
+                         ('networkFolder', 'group-n')):
+        sub = stub.add(vim.Folder, prefix, dc, name=attr[:-6])
+        stub.update(dc, **{attr: sub})
+    return dc
+
+
+def add_cluster(stub, host_folder, name):
+    return stub.add(vim.ClusterComputeResource, 'domain-c', host_folder,
+                    name=name)
+
+
+def add_host(stub, cluster, name):
+    return stub.add(vim.HostSystem, 'host', cluster, name=name, vm=[])
+
+
+def add_dvs(stub, network_folder, name):
+    return stub.add(vim.VmwareDistributedVirtualSwitch, 'dvs',
+                    network_folder, name=name,
+                    uuid='50 %s' % stub.new_moid('uuid'))
+
+
+def add_portgroup(stub, network_folder, dvs, name):
+    config = vim.dvs.DistributedVirtualPortgroup.ConfigInfo(
+        distributedVirtualSwitch=dvs)
+    return stub.add(vim.dvs.DistributedVirtualPortgroup, 'dvportgroup',
+                    network_folder, name=name, config=config,
+                    key=stub.new_moid('dvportgroup-key'))
+
+
+def add_vm(stub, vm_folder, name, ip=None, power_state='poweredOn',
+           host=None, tags=()):
+    config = vim.vm.ConfigInfo(hardware=vim.vm.VirtualHardware(device=[]))
+    runtime = vim.vm.RuntimeInfo(powerState=power_state, host=host)
+    summary = vim.vm.Summary(guest=vim.vm.Summary.GuestSummary(ipAddress=ip),
+                             runtime=runtime)
+    vm = stub.add(vim.VirtualMachine, 'vm', vm_folder, name=name,
+                  config=config, summary=summary, runtime=runtime,
+                  tag=vim.Tag.Array([vim.Tag(key=t) for t in tags]))
+    if host is not None:
+        with stub.lock:
+            stub.props[host._moId]['vm'].append(vm)
+    return vm
+
+
+def add_vapp(stub, vm_folder, name, version='3.0.0.0'):
+    summary = vim.VirtualApp.Summary(
+        vAppState='started',
+        product=vim.vApp.ProductInfo(key=0, fullVersion=version))
+    return stub.add(vim.VirtualApp, 'resgroup-v', vm_folder, name=name,
+                    summary=summary)
+
+
+def create_service_instance(datacenters=1, clusters=4, hosts_per_cluster=8,
+                            vms=1000, datastores=4, portgroups=4, vapps=1,
+                            latency=0.0, task_latency=0.0):
+    """Build a fake ServiceInstance populated with a generated inventory.
+
+    Clusters, hosts, VMs, datastores, portgroups and vApps are created in
+    every datacenter. Names are deterministic, e.g. ``dc-0``,
+    ``cluster-0-3``, ``host-0-3-7``, ``vm-00042``, ``datastore-0-1``,
+    ``dvpg-0-2`` and ``VMware-OpenStack-0-1.0.0.0``.
+
+    :returns: vim.ServiceInstance backed by a FakeStub.
+    """
+    stub = FakeStub(latency=latency, task_latency=task_latency)
+    root = stub.add(vim.Folder, 'group-d', name='Datacenters')
+    content = vim.ServiceInstanceContent(
+        rootFolder=root,
+        propertyCollector=stub.add(vim.PropertyCollector,
+                                   'propertyCollector'),
+        viewManager=stub.add(vim.view.ViewManager, 'ViewManager'),
+        sessionManager=stub.add(vim.SessionManager, 'SessionManager'),
+        diagnosticManager=stub.add(vim.DiagnosticManager,
+                                   'DiagMgr'),
+        setting=stub.add(vim.option.OptionManager, 'VpxSettings',
+                         setting=[]))
+    stub.collectors[content.propertyCollector._moId] = []
+    stub.content = content
+    stub.root = root
+    vm_names = itertools.count()
+    for d in range(datacenters):
+        dc = add_datacenter(stub, root, 'dc-%d' % d)
+        props = stub.props[dc._moId]
+        hosts = []
+        for c in range(clusters):
+            cluster = add_cluster(stub, props['hostFolder'],
+                                  'cluster-%d-%d' % (d, c))
+            for h in range(hosts_per_cluster):
+                hosts.append(add_host(stub, cluster,
+                                      'host-%d-%d-%d' % (d, c, h)))
+        for s in range(datastores):
+            stub.add(vim.Datastore, 'datastore', props['datastoreFolder'],
+                     name='datastore-%d-%d' % (d, s))
+        dvs = add_dvs(stub, props['networkFolder'], 'dvs-%d' % d)
+        for p in range(portgroups):
+            add_portgroup(stub, props['networkFolder'], dvs,
+                          'dvpg-%d-%d' % (d, p))
+        for _ in range(vms // datacenters):
+            n = next(vm_names)
+            add_vm(stub, props['vmFolder'], 'vm-%05d' % n,
+                   ip='10.%d.%d.%d' % (n >> 16, (n >> 8) & 255, n & 255),
+                   host=hosts[n % len(hosts)] if hosts else None)
+        for v in range(vapps):
+            add_vapp(stub, props['vmFolder'],
+                     'VMware-OpenStack-%d-%d.0.0.0' % (d, v))
+    si = vim.ServiceInstance('ServiceInstance', stub)
+    with stub.lock:
+        stub.props[si._moId] = {'content': content}
+        stub.mors[si._moId] = si
+        stub.children[si._moId] = []
+    LOG.debug('Created fake inventory with %d objects', len(stub.props))
+    return si
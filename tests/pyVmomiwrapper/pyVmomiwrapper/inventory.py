@@ -0,0 +1,401 @@
+"""Bulk inventory retrieval through the PropertyCollector"""
+
+import logging
+import re
+import threading
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_WAIT = 30
+BASE_PROPERTIES = ['name', 'parent']
+
+
+class InventoryItem(object):
+    """A managed entity together with the properties retrieved for it."""
+
+    def __init__(self, mor, props):
+        self.mor = mor
+        self.props = props
+
+    @property
+    def name(self):
+        return self.props.get('name')
+
+    @property
+    def moid(self):
+        return self.mor._moId
+
+    @property
+    def parent(self):
+        return self.props.get('parent')
+
+
+def _compile(pattern):
+    if isinstance(pattern, basestring):
+        return re.compile(pattern)
+    return pattern
+
+
+class InventorySnapshot(object):
+    """Point in time view of all entities of a type under a container.
+
+    Name and moid indexes are built on first use.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self._by_moid = None
+        self._by_name = None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, moid):
+        """Return the item with the given moid. None if not found."""
+        if self._by_moid is None:
+            self._by_moid = dict((item.moid, item) for item in self.items)
+        return self._by_moid.get(moid)
+
+    def find_by_name(self, name):
+        """Return items with exactly the given name."""
+        if self._by_name is None:
+            self._by_name = {}
+            for item in self.items:
+                self._by_name.setdefault(item.name, []).append(item)
+        return list(self._by_name.get(name, []))
+
+    def find_by_regex(self, pattern):
+        """Return items whose name matches a regular expression.
+
+        :param pattern: regular expression string or compiled pattern.
+        """
+        regex = _compile(pattern)
+        return [item for item in self.items
+                if item.name is not None and regex.match(item.name)]
+
+
+def _build_filter_spec(view, vim_type, path_set, extra_props=None):
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseView',
+        path='view',
+        skip=False,
+        type=vim.view.ContainerView)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(
+        obj=view,
+        skip=True,
+        selectSet=[traversal])
+    prop_specs = [vmodl.query.PropertyCollector.PropertySpec(
+        type=vim_type,
+        pathSet=path_set,
+        all=False)]
+    for extra_type, extra_path_set in (extra_props or {}).items():
+        prop_specs.append(vmodl.query.PropertyCollector.PropertySpec(
+            type=extra_type,
+            pathSet=extra_path_set,
+            all=False))
+    return vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[obj_spec],
+        propSet=prop_specs)
+
+
+def retrieve_inventory(si, container, vim_type, props=None,
+                       page_size=DEFAULT_PAGE_SIZE):
+    """Retrieve all entities of a type under a container in one pass.
+
+    Name, parent and the requested properties of every entity are
+    collected with RetrievePropertiesEx, following the continuation token
+    until all pages are read.
+
+    :param si: ServiceInstance to use.
+    :param container: container managed object reference to search under.
+    :param vim_type: vim managed entity type, e.g. vim.VirtualMachine.
+    :param props: list of extra property paths to collect.
+    :param page_size: maximum number of objects returned per page.
+    :returns: InventorySnapshot instance.
+    """
+    path_set = list(BASE_PROPERTIES)
+    for prop in props or []:
+        if prop not in path_set:
+            path_set.append(prop)
+
+    content = si.RetrieveContent()
+    view = content.viewManager.CreateContainerView(
+        container=container,
+        type=[vim_type],
+        recursive=True)
+    items = []
+    try:
+        pc = content.propertyCollector
+        filter_spec = _build_filter_spec(view, vim_type, path_set)
+        options = vmodl.query.PropertyCollector.RetrieveOptions(
+            maxObjects=page_size)
+        result = pc.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            for obj in result.objects:
+                props_ = dict((p.name, p.val) for p in obj.propSet)
+                items.append(InventoryItem(obj.obj, props_))
+            if not result.token:
+                break
+            result = pc.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        view.Destroy()
+    LOG.debug('Retrieved %d %s objects', len(items), vim_type.__name__)
+    return InventorySnapshot(items)
+
+
+def retrieve_properties(si, mors, path_set, page_size=DEFAULT_PAGE_SIZE):
+    """Retrieve properties of a list of managed objects in one pass.
+
+    :param si: ServiceInstance to use.
+    :param mors: managed object references, may be of different types.
+    :param path_set: list of property paths to collect.
+    :param page_size: maximum number of objects returned per page.
+    :returns: dict mapping moid to a dict of property path to value. Paths
+              which are unset on an object map to None.
+    """
+    if not mors:
+        return {}
+    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=mor,
+                                                           skip=False)
+                 for mor in mors]
+    prop_specs = [vmodl.query.PropertyCollector.PropertySpec(
+        type=vim_type,
+        pathSet=path_set,
+        all=False) for vim_type in set(type(mor) for mor in mors)]
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=obj_specs,
+        propSet=prop_specs)
+    options = vmodl.query.PropertyCollector.RetrieveOptions(
+        maxObjects=page_size)
+    pc = si.RetrieveContent().propertyCollector
+    found = {}
+    result = pc.RetrievePropertiesEx([filter_spec], options)
+    while result:
+        for obj in result.objects:
+            for missing in obj.missingSet or []:
+                if missing.fault:
+                    raise missing.fault
+            props = dict.fromkeys(path_set)
+            props.update((p.name, p.val) for p in obj.propSet)
+            found[obj.obj._moId] = props
+        if not result.token:
+            break
+        result = pc.ContinueRetrievePropertiesEx(result.token)
+    return found
+
+
+class InventoryCache(object):
+    """Long-lived inventory of all managed entities kept current in memory.
+
+    The cache is seeded with one WaitForUpdatesEx call on a private
+    PropertyCollector and then follows the update stream on a background
+    thread. Entities that enter the inventory are added, renamed or moved
+    entities are updated and destroyed entities are dropped, so lookups
+    never need a round-trip to vCenter. If the update stream fails the
+    cache marks itself inactive and callers should fall back to live
+    retrieval.
+    """
+
+    # VMs in a vApp have no parent, parentVApp links them into the tree.
+    EXTRA_PROPERTIES = {vim.VirtualMachine: ['parentVApp']}
+
+    def __init__(self, si, max_wait=DEFAULT_MAX_WAIT):
+        """
+        :param si: ServiceInstance to use.
+        :param max_wait: seconds each WaitForUpdatesEx call may block.
+        """
+        self.si = si
+        self.max_wait = max_wait
+        self.lock = threading.RLock()
+        self.items = {}
+        self.by_name = {}
+        self.types = set()
+        self.version = None
+        self.active = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pc = None
+        self._view = None
+
+    def start(self):
+        """Seed the cache and start following inventory updates."""
+        content = self.si.RetrieveContent()
+        self._pc = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateContainerView(
+            container=content.rootFolder,
+            type=[vim.ManagedEntity],
+            recursive=True)
+        filter_spec = _build_filter_spec(self._view, vim.ManagedEntity,
+                                         BASE_PROPERTIES,
+                                         self.EXTRA_PROPERTIES)
+        self._pc.CreateFilter(filter_spec, True)
+        update = self._wait_for_updates()
+        while update is not None:
+            self._apply(update)
+            if not update.truncated:
+                break
+            update = self._wait_for_updates()
+        self.active = True
+        LOG.debug('Inventory cache seeded with %d entities', len(self.items))
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._follow_updates,
+                                        name='inventory-cache')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop following updates and release server side objects."""
+        self.active = False
+        self._stopped.set()
+        if self._pc is not None:
+            try:
+                self._pc.CancelWaitForUpdates()
+            except Exception:
+                LOG.debug('Cancel WaitForUpdatesEx failed', exc_info=True)
+        if self._thread is not None:
+            self._thread.join(self.max_wait)
+            self._thread = None
+        try:
+            if self._pc is not None:
+                self._pc.Destroy()
+            if self._view is not None:
+                self._view.Destroy()
+        except Exception:
+            LOG.debug('Destroy inventory cache collector failed',
+                      exc_info=True)
+        self._pc = None
+        self._view = None
+
+    def _wait_for_updates(self):
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=self.max_wait)
+        return self._pc.WaitForUpdatesEx(self.version, options)
+
+    def _follow_updates(self):
+        while not self._stopped.is_set():
+            try:
+                update = self._wait_for_updates()
+            except Exception:
+                if not self._stopped.is_set():
+                    LOG.exception('Inventory cache lost its update stream.')
+                self.active = False
+                return
+            if update is not None:
+                self._apply(update)
+
+    def _apply(self, update):
+        with self.lock:
+            for filter_set in update.filterSet:
+                for obj_set in filter_set.objectSet:
+                    self._apply_object_update(obj_set)
+            self.version = update.version
+
+    def _index(self, item):
+        key = (type(item.mor), item.name)
+        self.types.add(key[0])
+        self.by_name.setdefault(key, {})[item.moid] = item
+
+    def _unindex(self, item):
+        key = (type(item.mor), item.name)
+        bucket = self.by_name.get(key)
+        if bucket is not None:
+            bucket.pop(item.moid, None)
+            if not bucket:
+                del self.by_name[key]
+
+    def _apply_object_update(self, obj_set):
+        moid = obj_set.obj._moId
+        item = self.items.get(moid)
+        if item is not None:
+            self._unindex(item)
+        if obj_set.kind == 'leave':
+            self.items.pop(moid, None)
+            return
+        if item is None:
+            item = InventoryItem(obj_set.obj, {})
+            self.items[moid] = item
+        for change in obj_set.changeSet:
+            if change.op in ('remove', 'indirectRemove'):
+                item.props.pop(change.name, None)
+            else:
+                item.props[change.name] = change.val
+        self._index(item)
+
+    def _container_of(self, item):
+        parent = item.parent
+        if parent is None:
+            parent = item.props.get('parentVApp')
+        return parent
+
+    def _is_under(self, item, container):
+        parent = self._container_of(item)
+        while parent is not None:
+            if parent._moId == container._moId:
+                return True
+            parent_item = self.items.get(parent._moId)
+            if parent_item is None:
+                return False
+            parent = self._container_of(parent_item)
+        return False
+
+    def snapshot(self, vim_type, container=None):
+        """Return cached entities of a type, optionally under a container.
+
+        :param vim_type: vim managed entity type, e.g. vim.VirtualMachine.
+        :param container: only include descendants of this container.
+        :returns: InventorySnapshot instance.
+        """
+        with self.lock:
+            items = [i for i in self.items.values()
+                     if isinstance(i.mor, vim_type) and
+                     (container is None or self._is_under(i, container))]
+        return InventorySnapshot(items)
+
+    def get(self, moid):
+        """Return the cached item with the given moid. None if not found."""
+        with self.lock:
+            return self.items.get(moid)
+
+    def _buckets(self, vim_type):
+        for (cls, name), bucket in self.by_name.items():
+            if issubclass(cls, vim_type):
+                yield name, bucket
+
+    def find_by_name(self, vim_type, name, container=None):
+        """Return cached items of a type with exactly the given name.
+
+        :param vim_type: vim managed entity type, e.g. vim.VirtualMachine.
+        :param name: entity name.
+        :param container: only include descendants of this container.
+        """
+        with self.lock:
+            found = []
+            for cls in self.types:
+                if issubclass(cls, vim_type):
+                    found.extend(self.by_name.get((cls, name), {}).values())
+            return [item for item in found
+                    if container is None or self._is_under(item, container)]
+
+    def find_by_regex(self, vim_type, pattern, container=None):
+        """Return cached items of a type whose name matches a regex.
+
+        :param vim_type: vim managed entity type, e.g. vim.VirtualMachine.
+        :param pattern: regular expression string or compiled pattern.
+        :param container: only include descendants of this container.
+        """
+        regex = _compile(pattern)
+        with self.lock:
+            found = []
+            for name, bucket in self._buckets(vim_type):
+                if name is not None and regex.match(name):
+                    found.extend(bucket.values())
+            return [item for item in found
+                    if container is None or self._is_under(item, container)]
@@ -0,0 +1,221 @@
+"""Opt-in latency and SOAP traffic instrumentation
+
+Call enable() before connecting, or set PYVMOMIWRAPPER_METRICS to a file
+path to enable it on import and dump the numbers there at exit. Every
+public function of vmwareapi and task and every public method of the
+vmwareapi classes is then timed. SOAP calls, bytes on the wire and session
+re-logins are charged to all instrumented calls running on the same thread,
+so nested calls are included in the numbers of their callers. Traffic
+outside instrumented calls, e.g. of the inventory cache thread, is charged
+to UNATTRIBUTED.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+ENV_VAR = 'PYVMOMIWRAPPER_METRICS'
+UNATTRIBUTED = '(unattributed)'
+
+
+class MethodStats(object):
+    """Accumulated numbers of one instrumented method."""
+
+    FIELDS = ('calls', 'errors', 'wall_time', 'max_wall_time', 'soap_calls',
+              'bytes_sent', 'bytes_received', 'relogins')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+
+class Registry(object):
+    """In-process store of MethodStats keyed by method name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self._local = threading.local()
+
+    def _frames(self):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def _get(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = MethodStats()
+        return stats
+
+    def begin(self, name):
+        frame = {'name': name, 'start': time.time(), 'soap_calls': 0,
+                 'bytes_sent': 0, 'bytes_received': 0, 'relogins': 0}
+        self._frames().append(frame)
+        return frame
+
+    def end(self, frame, failed=False):
+        elapsed = time.time() - frame['start']
+        frames = self._frames()
+        frames.remove(frame)
+        with self.lock:
+            stats = self._get(frame['name'])
+            stats.calls += 1
+            stats.errors += int(failed)
+            stats.wall_time += elapsed
+            stats.max_wall_time = max(stats.max_wall_time, elapsed)
+            for field in ('soap_calls', 'bytes_sent', 'bytes_received',
+                          'relogins'):
+                setattr(stats, field, getattr(stats, field) + frame[field])
+
+    def count(self, field, value=1):
+        """Charge value to all instrumented calls active on this thread."""
+        frames = self._frames()
+        if frames:
+            for frame in frames:
+                frame[field] += value
+        else:
+            with self.lock:
+                stats = self._get(UNATTRIBUTED)
+                setattr(stats, field, getattr(stats, field) + value)
+
+    def snapshot(self):
+        """Return {method name: {field: value}} of everything recorded."""
+        with self.lock:
+            return dict((name, stats.to_dict())
+                        for name, stats in self.stats.items())
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def dump(self, path):
+        """Write the snapshot as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        LOG.info('Wrote pyVmomiwrapper metrics to %s', path)
+
+
+registry = Registry()
+_enabled = False
+_enable_lock = threading.Lock()
+
+
+def is_enabled():
+    return _enabled
+
+
+def record_relogin():
+    if _enabled:
+        registry.count('relogins')
+
+
+def _wrap(name, func):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        frame = registry.begin(name)
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            registry.end(frame, failed)
+    timed._metrics_wrapped = func
+    return timed
+
+
+def _instrument_module(module, prefix):
+    for attr, value in vars(module).items():
+        if attr.startswith('_') or getattr(value, '_metrics_wrapped', None):
+            continue
+        if inspect.isfunction(value) and value.__module__ == module.__name__:
+            setattr(module, attr, _wrap('%s.%s' % (prefix, attr), value))
+        elif inspect.isclass(value) and value.__module__ == module.__name__:
+            for name, member in vars(value).items():
+                if name.startswith('_') or not inspect.isfunction(member) or \
+                        getattr(member, '_metrics_wrapped', None):
+                    continue
+                setattr(value, name,
+                        _wrap('%s.%s' % (attr, name), member))
+
+
+class _CountingResponse(object):
+
+    def __init__(self, resp):
+        self._resp = resp
+
+    def read(self, *args):
+        data = self._resp.read(*args)
+        registry.count('bytes_received', len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+
+class _CountingConnection(object):
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def getresponse(self, *args, **kwargs):
+        return _CountingResponse(self._conn.getresponse(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument_stub(stub):
+    """Count SOAP calls and bytes of a pyVmomi SoapStubAdapter."""
+    if not _enabled or getattr(stub, '_metrics_instrumented', False):
+        return stub
+
+    def count_request(req):
+        registry.count('soap_calls')
+        registry.count('bytes_sent', len(req))
+        return req
+
+    get_connection = stub.GetConnection
+    return_connection = stub.ReturnConnection
+    stub.requestModifierList.append(count_request)
+    stub.GetConnection = lambda: _CountingConnection(get_connection())
+    stub.ReturnConnection = lambda conn: return_connection(
+        getattr(conn, '_conn', conn))
+    stub._metrics_instrumented = True
+    return stub
+
+
+def enable(dump_path=None):
+    """Instrument pyVmomiwrapper.
+
+    :param dump_path: write the registry as JSON to this path at exit.
+    """
+    global _enabled
+    import task
+    import vmwareapi
+    with _enable_lock:
+        if not _enabled:
+            _enabled = True
+            _instrument_module(vmwareapi, 'vmwareapi')
+            _instrument_module(task, 'task')
+        if dump_path:
+            atexit.register(registry.dump, dump_path)
+
+
+def enable_from_env():
+    path = os.environ.get(ENV_VAR)
+    if path:
+        enable(path)
@@ -0,0 +1,180 @@
+"""Process-wide pool of reusable vCenter sessions"""
+
+import atexit
+import logging
+import ssl
+import threading
+import time
+
+import pyVmomi
+from pyVim.connect import VimSessionOrientedStub
+from pyVmomi import vim
+
+import metrics
+import task
+
+
+LOG = logging.getLogger(__name__)
+
+# Idle seconds after which a pooled session is checked on checkout
+KEEPALIVE_INTERVAL = 300
+LOGIN_RETRY_COUNT = 3
+LOGIN_RETRY_DELAY = 1
+# HTTP connections kept open per stub, i.e. SOAP calls that run in parallel
+POOL_SIZE = 5
+
+
+def create_stub(host, verify=True, pool_size=POOL_SIZE):
+    """Create a thread safe SOAP stub.
+
+    Concurrent calls each check out one of pool_size kept-alive HTTP
+    connections. Calls beyond pool_size open short-lived extra connections.
+    """
+    if verify:
+        context = None
+    else:
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.verify_mode = ssl.CERT_NONE
+
+    stub = pyVmomi.SoapStubAdapter(
+        host=host,
+        port=443,
+        version='vim.version.version6',
+        path='/sdk',
+        sslContext=context,
+        poolSize=pool_size)
+    return metrics.instrument_stub(stub)
+
+
+class PooledSession(object):
+    """A logged in ServiceInstance shared by all users of (host, user)."""
+
+    def __init__(self, host, user, password, soap_stub):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.session_key = None
+        self.relogins = 0
+        self.users = 0
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        stub = VimSessionOrientedStub(
+            soap_stub, self._login, retryDelay=LOGIN_RETRY_DELAY,
+            retryCount=LOGIN_RETRY_COUNT)
+        self.si = vim.ServiceInstance('ServiceInstance', stub)
+
+    def _login(self, soap_stub):
+        si = vim.ServiceInstance('ServiceInstance', soap_stub)
+        session_manager = si.RetrieveContent().sessionManager
+        session = session_manager.Login(self.user, self.password, None)
+        if self.session_key is not None:
+            self.relogins += 1
+            metrics.record_relogin()
+            LOG.info('Logged in to %s again as %s', self.host, self.user)
+        self.session_key = session.key
+
+    def is_active(self):
+        """Check the session with SessionIsActive, which also keeps it alive.
+
+        An expired session is logged in again transparently by the stub.
+        """
+        session_manager = self.si.content.sessionManager
+        if self.session_key is None:
+            return session_manager.currentSession is not None
+        try:
+            return session_manager.SessionIsActive(self.session_key,
+                                                   self.user)
+        except vim.fault.NoPermission:
+            # Validating sessions needs Sessions.ValidateSession privilege
+            return session_manager.currentSession is not None
+
+    def keepalive(self, interval=KEEPALIVE_INTERVAL):
+        with self.lock:
+            if time.time() - self.last_used > interval:
+                key = self.session_key
+                # A NotAuthenticated answer already triggers a new login
+                if not self.is_active() and key == self.session_key:
+                    LOG.debug('Session of %s on %s expired', self.user,
+                              self.host)
+                    self.si._stub._SetStateUnauthenticated()
+            self.last_used = time.time()
+
+    def logout(self):
+        task.StopTaskMonitor(self.si)
+        try:
+            self.si.content.sessionManager.Logout()
+        except Exception:
+            LOG.debug('Logout from %s failed', self.host, exc_info=True)
+
+
+class SessionPool(object):
+    """Share one logged in session per (host, user) across the process.
+
+    Sessions are created on first checkout, verified with SessionIsActive
+    when they were idle for more than keepalive_interval seconds and logged
+    in again transparently when vCenter answers NotAuthenticated.
+    Checkout and release are thread safe. Sessions stay open until
+    close_all() is called, at the latest when the process exits.
+    """
+
+    def __init__(self, keepalive_interval=KEEPALIVE_INTERVAL,
+                 stub_factory=create_stub):
+        self.keepalive_interval = keepalive_interval
+        self.stub_factory = stub_factory
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def acquire(self, host, user, password, verify=True,
+                pool_size=POOL_SIZE):
+        """Check out the ServiceInstance of (host, user).
+
+        :param pool_size: HTTP connections of the stub if a new session
+                          has to be created.
+        :returns: vim.ServiceInstance with a live session.
+        """
+        key = (host, user)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None or session.password != password:
+                soap_stub = self.stub_factory(host, verify, pool_size)
+                session = PooledSession(host, user, password, soap_stub)
+                self.sessions[key] = session
+            session.users += 1
+        session.keepalive(self.keepalive_interval)
+        return session.si
+
+    def release(self, si):
+        """Return a ServiceInstance checked out with acquire()."""
+        with self.lock:
+            for session in self.sessions.values():
+                if session.si is si:
+                    session.users -= 1
+                    session.last_used = time.time()
+                    return
+
+    def get_session(self, si):
+        with self.lock:
+            for session in self.sessions.values():
+                if session.si is si:
+                    return session
+
+    def close_all(self):
+        """Log out all pooled sessions."""
+        with self.lock:
+            sessions, self.sessions = self.sessions.values(), {}
+        for session in sessions:
+            session.logout()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide SessionPool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool()
+            atexit.register(_pool.close_all)
+        return _pool
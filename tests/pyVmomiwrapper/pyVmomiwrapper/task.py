@@ -12,11 +12,23 @@ This module provies synchronization of client/server operations since
 many vIM operations return 'tasks' which can have varying completion
 times.
 """
+import logging
+import threading
+import time
+import weakref
+
 from pyVmomi import vmodl, vim
 
 
 __author__ = 'VMware, Inc'
 
+LOG = logging.getLogger(__name__)
+
+# Longest time in seconds a single WaitForUpdatesEx call blocks on the server
+DEFAULT_MAX_WAIT = 60
+# Completed tasks left in the view of a TaskMonitor before removing them
+MAX_DONE_IN_VIEW = 100
+
 
 #
 # @brief Exception class to represent when task is blocked (e.g.:
@@ -30,6 +42,40 @@ class TaskBlocked(Exception):
     pass
 
 
+#
+# @brief Exception class to represent when tasks did not complete in time.
+#
+class TaskTimeout(Exception):
+    """
+    Exception class to represent when tasks did not complete in time.
+    """
+    pass
+
+
+#
+# @brief Final outcome of a task tracked by WaitForAllTasks.
+#
+class TaskResult(object):
+    """
+    Final outcome of a task tracked by WaitForAllTasks. state is one of
+    vim.TaskInfo.State values or TaskResult.TIMEOUT.
+    """
+    TIMEOUT = 'timeout'
+
+    def __init__(self, task, state, result=None, error=None):
+        self.task = task
+        self.state = state
+        self.result = result
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.state == vim.TaskInfo.State.success
+
+    def __repr__(self):
+        return '<TaskResult %s: %s>' % (self.task, self.state)
+
+
 #
 # TaskUpdates
 #     verbose information about task progress
@@ -76,7 +122,8 @@ def WaitForTask(task,
                 si,
                 raiseOnError=True,
                 pc=None,
-                onProgressUpdate=None):
+                onProgressUpdate=None,
+                maxWaitSeconds=DEFAULT_MAX_WAIT):
     """
     Wait for task to complete.
     @type  si                : ManagedObjectReference to a ServiceInstance.
@@ -85,8 +132,9 @@ def WaitForTask(task,
     @param raiseOnError      : Any exception thrown is thrown up to the caller
                               if raiseOnError is set to true.
     @type  pc                : ManagedObjectReference to a PropertyCollector.
-    @param pc                : Property collector to use. If None, get it from
-                              the ServiceInstance.
+    @param pc                : Property collector to use. If None, a private
+                              one is created for this wait and destroyed
+                              afterwards.
     @type  onProgressUpdate  : callable
     @param onProgressUpdate  : Callable to call with task progress updates.
 
@@ -94,29 +142,46 @@ def WaitForTask(task,
 
             def OnTaskProgressUpdate(task, percentDone):
                 print 'Task %s is %d%% complete.' % (task, percentDone)
+    @type  maxWaitSeconds    : int
+    @param maxWaitSeconds    : Longest time a single WaitForUpdatesEx call
+                              blocks on the server.
+
+    Task state, progress and error are taken from the property collector
+    updates, the task object is never read directly while waiting.
     """
-    if pc is None:
-        pc = si.content.propertyCollector
+    ownCollector = pc is None
+    if ownCollector:
+        pc = CreateCollector(si)
 
     progressUpdater = ProgressUpdater(task, onProgressUpdate)
     progressUpdater.Update('created')
 
-    filter = CreateFilter(pc, task)
-
-    version, state = None, None
-    # Loop looking for updates till the state moves to a completed state.
-    while state not in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
-        version, state = GetTaskStatus(task, version, pc)
-        progressUpdater.UpdateIfNeeded()
+    try:
+        filter = CreateFilter(pc, task)
+    except Exception:
+        if ownCollector:
+            pc.Destroy()
+        raise
 
-    filter.Destroy()
+    try:
+        version, info = None, None
+        # Loop looking for updates till the state moves to a completed state.
+        while info is None or info.state not in (vim.TaskInfo.State.success,
+                                                 vim.TaskInfo.State.error):
+            version, info = WaitForTaskInfo(task, version, pc, info,
+                                            maxWaitSeconds, filter)
+            if info is not None:
+                progressUpdater.UpdateIfNeeded(info)
+    finally:
+        DestroyFilter(pc, filter, ownCollector)
 
+    state = info.state
     if state == "error":
-        progressUpdater.Update('error: %s' % str(task.info.error))
+        progressUpdater.Update('error: %s' % str(info.error))
         if raiseOnError:
-            raise task.info.error
+            raise info.error
         else:
-            print "Task reported error: " + str(task.info.error)
+            print "Task reported error: " + str(info.error)
     else:
         progressUpdater.Update('completed')
     return state
@@ -125,8 +190,8 @@ def WaitForTask(task,
 # Wait for multiple tasks to complete
 #  See WaitForTask for detail
 #
-#  Difference: WaitForTasks won't return the state of tasks. User can check
-#  tasks state directly with task.info.state
+#  Difference: WaitForTasks won't return the state of tasks. Use
+#  WaitForAllTasks to get a TaskResult for every task.
 #
 #  TODO: Did not check for question pending
 def WaitForTasks(tasks,
@@ -141,72 +206,202 @@ def WaitForTasks(tasks,
     if not tasks:
         return
 
-    if pc is None:
-        pc = si.content.propertyCollector
+    results = WaitForAllTasks(tasks, si, pc, onProgressUpdate,
+                              raiseOnError=raiseOnError)
+    for result in results.values():
+        if result.state == vim.TaskInfo.State.error:
+            print "Task %s reported error: %s" % (result.task,
+                                                  str(result.error))
+    return
+
+
+#
+# @param tasks [in] tasks to wait for, all tracked through one filter.
+# @param timeout [in] seconds to wait for all tasks. None waits forever.
+# @param raiseOnError [in] raise the error of the first failed task instead
+#   of returning it in the result map.
+#
+# @return dict mapping every task to a TaskResult. Tasks that did not
+# complete in time have state TaskResult.TIMEOUT and a TaskTimeout error.
+#
+# NOTE: This is a blocking call.
+#
+def WaitForAllTasks(tasks,
+                    si=None,
+                    pc=None,
+                    onProgressUpdate=None,
+                    timeout=None,
+                    raiseOnError=False,
+                    maxWaitSeconds=DEFAULT_MAX_WAIT):
+    """
+    Wait for many tasks to complete and return a TaskResult per task.
+    @type  tasks             : list of vim.Task
+    @param tasks             : Tasks to wait for.
+    @type  si                : ManagedObjectReference to a ServiceInstance.
+    @param si                : ServiceInstance to use.
+    @type  pc                : ManagedObjectReference to a PropertyCollector.
+    @param pc                : Property collector to use. If None, a private
+                              one is created for this wait and destroyed
+                              afterwards.
+    @type  onProgressUpdate  : callable
+    @param onProgressUpdate  : Callable to call with task progress updates.
+    @type  timeout           : int
+    @param timeout           : Seconds to wait for all tasks. None waits
+                              until every task completes.
+    @type  raiseOnError      : bool
+    @param raiseOnError      : Raise the error of the first failed task.
+    @type  maxWaitSeconds    : int
+    @param maxWaitSeconds    : Longest time a single WaitForUpdatesEx call
+                              blocks on the server.
+    """
+    results = {}
+    if not tasks:
+        return results
+
+    ownCollector = pc is None
+    if ownCollector:
+        pc = CreateCollector(si)
 
     progressUpdaters = {}
     for task in tasks:
         progressUpdater = ProgressUpdater(task, onProgressUpdate)
         progressUpdater.Update('created')
-        progressUpdaters[str(task)] = progressUpdater
+        progressUpdaters[task] = progressUpdater
 
-    filter = CreateTasksFilter(pc, tasks)
+    try:
+        filter = CreateTasksFilter(pc, progressUpdaters.keys())
+    except Exception:
+        if ownCollector:
+            pc.Destroy()
+        raise
+    deadline = None if timeout is None else time.time() + timeout
+    infos = {}
 
     try:
-        version, state = None, None
+        version = None
+        # Loop looking for updates till all tasks move to a completed state.
+        while progressUpdaters:
+            wait = maxWaitSeconds
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                wait = max(1, min(wait, int(remaining + 0.5)))
+            options = vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=wait)
+            update = pc.WaitForUpdatesEx(version, options)
+            if update is None:
+                continue
 
-        # Loop looking for updates till the state moves to a completed state.
-        while len(progressUpdaters):
-            update = pc.WaitForUpdates(version)
             for filterSet in update.filterSet:
+                if filterSet.filter != filter:
+                    continue
                 for objSet in filterSet.objectSet:
                     task = objSet.obj
-                    taskId = str(task)
-                for change in objSet.changeSet:
-                    if change.name == 'info':
-                        state = change.val.state
-                    elif change.name == 'info.state':
-                        state = change.val
-                    else:
+                    progressUpdater = progressUpdaters.get(task)
+                    if not progressUpdater:
                         continue
 
-                    progressUpdater = progressUpdaters.get(taskId)
-                    if not progressUpdater:
+                    info = infos.get(task)
+                    for change in objSet.changeSet:
+                        info = ApplyTaskChange(info, change)
+                    infos[task] = info
+                    if info is None:
                         continue
 
-                    if state == vim.TaskInfo.State.success:
+                    if info.state == vim.TaskInfo.State.success:
                         progressUpdater.Update('completed')
-                        progressUpdaters.pop(taskId)
-                    elif state == vim.TaskInfo.State.error:
-                        err = task.info.error
-                        progressUpdater.Update('error: %s' % str(err))
+                        progressUpdaters.pop(task)
+                        results[task] = TaskResult(task, info.state,
+                                                   result=info.result)
+                    elif info.state == vim.TaskInfo.State.error:
+                        progressUpdater.Update('error: %s' % str(info.error))
+                        progressUpdaters.pop(task)
+                        results[task] = TaskResult(task, info.state,
+                                                   error=info.error)
                         if raiseOnError:
-                            raise err
-                        else:
-                            print "Task %s reported error: %s" % (taskId,
-                                                                  str(err))
-                            progressUpdaters.pop(taskId)
+                            raise info.error
                     else:
-                        if onProgressUpdate:
-                            progressUpdater.UpdateIfNeeded()
+                        progressUpdater.UpdateIfNeeded(info)
             # Move to next version
             version = update.version
     finally:
-        if filter:
-            filter.Destroy()
-    return
+        DestroyFilter(pc, filter, ownCollector)
+
+    for task, progressUpdater in progressUpdaters.items():
+        progressUpdater.Update('timeout')
+        results[task] = TaskResult(
+            task, TaskResult.TIMEOUT,
+            error=TaskTimeout('Task %s did not complete in %s seconds' %
+                              (task, timeout)))
+    return results
 
 
 def GetTaskStatus(task, version, pc):
-    update = pc.WaitForUpdates(version)
-    state = task.info.state
+    version, info = WaitForTaskInfo(task, version, pc)
+    return version, info.state if info is not None else None
+
+
+def ApplyTaskChange(info, change):
+    """
+    Apply a property collector change of a task to the last known TaskInfo
+    and return the updated TaskInfo.
+    """
+    if change.name == 'info':
+        return change.val
+    if info is not None and change.name.startswith('info.'):
+        val = None if change.op in ('remove', 'indirectRemove') \
+            else change.val
+        setattr(info, change.name[len('info.'):], val)
+    return info
+
+
+def WaitForTaskInfo(task, version, pc, info=None,
+                    maxWaitSeconds=DEFAULT_MAX_WAIT, filter=None):
+    """
+    Wait for the next update of a task and return the new version together
+    with the TaskInfo built from the update. If nothing changed within
+    maxWaitSeconds, the given info is returned unchanged.
+    """
+    options = vmodl.query.PropertyCollector.WaitOptions(
+        maxWaitSeconds=maxWaitSeconds)
+    update = pc.WaitForUpdatesEx(version, options)
+    if update is None:
+        return version, info
+
+    for filterSet in update.filterSet:
+        if filter is not None and filterSet.filter != filter:
+            continue
+        for objSet in filterSet.objectSet:
+            if objSet.obj != task:
+                continue
+            for change in objSet.changeSet:
+                info = ApplyTaskChange(info, change)
+
+    if info is not None and info.state == 'running' and \
+       info.name is not None and \
+       info.name.info.name != "Destroy":
+        CheckForQuestionPending(task, info)
+
+    return update.version, info
+
+
+def CreateCollector(si):
+    """
+    Create a property collector private to one wait. Waits of threads
+    sharing a ServiceInstance must not share a collector, its update
+    versions and filters would get mixed up between them.
+    """
+    return si.content.propertyCollector.CreatePropertyCollector()
 
-    if state == 'running' and \
-       task.info.name is not None and \
-       task.info.name.info.name != "Destroy":
-        CheckForQuestionPending(task)
 
-    return update.version, state
+def DestroyFilter(pc, filter, destroyCollector=False):
+    """ Destroy a task filter and, if asked to, its collector """
+    try:
+        filter.Destroy()
+    finally:
+        if destroyCollector:
+            pc.Destroy()
 
 
 def CreateFilter(pc, task):
@@ -223,9 +418,9 @@ def CreateTasksFilter(pc, tasks):
     objspecs = [
         vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks]
 
-    # Next, create the property specification as the state.
+    # Next, create the property specification as the task info.
     propspec = vmodl.query.PropertyCollector.PropertySpec(
-        type=vim.Task, pathSet=[], all=True)
+        type=vim.Task, pathSet=['info'], all=False)
 
     # Create a filter spec with the specified object and property spec.
     filterspec = vmodl.query.PropertyCollector.FilterSpec()
@@ -236,12 +431,28 @@ def CreateTasksFilter(pc, tasks):
     return pc.CreateFilter(filterspec, True)
 
 
-def CheckForQuestionPending(task):
+def CreateViewTasksFilter(pc, view):
+    """ Create property collector filter for the tasks of a ListView """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseView', path='view', skip=False,
+        type=vim.view.ListView)
+    objspec = vmodl.query.PropertyCollector.ObjectSpec(
+        obj=view, skip=True, selectSet=[traversal])
+    propspec = vmodl.query.PropertyCollector.PropertySpec(
+        type=vim.Task, pathSet=['info'], all=False)
+    filterspec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[objspec], propSet=[propspec])
+    return pc.CreateFilter(filterspec, True)
+
+
+def CheckForQuestionPending(task, info=None):
     """
     Check to see if VM needs to ask a question, throw exception
     """
 
-    vm = task.info.entity
+    if info is None:
+        info = task.info
+    vm = info.entity
     if vm is not None and isinstance(vm, vim.VirtualMachine):
         qst = vm.runtime.question
         if qst is not None:
@@ -272,10 +483,314 @@ class ProgressUpdater(object):
         if taskUpdate:
             taskUpdate(self.task, state)
 
-    def UpdateIfNeeded(self):
-        self.progress = self.task.info.progress
+    def UpdateIfNeeded(self, info=None):
+        if info is None:
+            info = self.task.info
+        self.progress = info.progress
 
         if self.progress != self.prevProgress:
             self.Update(self.progress)
 
         self.prevProgress = self.progress
+
+
+#
+# @brief Result of a task that is monitored in the background by a
+# TaskMonitor. Mirrors the interface of concurrent.futures.Future.
+#
+class TaskFuture(object):
+    """
+    Result of a task that is monitored in the background by a TaskMonitor.
+    Mirrors the interface of concurrent.futures.Future.
+    """
+
+    def __init__(self, task, transform=None):
+        self.task = task
+        self.info = None
+        self._error = None
+        self._transform = transform
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def _wait(self, timeout):
+        if not self._done.wait(timeout):
+            raise TaskTimeout('Task %s did not complete in %s seconds' %
+                              (self.task, timeout))
+
+    def exception(self, timeout=None):
+        """
+        Wait for the task and return its error, None if it succeeded.
+        """
+        self._wait(timeout)
+        if self._error is not None:
+            return self._error
+        if self.info.state == vim.TaskInfo.State.error:
+            return self.info.error
+
+    def result(self, timeout=None):
+        """
+        Wait for the task and return its result. The error of a failed task
+        is raised.
+        """
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        if self._transform:
+            return self._transform(self.info.result)
+        return self.info.result
+
+    def add_done_callback(self, fn):
+        """
+        Call fn with this future once the task completes. Callbacks run on
+        the monitor thread and should not block.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set_info(self, info, error=None):
+        with self._lock:
+            self.info = info
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                LOG.exception('Task %s done callback failed.', self.task)
+
+
+#
+# @brief Background loop that tracks tasks of one ServiceInstance through a
+# private property collector and completes their TaskFutures.
+#
+class TaskMonitor(object):
+    """
+    Background loop that tracks tasks of one ServiceInstance through a
+    private property collector and completes their TaskFutures. The loop
+    thread runs only while tasks are pending.
+
+    All tasks are watched by one filter over a ListView. Submitted tasks
+    are added to the view by a short-lived thread, so tasks submitted
+    while it adds others are added together in one ModifyListView call.
+    Completed tasks send no more updates, so they are removed with the
+    next addition, or once MAX_DONE_IN_VIEW of them piled up or the loop
+    goes idle.
+    """
+
+    def __init__(self, si, maxWaitSeconds=DEFAULT_MAX_WAIT):
+        # Weak, so that the monitor does not keep a discarded stub alive
+        self._stub = weakref.ref(si._stub)
+        self.maxWaitSeconds = maxWaitSeconds
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._toAdd = []
+        self._toRemove = []
+        self._adding = False
+        self._thread = None
+        # moIds of the collector and the list view once set up
+        self._ids = None
+        self._version = None
+
+    def submit(self, task, transform=None):
+        """
+        Start monitoring a task.
+        @param task      : vim.Task to monitor.
+        @param transform : Callable applied to the task result by
+                           TaskFuture.result.
+        @return TaskFuture
+        """
+        future = TaskFuture(task, transform)
+        stub = self._stub()
+        with self._lock:
+            self._pending[task] = future
+            ids = self._ids
+            if ids is None:
+                ids = self._ids = self._setUp(stub, task)
+            else:
+                self._toAdd.append(task)
+                if not self._adding:
+                    self._adding = True
+                    self._start(self._addTasks, stub, ids,
+                                'task-monitor-add')
+            if self._thread is None:
+                self._thread = self._start(self._run, stub, ids,
+                                           'task-monitor')
+        return future
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _setUp(self, stub, task):
+        si = vim.ServiceInstance('ServiceInstance', stub)
+        pc = CreateCollector(si)
+        view = si.content.viewManager.CreateListView([task])
+        CreateViewTasksFilter(pc, view)
+        return pc._moId, view._moId
+
+    def _objects(self, stub, ids):
+        return (vmodl.query.PropertyCollector(ids[0], stub),
+                vim.view.ListView(ids[1], stub))
+
+    def _start(self, target, stub, ids, name):
+        thread = threading.Thread(target=target, args=(stub, ids),
+                                  name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _addTasks(self, stub, ids):
+        _, view = self._objects(stub, ids)
+        while True:
+            with self._lock:
+                tasks, self._toAdd = self._toAdd, []
+                if not tasks:
+                    self._adding = False
+                    return
+                done, self._toRemove = self._toRemove, []
+            try:
+                missing = view.ModifyListView(add=tasks, remove=done)
+            except Exception as e:
+                LOG.exception('Adding tasks to the task monitor failed.')
+                self._fail(tasks, e)
+                continue
+            for task in missing or []:
+                self._fail([task], vmodl.fault.ManagedObjectNotFound(obj=task))
+
+    def _fail(self, tasks, error):
+        for task in tasks:
+            with self._lock:
+                future = self._pending.pop(task, None)
+            if future is not None:
+                future._set_info(future.info, error)
+
+    def _run(self, stub, ids):
+        pc, view = self._objects(stub, ids)
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=self.maxWaitSeconds)
+        while True:
+            with self._lock:
+                if self._ids is not ids:
+                    # Monitor was stopped, a new loop owns the collector.
+                    return
+                idle = not self._pending
+                if idle or len(self._toRemove) >= MAX_DONE_IN_VIEW:
+                    done, self._toRemove = self._toRemove, []
+                else:
+                    done = []
+                if idle:
+                    self._thread = None
+            if done:
+                try:
+                    view.ModifyListView(remove=done)
+                except Exception:
+                    LOG.debug('Removing tasks from the task monitor '
+                              'failed', exc_info=True)
+            if idle:
+                return
+            try:
+                update = pc.WaitForUpdatesEx(self._version, options)
+            except Exception as e:
+                with self._lock:
+                    if self._ids is not ids:
+                        return
+                LOG.exception('Task monitor lost its update stream.')
+                self._fail_all(e)
+                return
+            if update is not None:
+                self._apply(update)
+                self._version = update.version
+
+    def _apply(self, update):
+        infos = {}
+        for filterSet in update.filterSet:
+            for objSet in filterSet.objectSet:
+                with self._lock:
+                    future = self._pending.get(objSet.obj)
+                if future is None:
+                    continue
+                info = infos.get(objSet.obj, future.info)
+                for change in objSet.changeSet:
+                    info = ApplyTaskChange(info, change)
+                infos[objSet.obj] = info
+                if info is None:
+                    continue
+                future.info = info
+                if info.state in (vim.TaskInfo.State.success,
+                                  vim.TaskInfo.State.error):
+                    with self._lock:
+                        self._pending.pop(objSet.obj, None)
+                        self._toRemove.append(objSet.obj)
+                    future._set_info(info)
+
+    def _fail_all(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._toAdd = []
+            self._toRemove = []
+            self._thread = None
+            self._ids = None
+            self._version = None
+        for future in pending.values():
+            future._set_info(future.info, error)
+
+    def stop(self):
+        """
+        Stop monitoring, pending futures fail with a TaskTimeout error.
+        """
+        with self._lock:
+            ids = self._ids
+        self._fail_all(TaskTimeout('Task monitor stopped'))
+        stub = self._stub()
+        if ids is not None and stub is not None:
+            pc, view = self._objects(stub, ids)
+            try:
+                pc.CancelWaitForUpdates()
+                view.DestroyView()
+                pc.Destroy()
+            except Exception:
+                LOG.debug('Destroy task monitor collector failed',
+                          exc_info=True)
+
+
+# Keyed by the SOAP stub, a monitor goes away together with its stub
+_taskMonitors = weakref.WeakKeyDictionary()
+_taskMonitorsLock = threading.Lock()
+
+
+def GetTaskMonitor(si):
+    """
+    Return the shared TaskMonitor of a ServiceInstance, creating it on
+    first use.
+    """
+    with _taskMonitorsLock:
+        monitor = _taskMonitors.get(si._stub)
+        if monitor is None:
+            monitor = TaskMonitor(si)
+            _taskMonitors[si._stub] = monitor
+        return monitor
+
+
+def StopTaskMonitor(si):
+    """
+    Stop and forget the shared TaskMonitor of a ServiceInstance.
+    """
+    with _taskMonitorsLock:
+        monitor = _taskMonitors.pop(si._stub, None)
+    if monitor is not None:
+        monitor.stop()
+
+
+def MonitorTask(task, si, transform=None):
+    """
+    Monitor a task in the background and return a TaskFuture for it.
+    """
+    return GetTaskMonitor(si).submit(task, transform)
@@ -1,32 +1,36 @@
 """Wrapper library for pyVmomi"""
 
 import logging
-import re
+import threading
+import time
+import weakref
 
-import pyVmomi
 from pyVmomi import vim
-import ssl
+from pyVmomi import vmodl
 
+import download
+import inventory
+import metrics
+import session
 import task
 
 
 LOG = logging.getLogger(__name__)
 
+# Seconds a fetched property value is served without a new round-trip
+PROPERTY_TTL = 60
+# Property paths whose values change on their own. They, their sub-paths
+# and the paths containing them, like summary, are read anew on every
+# access unless prefetched for that access.
+VOLATILE_PROPERTIES = ('runtime', 'summary.runtime', 'summary.quickStats',
+                       'summary.guest', 'summary.vAppState', 'guest')
+# Destroy tasks kept in flight by bulk VM cleanup
+DESTROY_CONCURRENCY = 16
 
-def connect(host, user, password, verify=True):
-    if verify:
-        context = None
-    else:
-        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-        context.verify_mode = ssl.CERT_NONE
-
-    stub = pyVmomi.SoapStubAdapter(
-        host=host,
-        port=443,
-        version='vim.version.version6',
-        path='/sdk',
-        sslContext=context)
 
+def connect(host, user, password, verify=True,
+            pool_size=session.POOL_SIZE):
+    stub = session.create_stub(host, verify, pool_size)
     si = vim.ServiceInstance("ServiceInstance", stub)
     content = si.RetrieveContent()
     content.sessionManager.Login(user, password, None)
@@ -38,22 +42,386 @@ def disconnect(si):
     content.sessionManager.Logout()
 
 
-def equals_match(name, mor):
-    LOG.debug('Check %s equals %s' % (mor.name, name))
-    return name == mor.name
-
-
-def regex_match(pattern, mor):
-    LOG.debug('Check %s matches %s' % (mor.name, pattern))
-    m = re.match(pattern, mor.name)
-    return True if m else False
+def _submit_failed(item, error):
+    LOG.warning('Failed to submit task for %s: %s', item, error.msg)
+    return task.TaskResult(None, vim.TaskInfo.State.error, error=error)
+
+
+def _run_capped(si, items, submit, max_concurrent, timeout):
+    deadline = None if timeout is None else time.time() + timeout
+    slots = threading.Condition()
+    progress = {'running': 0, 'done': 0}
+    total = len(items)
+
+    def finished(future):
+        with slots:
+            progress['running'] -= 1
+            progress['done'] += 1
+            done = progress['done']
+            slots.notify()
+        LOG.debug('%d of %d tasks completed', done, total)
+
+    def remaining():
+        if deadline is None:
+            return None
+        return max(deadline - time.time(), 0)
+
+    results = {}
+    futures = {}
+    for item in items:
+        with slots:
+            while progress['running'] >= max_concurrent and \
+                    remaining() != 0:
+                slots.wait(remaining())
+            if progress['running'] >= max_concurrent:
+                break
+            progress['running'] += 1
+        try:
+            task_ = submit(item)
+        except vmodl.MethodFault as e:
+            results[item] = _submit_failed(item, e)
+            with slots:
+                progress['running'] -= 1
+            continue
+        future = task.MonitorTask(task_, si)
+        future.add_done_callback(finished)
+        futures[item] = future
+
+    for item in items:
+        future = futures.get(item)
+        if item in results:
+            continue
+        if future is None:
+            results[item] = task.TaskResult(
+                None, task.TaskResult.TIMEOUT,
+                error=task.TaskTimeout('Task for %s was not started in %s '
+                                       'seconds' % (item, timeout)))
+            continue
+        try:
+            error = future.exception(remaining())
+        except task.TaskTimeout as e:
+            results[item] = task.TaskResult(future.task,
+                                            task.TaskResult.TIMEOUT, error=e)
+            continue
+        if error is None:
+            results[item] = task.TaskResult(future.task,
+                                            vim.TaskInfo.State.success,
+                                            result=future.info.result)
+        else:
+            results[item] = task.TaskResult(future.task,
+                                            vim.TaskInfo.State.error,
+                                            error=error)
+    return results
+
+
+def run_batch(si, items, submit, timeout=None, max_concurrent=None):
+    """Submit a task for every item first, then wait on all of them.
+
+    With max_concurrent, at most that many tasks are in flight and a new
+    task is started whenever one completes. All tasks are tracked by the
+    shared task monitor of the ServiceInstance.
+
+    :param si: ServiceInstance to use.
+    :param items: items to start a task for, e.g. ManagedObject instances.
+    :param submit: callable that starts and returns a task for an item.
+    :param timeout: seconds to wait for all tasks. None waits forever.
+    :param max_concurrent: maximum number of tasks in flight. None starts
+                           all tasks at once.
+    :returns: dict mapping every item to a task.TaskResult. Items whose
+              task could not be submitted get an error result.
+    """
+    if max_concurrent is not None:
+        results = _run_capped(si, list(items), submit, max_concurrent,
+                              timeout)
+        failed = [i for i, r in results.items() if not r.succeeded]
+        LOG.debug('Batch of %d tasks finished, %d failed', len(results),
+                  len(failed))
+        return results
+
+    results = {}
+    submitted = {}
+    for item in items:
+        try:
+            submitted[submit(item)] = item
+        except vmodl.MethodFault as e:
+            results[item] = _submit_failed(item, e)
+    if submitted:
+        task_results = task.WaitForAllTasks(submitted.keys(), si=si,
+                                            timeout=timeout)
+        for task_, item in submitted.items():
+            results[item] = task_results[task_]
+    failed = [i for i, r in results.items() if not r.succeeded]
+    LOG.debug('Batch of %d tasks finished, %d failed', len(results),
+              len(failed))
+    return results
+
+
+def poweroff_all(objects, timeout=None):
+    """Power off VMs or vApps together.
+
+    :param objects: VM or Vapp instances.
+    :returns: dict mapping every object to a task.TaskResult.
+    """
+    if not objects:
+        return {}
+    LOG.info('Power off %d entities', len(objects))
+    results = run_batch(objects[0].si, objects, lambda o: o._poweroff_task(),
+                        timeout)
+    for obj in objects:
+        obj.refresh()
+    return results
+
+
+def destroy_all(objects, timeout=None, max_concurrent=None):
+    """Destroy entities together.
+
+    :param objects: ManagedObject instances.
+    :param max_concurrent: maximum number of destroy tasks in flight.
+    :returns: dict mapping every object to a task.TaskResult.
+    """
+    if not objects:
+        return {}
+    LOG.info('Destroy %d entities', len(objects))
+    # Names can not be read once the objects are gone, read them now
+    prefetch([o for o in objects if 'name' not in o._props], ['name'])
+    results = run_batch(objects[0].si, objects, lambda o: o._destroy_task(),
+                        timeout, max_concurrent)
+    for obj, result in results.items():
+        if result.succeeded:
+            obj._destroyed = True
+        else:
+            obj.refresh()
+    return results
+
+
+def _nic_spec(network, backings):
+    nicspec = vim.vm.device.VirtualDeviceSpec()
+
+    nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
+    # For now hard code change it to to use string nic_type
+    nicspec.device = vim.vm.device.VirtualVmxnet3()
+    nicspec.device.wakeOnLanEnabled = True
+    nicspec.device.deviceInfo = vim.Description()
+
+    net_mor = network.mor
+    if isinstance(net_mor, vim.dvs.DistributedVirtualPortgroup):
+        # Configuration for DVPortgroups
+        switch_uuid, portgroup_key = backings[network.moid]
+        dvs_port_connection = vim.dvs.PortConnection()
+        dvs_port_connection.portgroupKey = portgroup_key
+        dvs_port_connection.switchUuid = switch_uuid
+        nicspec.device.backing = vim.vm.device.VirtualEthernetCard.\
+            DistributedVirtualPortBackingInfo()
+        nicspec.device.backing.port = dvs_port_connection
+    else:
+        # Configuration for Standard switch port groups
+        nicspec.device.backing = vim.vm.device.\
+            VirtualEthernetCard.NetworkBackingInfo()
+        nicspec.device.backing.network = net_mor
+        nicspec.device.backing.deviceName = network.name
+
+    nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+    nicspec.device.connectable.startConnected = True
+    nicspec.device.connectable.allowGuestControl = True
+    return nicspec
+
+
+# stub -> {moid: switch uuid or portgroup key}. Neither ever changes while
+# the session lives, entries go with the stub or on disconnect.
+_backing_keys = weakref.WeakKeyDictionary()
+_backing_keys_lock = threading.Lock()
+
+
+def _forget_backings(si):
+    with _backing_keys_lock:
+        _backing_keys.pop(si._stub, None)
+
+
+def _get_portgroup_backings(networks):
+    """Return {moid: (switch uuid, portgroup key)} of the dvportgroups.
+
+    Keys and uuids not seen before are read in one round-trip each, so
+    every portgroup and switch is looked up once per connection.
+    """
+    portgroups = [n for n in networks
+                  if isinstance(n.mor, vim.dvs.DistributedVirtualPortgroup)]
+    if not portgroups:
+        return {}
+    si = portgroups[0].si
+
+    def cached(moids):
+        with _backing_keys_lock:
+            known = _backing_keys.get(si._stub, {})
+            return dict((m, known.get(m)) for m in moids)
+
+    def remember(values):
+        with _backing_keys_lock:
+            _backing_keys.setdefault(si._stub, {}).update(values)
+
+    keys = cached(set(pg.moid for pg in portgroups))
+    missing = [pg.mor for pg in portgroups if keys[pg.moid] is None]
+    if missing:
+        found = inventory.retrieve_properties(
+            si, missing, ['key', 'config.distributedVirtualSwitch'])
+        fetched = dict((moid, (props['config.distributedVirtualSwitch'],
+                               props['key']))
+                       for moid, props in found.items())
+        remember(dict((moid, (switch._moId, key))
+                      for moid, (switch, key) in fetched.items()))
+        keys.update(cached(fetched.keys()))
+
+    uuids = cached(set(switch for switch, _ in keys.values()))
+    missing = [vim.DistributedVirtualSwitch(moid, si._stub)
+               for moid, uuid in uuids.items() if uuid is None]
+    if missing:
+        found = inventory.retrieve_properties(si, missing, ['uuid'])
+        remember(dict((moid, props['uuid'])
+                      for moid, props in found.items()))
+        uuids.update(cached(found.keys()))
+    return dict((moid, (uuids[switch], key))
+                for moid, (switch, key) in keys.items())
+
+
+def add_nics_all(vms, networks, timeout=None, max_concurrent=None):
+    """Add a nic per network to every VM, one reconfiguration per VM.
+
+    :param vms: VM instances.
+    :param networks: list of Network or DistributedVirtualPortgroup
+    :param max_concurrent: maximum number of reconfigurations in flight.
+    :returns: dict mapping every VM to a task.TaskResult.
+    """
+    if not vms:
+        return {}
+    LOG.info('Add networks %s to %d VMs', [n.name for n in networks],
+             len(vms))
+    results = run_batch(vms[0].si, vms,
+                        lambda vm: vm._add_nics_task(networks), timeout,
+                        max_concurrent)
+    for vm in vms:
+        vm.refresh()
+    return results
+
+
+def cleanup_vms(vms, max_concurrent=DESTROY_CONCURRENCY, timeout=None):
+    """Power off and destroy VMs.
+
+    VMs which are not powered off are powered off together first, then all
+    VMs are destroyed with at most max_concurrent destroy tasks in flight.
+    A VM which fails to power off is not destroyed.
+
+    :param vms: VM instances.
+    :param timeout: seconds to wait for each of the two phases.
+    :returns: dict mapping every VM to the task.TaskResult of the step
+              that failed, or of the destroy task if none did.
+    """
+    if not vms:
+        return {}
+    report = {}
+    prefetch([vm for vm in vms if 'runtime.powerState' not in vm._props],
+             ['runtime.powerState'])
+    running = [vm for vm in vms if vm.get_state() != 'poweredOff']
+    for vm, result in poweroff_all(running, timeout).items():
+        if not result.succeeded:
+            report[vm] = result
+    report.update(destroy_all([vm for vm in vms if vm not in report],
+                              timeout, max_concurrent))
+    failed = [vm.name for vm, r in report.items() if not r.succeeded]
+    LOG.info('Removed %d of %d VMs. Failed: %s', len(vms) - len(failed),
+             len(vms), failed)
+    return report
+
+
+def _is_volatile(path):
+    return any(path == p or path.startswith(p + '.') or
+               p.startswith(path + '.') for p in VOLATILE_PROPERTIES)
+
+
+def prefetch(objects, props):
+    """Fetch the same properties of many objects in one round-trip.
+
+    Values of VOLATILE_PROPERTIES are served to the next read only.
+
+    :param objects: ManagedObject instances sharing a ServiceInstance.
+    :param props: list of property paths, e.g. ['runtime.powerState'].
+    """
+    if not objects:
+        return
+    found = inventory.retrieve_properties(objects[0].si,
+                                          [o.mor for o in objects], props)
+    for obj in objects:
+        obj._store(found.get(obj.moid, dict.fromkeys(props)))
 
 
 class ManagedObject(object):
-
-    def __init__(self, si, mor):
+    """Wrapper of a vim managed object reference.
+
+    Property values are kept after the first read and served from memory
+    for property_ttl seconds, so repeated reads of e.g. name cost one
+    round-trip. Values prefetched by the lookup which created the object
+    are served the same way. VOLATILE_PROPERTIES like runtime.powerState
+    are the exception: they are read on every access, and a prefetched
+    value of one is served to the next read only. Use fetch() to read
+    several properties in one round-trip and refresh() to drop values
+    known to be stale. Operations through this wrapper which change the
+    object refresh it themselves. Once destroyed through this wrapper, an
+    object keeps serving the values read before, as there is nothing left
+    to read them from.
+    """
+
+    property_ttl = PROPERTY_TTL
+    _destroyed = False
+
+    def __init__(self, si, mor, cache=None, props=None):
+        """
+        :param si: ServiceInstance to use.
+        :param mor: vim managed object reference.
+        :param cache: inventory.InventoryCache to serve lookups from.
+        :param props: dict of property path to value already retrieved.
+        """
         self.mor = mor
         self.si = si
+        self.cache = cache
+        self._props = {}
+        if props:
+            self._store(props)
+
+    def _store(self, props):
+        now = time.time()
+        for path, value in props.items():
+            self._props[path] = (value, now)
+
+    def fetch(self, props):
+        """Retrieve several properties in one round-trip.
+
+        :param props: list of property paths, e.g. ['summary.guest'].
+        :returns: dict of property path to value.
+        """
+        found = inventory.retrieve_properties(self.si, [self.mor], props)
+        values = found.get(self.moid, dict.fromkeys(props))
+        self._store(values)
+        return values
+
+    def refresh(self):
+        """Forget all property values read so far."""
+        if not self._destroyed:
+            self._props = {}
+
+    def _get_prop(self, path):
+        if self._destroyed:
+            cached = self._props.get(path)
+            return cached[0] if cached is not None else None
+        volatile = _is_volatile(path)
+        if volatile:
+            cached = self._props.pop(path, None)
+        else:
+            cached = self._props.get(path)
+        if cached is not None and \
+                time.time() - cached[1] < self.property_ttl:
+            return cached[0]
+        value = self.fetch([path])[path]
+        if volatile:
+            self._props.pop(path, None)
+        return value
 
     def _create_container_view(self, container, vim_type):
         vmgr = self.si.RetrieveContent().viewManager
@@ -62,62 +430,221 @@ class ManagedObject(object):
             type=[vim_type],
             recursive=True)
 
-    def _get_entities_by_name(self, cls, container, name, matcher):
-        LOG.debug('Search %s %s under %s' %
-                  (cls.VIM_CLS, name, container.name))
+    def _cache_active(self):
+        return self.cache is not None and self.cache.active
+
+    def _get_inventory(self, cls, container, props=None):
+        if not props and self._cache_active():
+            return self.cache.snapshot(cls.VIM_CLS, container)
+        return inventory.retrieve_inventory(self.si, container, cls.VIM_CLS,
+                                            props)
+
+    def _find_items(self, cls, container, name, regex):
+        if self._cache_active():
+            if regex:
+                return self.cache.find_by_regex(cls.VIM_CLS, name, container)
+            return self.cache.find_by_name(cls.VIM_CLS, name, container)
+        snapshot = self._get_inventory(cls, container)
+        if regex:
+            return snapshot.find_by_regex(name)
+        return snapshot.find_by_name(name)
+
+    def _get_entities_by_name(self, cls, container, name, regex=False):
+        LOG.debug('Search %s %s under %s' % (cls.VIM_CLS, name, container))
         entities = []
-        invtvw = self._create_container_view(container, cls.VIM_CLS)
-        for mor in invtvw.view:
-            if matcher(name, mor):
-                LOG.debug('Found %s (%s)' % (mor.name, mor._moId))
-                entities.append(cls(self.si, mor))
+        for item in self._find_items(cls, container, name, regex):
+            LOG.debug('Found %s (%s)' % (item.name, item.moid))
+            entities.append(cls(self.si, item.mor, cache=self.cache,
+                                props=dict(item.props)))
         return entities
 
-    def _get_entity_by_name(self, cls, container, name, matcher):
+    def _get_entity_by_name(self, cls, container, name, regex=False):
         LOG.debug('Search the first %s %s under %s' %
-                  (cls.VIM_CLS, name, container.name))
-        invtvw = self._create_container_view(container, cls.VIM_CLS)
-        for mor in invtvw.view:
-            if matcher(name, mor):
-                LOG.debug('Found %s (%s)' % (mor.name, mor._moId))
-                return cls(self.si, mor)
+                  (cls.VIM_CLS, name, container))
+        for item in self._find_items(cls, container, name, regex):
+            LOG.debug('Found %s (%s)' % (item.name, item.moid))
+            return cls(self.si, item.mor, cache=self.cache,
+                       props=dict(item.props))
+
+    def _get_child_by_name(self, cls, parent, name):
+        for item in self._find_items(cls, parent, name, False):
+            if item.parent == parent:
+                return cls(self.si, item.mor, cache=self.cache,
+                           props=dict(item.props))
+
+    def _get_vms(self, regex=None, tag=None, folder=None):
+        props = ['runtime.powerState']
+        if tag is not None:
+            props.append('tag')
+        container = self.mor if folder is None else folder.mor
+        snapshot = self._get_inventory(VM, container, props)
+        items = list(snapshot) if regex is None else \
+            snapshot.find_by_regex(regex)
+        if tag is not None:
+            items = [i for i in items
+                     if tag in [t.key for t in i.props.get('tag') or []]]
+        if folder is not None:
+            # Only keep VMs of the folder which are also under self
+            under = self._get_inventory(VM, self.mor)
+            items = [i for i in items if under.get(i.moid) is not None]
+        LOG.debug('Selected %d VMs under %s', len(items), self.moid)
+        return [VM(self.si, i.mor, cache=self.cache, props=dict(i.props))
+                for i in items]
+
+    def _destroy_task(self):
+        return self.mor.Destroy()
 
     def _destroy(self):
         LOG.info('Destroy %s' % self.name)
-        destroy_task = self.mor.Destroy()
-        task.WaitForTask(task=destroy_task, si=self.si)
+        destroy_task = self._destroy_task()
+        try:
+            task.WaitForTask(task=destroy_task, si=self.si)
+        except Exception:
+            self.refresh()
+            raise
+        self._destroyed = True
+
+    def _destroy_async(self):
+        LOG.info('Destroy %s' % self.name)
+        future = task.MonitorTask(self._destroy_task(), self.si)
+        future.add_done_callback(self._destroy_done)
+        return future
+
+    def _destroy_done(self, future):
+        if future.exception() is None:
+            self._destroyed = True
+        else:
+            self.refresh()
+
+    def _wait(self, task_):
+        """Wait for a task which changes this object."""
+        try:
+            task.WaitForTask(task=task_, si=self.si)
+        finally:
+            self.refresh()
+
+    def _monitor(self, task_, transform=None):
+        """Track a task on the shared monitor loop of the ServiceInstance.
+
+        :returns: task.TaskFuture instance.
+        """
+        future = task.MonitorTask(task_, self.si, transform)
+        future.add_done_callback(lambda f: self.refresh())
+        return future
 
     @property
     def name(self):
-        return self.mor.name
+        return self._get_prop('name')
 
     @property
     def moid(self):
         return self.mor._moId
 
     def __getattr__(self, name):
-        return getattr(self.mor, name)
+        mor = self.__dict__.get('mor')
+        if mor is None or name.startswith('_'):
+            return getattr(mor, name)
+        try:
+            mor._GetPropertyInfo(name)
+        except AttributeError:
+            # A method of the managed object
+            return getattr(mor, name)
+        return self._get_prop(name)
 
 
 class VirtualCenter(ManagedObject):
+    """Entry point to a vCenter inventory.
+
+    Concurrency model: one VirtualCenter may be shared by a pool of worker
+    threads. The connection is set up once under a lock by whichever
+    thread needs it first. All threads then share the ServiceInstance, whose
+    SOAP stub hands every concurrent call its own HTTP connection out of a
+    pool of pool_size connections, so size it to the number of workers.
+    Lookups are served either from the inventory cache, which is guarded by
+    its own lock, or from per call container views, and the task monitor
+    behind the *_async methods is shared and thread safe. ManagedObject
+    instances keep the property values they read, see ManagedObject, so
+    share one between threads only to read properties which do not change,
+    like name, and have each thread look up its own instances otherwise.
+    Call disconnect() only after all workers are done.
+    """
 
     def __enter__(self):
-        self.si = connect(self.host, self.user, self.pwd)
+        self._connect()
         return self
 
     def __exit__(self, *exc_info):
         self.disconnect()
 
-    def __init__(self, host, user, pwd):
+    def __init__(self, host, user, pwd, cache=False, pooled=False,
+                 pool_size=session.POOL_SIZE):
+        """
+        :param host: vCenter host name or IP address.
+        :param user: vCenter user name.
+        :param pwd: vCenter password.
+        :param cache: keep a long-lived inventory cache, updated in the
+                      background, and serve lookups from it.
+        :param pooled: check out a shared session from the process-wide
+                       session pool instead of logging in and out.
+        :param pool_size: number of SOAP calls which can run in parallel
+                          over kept-alive HTTP connections.
+        """
         self.host = host
         self.user = user
         self.pwd = pwd
         self.si = None
+        self.mor = None
+        self.cache = None
+        self.use_cache = cache
+        self.pooled = pooled
+        self.pool_size = pool_size
+        self.lock = threading.RLock()
+
+    def _connect(self):
+        with self.lock:
+            if self.si is not None:
+                return
+            if self.pooled:
+                si = session.get_pool().acquire(self.host, self.user,
+                                                self.pwd,
+                                                pool_size=self.pool_size)
+            else:
+                si = connect(self.host, self.user, self.pwd,
+                             pool_size=self.pool_size)
+            if self.use_cache:
+                self.enable_cache(si)
+            # Publish si last, unlocked readers treat it as connected
+            self.si = si
+
+    def enable_cache(self, si=None):
+        """Seed the inventory cache and keep it current in the background.
+
+        Changes made through other clients show up once the background
+        thread has received them, usually well under a second later.
+        """
+        with self.lock:
+            if self.cache is None:
+                cache = inventory.InventoryCache(si or self.si)
+                cache.start()
+                self.cache = cache
+
+    def disable_cache(self):
+        with self.lock:
+            if self.cache is not None:
+                self.cache.stop()
+                self.cache = None
 
     def disconnect(self):
-        if self.si is not None:
-            disconnect(self.si)
-            self.si = None
+        with self.lock:
+            self.disable_cache()
+            if self.si is not None:
+                if self.pooled:
+                    session.get_pool().release(self.si)
+                else:
+                    task.StopTaskMonitor(self.si)
+                    _forget_backings(self.si)
+                    disconnect(self.si)
+                self.si = None
 
     def requires_connection(func):
         """Decorator that makes sure that we have active connection to virtual
@@ -129,7 +656,8 @@ class VirtualCenter(ManagedObject):
 
         def connect_me(self, *args, **kargs):
             if self.si is None:
-                self.si = connect(self.host, self.user, self.pwd)
+                # _connect() checks again under the lock
+                self._connect()
             return func(self, *args, **kargs)
         return connect_me
 
@@ -145,7 +673,7 @@ class VirtualCenter(ManagedObject):
         """
         root_folder = self._get_root_folder()
         dc = root_folder.CreateDatacenter(name)
-        return Datacenter(self.si, dc)
+        return Datacenter(self.si, dc, cache=self.cache)
 
     @requires_connection
     def get_datacenter(self, name):
@@ -154,40 +682,84 @@ class VirtualCenter(ManagedObject):
         @param name: name of the datacenter
         @return returns Datacenter instance
         """
-        root_folder = self._get_root_folder()
-        for mor in root_folder.childEntity:
-            if name == mor.name:
-                return Datacenter(self.si, mor)
+        return self._get_child_by_name(Datacenter, self._get_root_folder(),
+                                       name)
 
     @requires_connection
     def get_hosts(self):
+        if self._cache_active():
+            return [Host(self.si, item.mor, cache=self.cache,
+                         props=dict(item.props))
+                    for item in self.cache.snapshot(vim.HostSystem)]
         vmgr = self.si.RetrieveContent().viewManager
         invtvw = vmgr.CreateContainerView(
             container=self._get_root_folder(),
             type=[vim.HostSystem],
             recursive=True)
-        return [Host(self.si, h) for h in invtvw.view]
+        return [Host(self.si, h, cache=self.cache) for h in invtvw.view]
 
-    @requires_connection
-    def get_log_bundle(self):
-        def get_all_host_systems():
-            vmgr = self.si.RetrieveContent().viewManager
-            invtvw = vmgr.CreateContainerView(
-                container=self._get_root_folder(),
-                type=[vim.HostSystem],
-                recursive=True)
-            return [h for h in invtvw.view]
+    def _generate_log_bundles(self, hosts=None):
+        """Generate log bundles of vCenter and the selected hosts.
 
+        :returns: list of (name, url) pairs, name is the host name or the
+                  vCenter host for the vCenter bundle.
+        """
+        host_systems = self.get_hosts()
+        if hosts is not None:
+            host_systems = [h for h in host_systems if h.name in hosts]
         content = self.si.RetrieveContent()
         dmgr = content.diagnosticManager
         generate_task = dmgr.GenerateLogBundles_Task(
             includeDefault=True,
-            host=get_all_host_systems())
+            host=[h.mor for h in host_systems])
         task.WaitForTask(generate_task, self.si)
-        bundles = [b.url.replace("*", self.host)
-                   for b in generate_task.info.result]
+        names = dict((h.moid, h.name) for h in host_systems)
+        bundles = []
+        for b in generate_task.info.result:
+            name = names.get(b.system._moId) if b.system else self.host
+            bundles.append((name, b.url.replace("*", self.host)))
         return bundles
 
+    @requires_connection
+    def get_log_bundle(self, hosts=None):
+        """Generate log bundles and return their URLs.
+
+        :param hosts: names of the hosts to include. None includes all.
+        """
+        return [url for _, url in self._generate_log_bundles(hosts)]
+
+    @requires_connection
+    def download_log_bundle(self, dest_dir, hosts=None,
+                            workers=download.DEFAULT_WORKERS, verify=True):
+        """Generate log bundles and stream them to a directory.
+
+        Bundles are downloaded concurrently, each with ranged GETs which
+        resume after dropped connections.
+
+        :param dest_dir: directory to write the bundles to.
+        :param hosts: names of the hosts to include. None includes all.
+        :param workers: maximum number of concurrent downloads.
+        :param verify: verify the server certificates.
+        :returns: list of download.DownloadResult, one per bundle, with
+                  size and throughput.
+        """
+        bundles = self._generate_log_bundles(hosts)
+        LOG.info('Download %d log bundles to %s', len(bundles), dest_dir)
+        return download.download_all(bundles, dest_dir, workers=workers,
+                                     cookie=download.session_cookie(self.si),
+                                     verify=verify)
+
+    @requires_connection
+    def get_inventory(self, cls, props=None):
+        """Retrieve all entities of a type in one PropertyCollector pass.
+
+        :param cls:  ManagedObject sub class.
+        :param props: list of extra property paths to collect along with
+                      name and parent.
+        :returns: inventory.InventorySnapshot instance.
+        """
+        return self._get_inventory(cls, self._get_root_folder(), props)
+
     @requires_connection
     def get_entities_by_name(self, cls, name):
         """Recursively search entities by name.
@@ -196,8 +768,7 @@ class VirtualCenter(ManagedObject):
         :param name: entity name.
         :returns: a list of entities. Empty list if nothing found.
         """
-        return self._get_entities_by_name(cls, self._get_root_folder(), name,
-                                          equals_match)
+        return self._get_entities_by_name(cls, self._get_root_folder(), name)
 
     @requires_connection
     def get_entity_by_name(self, cls, name):
@@ -207,8 +778,24 @@ class VirtualCenter(ManagedObject):
         :param name: entity name.
         :returns: first found entity. None if nothing found.
         """
-        return self._get_entity_by_name(cls, self._get_root_folder(), name,
-                                        equals_match)
+        return self._get_entity_by_name(cls, self._get_root_folder(), name)
+
+    @requires_connection
+    def get_entity_by_moid(self, cls, moid):
+        """Get entity by managed object id.
+
+        :param cls:  ManagedObject sub class.
+        :param moid: managed object id, e.g. vm-42.
+        :returns: entity. With the inventory cache active, None if nothing
+                  found.
+        """
+        if self._cache_active():
+            item = self.cache.get(moid)
+            if item is None or not isinstance(item.mor, cls.VIM_CLS):
+                return None
+            return cls(self.si, item.mor, cache=self.cache,
+                       props=dict(item.props))
+        return cls(self.si, cls.VIM_CLS(moid, self.si._stub), cache=self.cache)
 
     @requires_connection
     def get_entities_by_regex(self, cls, regex):
@@ -219,7 +806,7 @@ class VirtualCenter(ManagedObject):
         :returns: a list of entities. Empty list if nothing found.
         """
         return self._get_entities_by_name(cls, self._get_root_folder(), regex,
-                                          regex_match)
+                                          regex=True)
 
     @requires_connection
     def get_entity_by_regex(self, cls, regex):
@@ -230,7 +817,7 @@ class VirtualCenter(ManagedObject):
         :returns: first found entity. None if nothing found.
         """
         return self._get_entity_by_name(cls, self._get_root_folder(), regex,
-                                        regex_match)
+                                        regex=True)
 
     @requires_connection
     def query_vpx_settings(self, name):
@@ -264,10 +851,10 @@ class VirtualCenter(ManagedObject):
 class Datacenter(ManagedObject):
     VIM_CLS = vim.Datacenter
 
-    def __init__(self, si, dc):
+    def __init__(self, si, dc, cache=None, props=None):
         if not isinstance(dc, Datacenter.VIM_CLS):
             raise TypeError("Not a vim.Datacenter object")
-        super(Datacenter, self).__init__(si, dc)
+        super(Datacenter, self).__init__(si, dc, cache, props)
 
     def create_cluster(self, name, config=vim.cluster.ConfigSpecEx()):
         """Creates cluster.
@@ -276,21 +863,39 @@ class Datacenter(ManagedObject):
         @param config: vim.cluster.ConfigSpecEx
         """
 
-        hostFolder = self.mor.hostFolder
+        hostFolder = self.hostFolder
         c = hostFolder.CreateClusterEx(name, config)
-        return Cluster(self.si, c)
+        return Cluster(self.si, c, cache=self.cache)
 
     def get_cluster(self, name):
-        for mor in self.mor.hostFolder.childEntity:
-            if isinstance(mor, vim.ClusterComputeResource) \
-                    and name == mor.name:
-                return Cluster(self.si, mor)
+        return self._get_child_by_name(Cluster, self.hostFolder, name)
+
+    def _to_dvs(self, dvs):
+        return DistributedVirtualSwitch(self.si, dvs, cache=self.cache)
 
     def create_dvs(self, spec):
-        dvs_task = self.mor.networkFolder.CreateDVS_Task(spec)
+        dvs_task = self.networkFolder.CreateDVS_Task(spec)
         task.WaitForTask(task=dvs_task, si=self.si)
 
-        return DistributedVirtualSwitch(self.si, dvs_task.info.result)
+        return self._to_dvs(dvs_task.info.result)
+
+    def create_dvs_async(self, spec):
+        """Start creating a dvs without waiting for it.
+
+        :returns: task.TaskFuture resolving to a DistributedVirtualSwitch.
+        """
+        dvs_task = self.networkFolder.CreateDVS_Task(spec)
+        return self._monitor(dvs_task, self._to_dvs)
+
+    def get_inventory(self, cls, props=None):
+        """Retrieve all entities of a type in one PropertyCollector pass.
+
+        :param cls:  ManagedObject sub class.
+        :param props: list of extra property paths to collect along with
+                      name and parent.
+        :returns: inventory.InventorySnapshot instance.
+        """
+        return self._get_inventory(cls, self.mor, props)
 
     def get_entities_by_name(self, cls, name):
         """Recursively search entities by name.
@@ -299,7 +904,7 @@ class Datacenter(ManagedObject):
         :param name: entity name.
         :returns: a list of entities. Empty list if nothing found.
         """
-        return self._get_entities_by_name(cls, self.mor, name, equals_match)
+        return self._get_entities_by_name(cls, self.mor, name)
 
     def get_entity_by_name(self, cls, name):
         """Recursively search entity by name.
@@ -308,7 +913,7 @@ class Datacenter(ManagedObject):
         :param name: entity name.
         :returns: first found entity. None if nothing found.
         """
-        return self._get_entity_by_name(cls, self.mor, name, equals_match)
+        return self._get_entity_by_name(cls, self.mor, name)
 
     def get_entities_by_regex(self, cls, regex):
         """Recursively search entities by regular expression.
@@ -317,7 +922,8 @@ class Datacenter(ManagedObject):
         :param regex: regular expression to match entity name.
         :returns: a list of entities. Empty list if nothing found.
         """
-        return self._get_entities_by_name(cls, self.mor, regex, regex_match)
+        return self._get_entities_by_name(cls, self.mor, regex,
+                                          regex=True)
 
     def get_entity_by_regex(self, cls, regex):
         """Recursively search entity by regular expression.
@@ -326,16 +932,52 @@ class Datacenter(ManagedObject):
         :param regex: regular expression to match entity name.
         :returns: first found entity. None if nothing found.
         """
-        return self._get_entity_by_name(cls, self.mor, regex, regex_match)
+        return self._get_entity_by_name(cls, self.mor, regex, regex=True)
+
+    def get_vms(self, regex=None, tag=None, folder=None):
+        """Select VMs under this datacenter in one PropertyCollector pass.
+
+        :param regex: regular expression to match VM names.
+        :param tag: key of a tag the VMs must carry.
+        :param folder: Folder instance the VMs must be in.
+        :returns: list of VM instances with their power state prefetched.
+        """
+        return self._get_vms(regex, tag, folder)
+
+    def poweroff_vms(self, regex=None, tag=None, folder=None, timeout=None):
+        """Power off the selected VMs which are not powered off together.
+
+        :returns: dict mapping every VM to a task.TaskResult.
+        """
+        vms = [vm for vm in self._get_vms(regex, tag, folder)
+               if vm.get_state() != 'poweredOff']
+        return poweroff_all(vms, timeout)
+
+    def destroy_vms(self, regex=None, tag=None, folder=None,
+                    max_concurrent=DESTROY_CONCURRENCY, timeout=None):
+        """Power off and destroy the selected VMs.
+
+        See cleanup_vms() for the order of operations.
+
+        :param max_concurrent: maximum number of destroy tasks in flight.
+        :returns: dict mapping every VM to a task.TaskResult.
+        """
+        return cleanup_vms(self._get_vms(regex, tag, folder),
+                           max_concurrent, timeout)
 
 
 class Cluster(ManagedObject):
     VIM_CLS = vim.ClusterComputeResource
 
-    def __init__(self, si, cluster):
+    def __init__(self, si, cluster, cache=None, props=None):
         if not isinstance(cluster, Cluster.VIM_CLS):
             raise TypeError("Not a vim.ClusterComputeResource object")
-        super(Cluster, self).__init__(si, cluster)
+        super(Cluster, self).__init__(si, cluster, cache, props)
+
+    def _add_host_task(self, hostConnectSpec):
+        return self.mor.AddHost_Task(
+            spec=hostConnectSpec,
+            asConnected=True)
 
     def add_host(self, hostConnectSpec):
         """Adds host to a cluster.
@@ -343,26 +985,93 @@ class Cluster(ManagedObject):
         @param hostConnectSpec: vim.host.ConnectSpec
         """
 
-        hosttask = self.mor.AddHost_Task(
-            spec=hostConnectSpec,
-            asConnected=True)
-        task.WaitForTask(task=hosttask, si=self.si)
+        hosttask = self._add_host_task(hostConnectSpec)
+        self._wait(hosttask)
 
-    def enable_drs(self, enable=True):
+    def add_host_async(self, hostConnectSpec):
+        """Start adding a host to a cluster without waiting for it.
+
+        @param hostConnectSpec: vim.host.ConnectSpec
+        @return task.TaskFuture
+        """
+        return self._monitor(self._add_host_task(hostConnectSpec))
+
+    def add_hosts(self, hostConnectSpecs, timeout=None):
+        """Adds hosts to a cluster, submitting all tasks before waiting.
+
+        @param hostConnectSpecs: list of vim.host.ConnectSpec
+        @param timeout: seconds to wait for all hosts. None waits forever.
+        @return dict mapping host name to task.TaskResult
+        @raise ValueError: if a host name is given more than once. No host
+                           is added then.
+        """
+        specs = {}
+        for spec in hostConnectSpecs:
+            if spec.hostName in specs:
+                raise ValueError('Host %s given more than once' %
+                                 spec.hostName)
+            specs[spec.hostName] = spec
+        LOG.info('Add %d hosts to cluster %s', len(specs), self.name)
+        return run_batch(self.si, specs.keys(),
+                         lambda name: self._add_host_task(specs[name]),
+                         timeout)
+
+    def _enable_drs_task(self, enable):
         spec = vim.cluster.ConfigSpec(
             drsConfig=vim.cluster.DrsConfigInfo(enabled=enable))
-        rcfg_task = self.mor.ReconfigureCluster_Task(
+        return self.mor.ReconfigureCluster_Task(
             spec=spec, modify=True)
-        task.WaitForTask(task=rcfg_task, si=self.si)
+
+    def enable_drs(self, enable=True):
+        rcfg_task = self._enable_drs_task(enable)
+        self._wait(rcfg_task)
+
+    def enable_drs_async(self, enable=True):
+        """Start reconfiguring DRS without waiting for it.
+
+        @return task.TaskFuture
+        """
+        return self._monitor(self._enable_drs_task(enable))
+
+    def get_vms(self, regex=None, tag=None, folder=None):
+        """Select VMs under this cluster in one PropertyCollector pass.
+
+        :param regex: regular expression to match VM names.
+        :param tag: key of a tag the VMs must carry.
+        :param folder: Folder instance the VMs must be in.
+        :returns: list of VM instances with their power state prefetched.
+        """
+        return self._get_vms(regex, tag, folder)
+
+    def poweroff_vms(self, regex=None, tag=None, folder=None, timeout=None):
+        """Power off the selected VMs which are not powered off together.
+
+        :returns: dict mapping every VM to a task.TaskResult.
+        """
+        vms = [vm for vm in self._get_vms(regex, tag, folder)
+               if vm.get_state() != 'poweredOff']
+        return poweroff_all(vms, timeout)
+
+    def destroy_vms(self, regex=None, tag=None, folder=None,
+                    max_concurrent=DESTROY_CONCURRENCY, timeout=None):
+        """Power off and destroy the selected VMs.
+
+        See cleanup_vms() for the order of operations.
+
+        :param max_concurrent: maximum number of destroy tasks in flight.
+        :returns: dict mapping every VM to a task.TaskResult.
+        """
+        return cleanup_vms(self._get_vms(regex, tag, folder),
+                           max_concurrent, timeout)
 
 
 class Host(ManagedObject):
     VIM_CLS = vim.HostSystem
 
-    def __init__(self, si, host_system):
+    def __init__(self, si, host_system, cache=None, props=None):
         if not isinstance(host_system, Host.VIM_CLS):
             raise TypeError("Not a vim.HostSystem object")
-        super(Host, self).__init__(si, host_system)
+        super(Host, self).__init__(si, host_system, cache, props)
 
     def remove_datastore(self, datastore):
         """Remove datastore of the host.
@@ -376,146 +1085,181 @@ class Host(ManagedObject):
 class VM(ManagedObject):
     VIM_CLS = vim.VirtualMachine
 
-    def __init__(self, si, vm):
+    def __init__(self, si, vm, cache=None, props=None):
         if not isinstance(vm, VM.VIM_CLS):
             raise TypeError("Not a vim.VirtualMachine object")
-        super(VM, self).__init__(si, vm)
+        super(VM, self).__init__(si, vm, cache, props)
 
     @property
     def ip(self):
-        return self.mor.summary.guest.ipAddress
+        return self._get_prop('summary.guest.ipAddress')
+
+    def _add_nics_task(self, networks):
+        devices = []
+        backings = _get_portgroup_backings(networks)
+        for i, network in enumerate(networks):
+            nicspec = _nic_spec(network, backings)
+            # New devices need distinct temporary keys
+            nicspec.device.key = -(i + 1)
+            devices.append(nicspec)
+        vmconf = vim.vm.ConfigSpec(deviceChange=devices)
+
+        return self.mor.ReconfigVM_Task(vmconf)
 
     def add_nic(self, network):
         """Add a nic and connect to network.
 
         :param network: Network or DistributedVirtualPortgroup
         """
-        LOG.info('Add network %s to VM %s' % (network.name, self.name))
-        devices = []
-        nicspec = vim.vm.device.VirtualDeviceSpec()
-
-        nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
-        # For now hard code change it to to use string nic_type
-        nicspec.device = vim.vm.device.VirtualVmxnet3()
-        nicspec.device.wakeOnLanEnabled = True
-        nicspec.device.deviceInfo = vim.Description()
-
-        net_mor = network.mor
-        if isinstance(net_mor, vim.dvs.DistributedVirtualPortgroup):
-            # Configuration for DVPortgroups
-            dvs_port_connection = vim.dvs.PortConnection()
-            dvs_port_connection.portgroupKey = net_mor.key
-            dvs_port_connection.switchUuid = net_mor.config.\
-                distributedVirtualSwitch.uuid
-            nicspec.device.backing = vim.vm.device.VirtualEthernetCard.\
-                DistributedVirtualPortBackingInfo()
-            nicspec.device.backing.port = dvs_port_connection
-        else:
-            # Configuration for Standard switch port groups
-            nicspec.device.backing = vim.vm.device.\
-                VirtualEthernetCard.NetworkBackingInfo()
-            nicspec.device.backing.network = net_mor
-            nicspec.device.backing.deviceName = net_mor.name
+        self.add_nics([network])
 
-        nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-        nicspec.device.connectable.startConnected = True
-        nicspec.device.connectable.allowGuestControl = True
+    def add_nic_async(self, network):
+        """Start adding a nic without waiting for the reconfiguration.
 
-        devices.append(nicspec)
-        vmconf = vim.vm.ConfigSpec(deviceChange=devices)
+        :param network: Network or DistributedVirtualPortgroup
+        :returns: task.TaskFuture instance.
+        """
+        return self.add_nics_async([network])
+
+    def add_nics(self, networks):
+        """Add a nic per network with a single reconfiguration.
+
+        :param networks: list of Network or DistributedVirtualPortgroup
+        """
+        LOG.info('Add networks %s to VM %s' %
+                 ([n.name for n in networks], self.name))
+        reconfig_task = self._add_nics_task(networks)
+        self._wait(reconfig_task)
+
+    def add_nics_async(self, networks):
+        """Start adding a nic per network without waiting for it.
 
-        reconfig_task = self.mor.ReconfigVM_Task(vmconf)
-        task.WaitForTask(task=reconfig_task, si=self.si)
+        :param networks: list of Network or DistributedVirtualPortgroup
+        :returns: task.TaskFuture instance.
+        """
+        LOG.info('Add networks %s to VM %s' %
+                 ([n.name for n in networks], self.name))
+        return self._monitor(self._add_nics_task(networks))
 
     def get_state(self):
-        state = self.mor.runtime.powerState
+        state = self._get_prop('runtime.powerState')
         return state
 
+    def _poweroff_task(self):
+        return self.mor.PowerOff()
+
     def poweroff(self):
         LOG.info('Power off %s' % self.name)
-        poweroff_task = self.mor.PowerOff()
-        task.WaitForTask(task=poweroff_task, si=self.si)
+        poweroff_task = self._poweroff_task()
+        self._wait(poweroff_task)
 
     def destroy(self):
         self._destroy()
 
+    def destroy_async(self):
+        return self._destroy_async()
+
 
 class DataStore(ManagedObject):
     VIM_CLS = vim.Datastore
 
-    def __init__(self, si, ds):
+    def __init__(self, si, ds, cache=None, props=None):
         if not isinstance(ds, DataStore.VIM_CLS):
             raise TypeError("Not a vim.Datastore object")
-        super(DataStore, self).__init__(si, ds)
+        super(DataStore, self).__init__(si, ds, cache, props)
 
 
 class DistributedVirtualSwitch(ManagedObject):
     VIM_CLS = vim.VmwareDistributedVirtualSwitch
 
-    def __init__(self, si, dvs):
+    def __init__(self, si, dvs, cache=None, props=None):
         if not isinstance(dvs, DistributedVirtualSwitch.VIM_CLS):
             raise TypeError("Not a vim.VmwareDistributedVirtualSwitch object")
-        super(DistributedVirtualSwitch, self).__init__(si, dvs)
+        super(DistributedVirtualSwitch, self).__init__(si, dvs, cache, props)
 
 
 class DistributedVirtualPortgroup(ManagedObject):
     VIM_CLS = vim.DistributedVirtualPortgroup
 
-    def __init__(self, si, dvpg):
+    def __init__(self, si, dvpg, cache=None, props=None):
         if not isinstance(dvpg, DistributedVirtualPortgroup.VIM_CLS):
             raise TypeError("Not a vim.DistributedVirtualPortgroup object")
-        super(DistributedVirtualPortgroup, self).__init__(si, dvpg)
+        super(DistributedVirtualPortgroup, self).__init__(si, dvpg, cache,
+                                                          props)
 
 
 class Network(ManagedObject):
     VIM_CLS = vim.Network
 
-    def __init__(self, si, net):
+    def __init__(self, si, net, cache=None, props=None):
         if not isinstance(net, Network.VIM_CLS):
             raise TypeError("Not a vim.Network object")
-        super(Network, self).__init__(si, net)
+        super(Network, self).__init__(si, net, cache, props)
 
     def destroy(self):
         self._destroy()
 
+    def destroy_async(self):
+        return self._destroy_async()
+
 
 class Folder(ManagedObject):
     VIM_CLS = vim.Folder
 
-    def __init__(self, si, folder):
+    def __init__(self, si, folder, cache=None, props=None):
         if not isinstance(folder, Folder.VIM_CLS):
             raise TypeError("Not a vim.Folder object")
-        super(Folder, self).__init__(si, folder)
+        super(Folder, self).__init__(si, folder, cache, props)
 
     def destroy(self):
         self._destroy()
 
+    def destroy_async(self):
+        return self._destroy_async()
+
 
 class Vapp(ManagedObject):
     VIM_CLS = vim.VirtualApp
 
-    def __init__(self, si, vapp):
+    def __init__(self, si, vapp, cache=None, props=None):
         if not isinstance(vapp, Vapp.VIM_CLS):
             raise TypeError("Not a vim.VirtualApp object")
-        super(Vapp, self).__init__(si, vapp)
+        super(Vapp, self).__init__(si, vapp, cache, props)
+
+    def _poweroff_task(self):
+        return self.mor.PowerOff(force=True)
 
     def poweroff(self):
         LOG.info('Power off %s' % self.name)
-        poweroff_task = self.mor.PowerOff(force=True)
-        task.WaitForTask(task=poweroff_task, si=self.si)
+        poweroff_task = self._poweroff_task()
+        self._wait(poweroff_task)
 
     def destroy(self):
         self._destroy()
 
+    def destroy_async(self):
+        return self._destroy_async()
+
     def get_state(self):
-        state = self.mor.summary.vAppState
+        state = self._get_prop('summary.vAppState')
         return state
 
     def poweron(self):
         LOG.info('Power on %s' % self.name)
         poweron_task = self.mor.PowerOn()
-        task.WaitForTask(task=poweron_task, si=self.si)
+        self._wait(poweron_task)
+
+    def poweron_async(self):
+        """Start powering on without waiting for it.
+
+        :returns: task.TaskFuture instance.
+        """
+        LOG.info('Power on %s' % self.name)
+        return self._monitor(self.mor.PowerOn())
 
     @property
     def version(self):
-        return self.mor.summary.product.fullVersion
+        return self._get_prop('summary.product.fullVersion')
+
+
+metrics.enable_from_env()
@@ -7,6 +7,7 @@ setup(
     packages=['pyVmomiwrapper'],
     include_package_data=True,
     install_requires=[
-        'pyvmomi>=6.0.0'
+        'pyvmomi>=6.0.0',
+        'requests'
     ]
 )
@@ -0,0 +1,83 @@
+import time
+import unittest
+
+from pyVmomi import vim
+
+from pyVmomiwrapper import fake
+from pyVmomiwrapper import inventory
+from pyVmomiwrapper import task
+from pyVmomiwrapper import vmwareapi
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class InventoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.si = fake.create_service_instance(clusters=2,
+                                               hosts_per_cluster=2, vms=20)
+        self.stub = self.si._stub
+        self.cache = inventory.InventoryCache(self.si, max_wait=10)
+        self.cache.start()
+
+    def tearDown(self):
+        self.cache.stop()
+        task.StopTaskMonitor(self.si)
+
+    def names(self, vim_type, pattern='.*'):
+        return sorted(i.name for i in
+                      self.cache.find_by_regex(vim_type, pattern))
+
+    def test_seeded(self):
+        self.assertTrue(self.cache.active)
+        self.assertEqual(len(self.names(vim.VirtualMachine, '^vm-')), 20)
+        self.assertEqual(self.names(vim.ClusterComputeResource),
+                         ['cluster-0-0', 'cluster-0-1'])
+        cluster = self.cache.find_by_name(vim.ManagedEntity,
+                                          'cluster-0-1')[0]
+        hosts = self.cache.snapshot(vim.HostSystem, cluster.mor)
+        self.assertEqual(sorted(i.name for i in hosts),
+                         ['host-0-1-0', 'host-0-1-1'])
+
+    def test_rename(self):
+        vm = self.cache.find_by_name(vim.VirtualMachine, 'vm-00003')[0]
+        task.WaitForTask(vm.mor.Rename('renamed'), si=self.si)
+        self.assertTrue(wait_for(lambda: self.cache.find_by_name(
+            vim.VirtualMachine, 'renamed')))
+        self.assertEqual(self.cache.find_by_name(vim.VirtualMachine,
+                                                 'vm-00003'), [])
+        self.assertEqual(self.cache.get(vm.moid).name, 'renamed')
+
+    def test_enter_and_leave(self):
+        folder = self.stub.get_property(
+            self.cache.find_by_name(vim.Datacenter, 'dc-0')[0].mor,
+            'vmFolder')
+        added = fake.add_vm(self.stub, folder, 'vm-new')
+        self.assertTrue(wait_for(lambda: self.cache.get(added._moId)))
+        self.assertEqual(self.cache.get(added._moId).name, 'vm-new')
+        self.stub.remove(added)
+        self.assertTrue(wait_for(
+            lambda: self.cache.get(added._moId) is None))
+        self.assertEqual(self.cache.find_by_name(vim.VirtualMachine,
+                                                 'vm-new'), [])
+
+    def test_lookups_served_from_cache(self):
+        vc = vmwareapi.VirtualCenter('fake', 'user', 'pwd')
+        vc.si = self.si
+        vc.cache = self.cache
+        round_trips = self.stub.round_trips
+        for n in range(5):
+            vm = vc.get_entity_by_name(vmwareapi.VM, 'vm-%05d' % n)
+            self.assertEqual(vm.name, 'vm-%05d' % n)
+        # Only the root folder is read from vCenter
+        self.assertEqual(self.stub.round_trips, round_trips + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from pyVmomi import vim
+
+from pyVmomiwrapper import fake
+from pyVmomiwrapper import session
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        si = fake.create_service_instance(clusters=1, hosts_per_cluster=1,
+                                          vms=1)
+        self.stub = si._stub
+        self.pool = self.create_pool(keepalive_interval=0)
+
+    def create_pool(self, keepalive_interval):
+        return session.SessionPool(
+            keepalive_interval=keepalive_interval,
+            stub_factory=lambda host, verify, pool_size: self.stub)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_shared_per_host_and_user(self):
+        si = self.pool.acquire('vc', 'user', 'pwd')
+        self.assertIs(self.pool.acquire('vc', 'user', 'pwd'), si)
+        self.assertIsNot(self.pool.acquire('vc', 'other', 'pwd'), si)
+        self.assertEqual(self.pool.get_session(si).users, 2)
+        self.pool.release(si)
+        self.assertEqual(self.pool.get_session(si).users, 1)
+
+    def test_relogin_on_acquire(self):
+        si = self.pool.acquire('vc', 'user', 'pwd')
+        pooled = self.pool.get_session(si)
+        self.assertEqual(self.stub.sessions, 1)
+        self.pool.release(si)
+        self.stub.expire_sessions()
+        self.assertIs(self.pool.acquire('vc', 'user', 'pwd'), si)
+        self.assertEqual(self.stub.sessions, 2)
+        self.assertEqual(pooled.relogins, 1)
+        self.assertEqual(pooled.session_key, 'session-2')
+
+    def test_relogin_on_call(self):
+        self.pool = self.create_pool(keepalive_interval=3600)
+        si = self.pool.acquire('vc', 'user', 'pwd')
+        # The fake hands out references bound to itself, bind this one to
+        # the session stub like a deserialized reply would be
+        collector = vim.PropertyCollector(
+            si.content.propertyCollector._moId, si._stub)
+        collector.CreatePropertyCollector()
+        self.assertEqual(self.stub.sessions, 1)
+        self.stub.expire_sessions()
+        collector.CreatePropertyCollector()
+        self.assertEqual(self.stub.sessions, 2)
+        self.assertEqual(self.pool.get_session(si).relogins, 1)
+
+    def test_new_password_new_session(self):
+        si = self.pool.acquire('vc', 'user', 'pwd')
+        self.assertIsNot(self.pool.acquire('vc', 'user', 'new'), si)
+        self.assertEqual(self.stub.sessions, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
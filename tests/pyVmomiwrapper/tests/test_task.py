@@ -0,0 +1,63 @@
+import gc
+import time
+import unittest
+import weakref
+
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+from pyVmomiwrapper import fake
+from pyVmomiwrapper import task
+
+
+class TaskMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.si = fake.create_service_instance(clusters=1,
+                                               hosts_per_cluster=1, vms=20,
+                                               task_latency=0.01)
+        self.stub = self.si._stub
+        self.vms = [m for m in self.stub.mors.values()
+                    if isinstance(m, vim.VirtualMachine)]
+
+    def tearDown(self):
+        if self.si is not None:
+            task.StopTaskMonitor(self.si)
+
+    def test_one_filter_for_all_tasks(self):
+        futures = [task.MonitorTask(vm.PowerOff(), self.si)
+                   for vm in self.vms]
+        for future in futures:
+            self.assertEqual(future.result(10), None)
+            self.assertEqual(future.info.state, 'success')
+        self.assertEqual(len(self.stub.filters), 1)
+        self.assertEqual(task.GetTaskMonitor(self.si).pending(), 0)
+
+    def test_error_and_unknown_task(self):
+        vm = self.vms[0]
+        task.MonitorTask(vm.PowerOff(), self.si).result(10)
+        self.stub.remove(vm)
+        future = task.MonitorTask(vm.Destroy(), self.si)
+        self.assertIsInstance(future.exception(10),
+                              vmodl.fault.ManagedObjectNotFound)
+        future = task.MonitorTask(vim.Task('task-none', self.stub), self.si)
+        self.assertIsInstance(future.exception(10),
+                              vmodl.fault.ManagedObjectNotFound)
+
+    def test_monitor_dropped_with_stub(self):
+        task.MonitorTask(self.vms[0].PowerOff(), self.si).result(10)
+        monitor = weakref.ref(task.GetTaskMonitor(self.si))
+        self.si = self.stub = self.vms = None
+        gc.collect()
+        self.assertIsNone(monitor())
+
+    def test_stop_fails_pending(self):
+        self.stub.task_latency = 0.2
+        future = task.MonitorTask(self.vms[0].PowerOff(), self.si)
+        task.StopTaskMonitor(self.si)
+        self.assertIsInstance(future.exception(0.1), task.TaskTimeout)
+        # Let the fake complete the task before the next test
+        time.sleep(0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import threading
+import unittest
+
+from pyVmomi import vim
+
+from pyVmomiwrapper import fake
+from pyVmomiwrapper import task
+from pyVmomiwrapper import vmwareapi
+
+
+class FakeVCenterTest(unittest.TestCase):
+    """Runs the wrapper against the in-memory vCenter of fake.py."""
+
+    task_latency = 0.0
+
+    def setUp(self):
+        self.si = fake.create_service_instance(
+            clusters=1, hosts_per_cluster=2, vms=10,
+            task_latency=self.task_latency)
+        self.stub = self.si._stub
+        self.vc = vmwareapi.VirtualCenter('fake', 'user', 'pwd')
+        self.vc.si = self.si
+        self.dc = self.vc.get_datacenter('dc-0')
+
+    def tearDown(self):
+        task.StopTaskMonitor(self.si)
+
+    def get_vm(self, name):
+        return self.dc.get_vms(regex='^%s$' % name)[0]
+
+
+class PropertyCacheTest(FakeVCenterTest):
+    def test_volatile_parent_read_anew(self):
+        vm = self.get_vm('vm-00001')
+        self.assertEqual(vm.summary.runtime.powerState, 'poweredOn')
+        self.get_vm('vm-00001').poweroff()
+        self.assertEqual(vm.summary.runtime.powerState, 'poweredOff')
+
+    def test_stable_property_cached(self):
+        vm = self.get_vm('vm-00001')
+        vm.name
+        round_trips = self.stub.round_trips
+        self.assertEqual(vm.name, 'vm-00001')
+        self.assertEqual(self.stub.round_trips, round_trips)
+
+    def test_prefetched_volatile_served_once(self):
+        vm = self.get_vm('vm-00002')
+        round_trips = self.stub.round_trips
+        self.assertEqual(vm.get_state(), 'poweredOn')
+        self.assertEqual(self.stub.round_trips, round_trips)
+        vm.get_state()
+        self.assertGreater(self.stub.round_trips, round_trips)
+
+
+class BatchTest(FakeVCenterTest):
+    task_latency = 0.02
+
+    def test_run_batch_caps_tasks_in_flight(self):
+        vms = self.dc.get_vms(regex=r'^vm-')
+        lock = threading.Lock()
+        tasks = []
+        in_flight = []
+
+        def submit(vm):
+            with lock:
+                running = [t for t in tasks if self.stub.get_property(
+                    t, 'info').state == 'running']
+                in_flight.append(len(running) + 1)
+                task_ = vm._poweroff_task()
+                tasks.append(task_)
+            return task_
+
+        results = vmwareapi.run_batch(self.si, vms, submit, timeout=10,
+                                      max_concurrent=3)
+        self.assertEqual(sorted(results), sorted(vms))
+        self.assertTrue(all(r.succeeded for r in results.values()))
+        self.assertLessEqual(max(in_flight), 3)
+        self.assertEqual(max(in_flight), 3)
+
+    def test_run_batch_submit_failure(self):
+        vms = self.dc.get_vms(regex=r'^vm-')
+
+        def submit(vm):
+            if vm.name == 'vm-00003':
+                raise vim.fault.InvalidState()
+            return vm._poweroff_task()
+
+        for max_concurrent in (None, 2):
+            results = vmwareapi.run_batch(self.si, vms, submit, timeout=10,
+                                          max_concurrent=max_concurrent)
+            self.assertEqual(len(results), len(vms))
+            failed = [vm.name for vm, r in results.items()
+                      if not r.succeeded]
+            self.assertEqual(failed, ['vm-00003'])
+
+    def test_prefetch_one_round_trip(self):
+        vms = self.dc.get_vms(regex=r'^vm-')
+        for vm in vms:
+            vm.refresh()
+        round_trips = self.stub.round_trips
+        vmwareapi.prefetch(vms, ['name', 'config'])
+        # RetrieveServiceContent and RetrievePropertiesEx, whatever the
+        # number of VMs
+        round_trips += 2
+        self.assertEqual(self.stub.round_trips, round_trips)
+        self.assertEqual(sorted(vm.name for vm in vms),
+                         ['vm-%05d' % n for n in range(10)])
+        self.assertEqual(self.stub.round_trips, round_trips)
+
+    def test_cleanup_vms(self):
+        vms = self.dc.get_vms(regex=r'^vm-0000[0-4]$')
+        vms[0].poweroff()
+        report = vmwareapi.cleanup_vms(vms, max_concurrent=2, timeout=10)
+        self.assertEqual(sorted(report), sorted(vms))
+        self.assertTrue(all(r.succeeded for r in report.values()))
+        self.assertEqual(sorted(vm.name for vm in
+                                self.dc.get_vms(regex=r'^vm-')),
+                         ['vm-%05d' % n for n in range(5, 10)])
+
+    def test_add_nics_all(self):
+        vms = self.dc.get_vms(regex=r'^vm-0000[0-2]$')
+        pgs = self.dc.get_entities_by_regex(
+            vmwareapi.DistributedVirtualPortgroup, r'^dvpg-')
+        results = vmwareapi.add_nics_all(vms, pgs, timeout=10,
+                                         max_concurrent=2)
+        self.assertTrue(all(r.succeeded for r in results.values()))
+        for vm in vms:
+            devices = self.stub.get_property(vm.mor,
+                                             'config.hardware.device')
+            self.assertEqual(len(devices), len(pgs))
+
+
+class ClusterTest(FakeVCenterTest):
+    def setUp(self):
+        FakeVCenterTest.setUp(self)
+        self.cluster = self.dc.get_cluster('cluster-0-0')
+
+    def host_names(self):
+        return sorted(h.name for h in self.dc.get_entities_by_regex(
+            vmwareapi.Host, r'^'))
+
+    def test_add_hosts(self):
+        specs = [vim.host.ConnectSpec(hostName=name)
+                 for name in ('esx-1', 'esx-2')]
+        results = self.cluster.add_hosts(specs, timeout=10)
+        self.assertEqual(sorted(results), ['esx-1', 'esx-2'])
+        self.assertTrue(all(r.succeeded for r in results.values()))
+        self.assertIn('esx-2', self.host_names())
+
+    def test_add_hosts_rejects_duplicates(self):
+        specs = [vim.host.ConnectSpec(hostName=name)
+                 for name in ('esx-1', 'esx-2', 'esx-1')]
+        names = self.host_names()
+        self.assertRaises(ValueError, self.cluster.add_hosts, specs)
+        self.assertEqual(self.host_names(), names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,30 +1,63 @@
+import collections
 import contextlib
+import errno
+import fcntl
 import logging
 import os
+import select
+import signal
 import subprocess
+import threading
+import time
 
 
 LOG = logging.getLogger(__name__)
 
-GLOBAL_PWD = ['.']
+DEFAULT_WORKERS = 8
+# Seconds between SIGTERM and SIGKILL of a timed out command
+KILL_GRACE = 10
+READ_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 64 * 1024
+DEFAULT_TAIL_LINES = 100
+# Seconds between checks for commands that closed stdout but still run
+EXIT_POLL_INTERVAL = 0.1
+# Bytes buffered for a slow consumer of tee() before the source is paused
+MAX_PENDING = 4 * 1024 * 1024
+
+_state = threading.local()
 
 
 class CommandError(Exception):
     """Shell command exceptions"""
 
 
+def _pwd_stack():
+    stack = getattr(_state, 'pwd', None)
+    if stack is None:
+        stack = _state.pwd = ['.']
+    return stack
+
+
 @contextlib.contextmanager
 def cd(directory):
     """A context manager for switching the current working directory when
 
-    using the local() function. Not thread safe.
+    using the local() function. The directory applies to the current thread
+    only.
     """
 
-    global GLOBAL_PWD
-    GLOBAL_PWD.append(directory)
-    yield
-    if len(GLOBAL_PWD) > 1:
-        GLOBAL_PWD.pop()
+    stack = _pwd_stack()
+    stack.append(directory)
+    try:
+        yield
+    finally:
+        if len(stack) > 1:
+            stack.pop()
+
+
+def _cwd():
+    stack = _pwd_stack()
+    return stack[-1] if len(stack) > 1 else None
 
 
 def local(cmd, capture=True, pipefail=False, log_method='debug', env=None,
@@ -33,8 +66,8 @@ def local(cmd, capture=True, pipefail=False, log_method='debug', env=None,
 
     log_method = getattr(LOG, log_method)
 
-    if len(GLOBAL_PWD) > 1:
-        cmd = 'cd %s && %s' % (GLOBAL_PWD[-1], cmd)
+    if _cwd():
+        cmd = 'cd %s && %s' % (_cwd(), cmd)
 
     if pipefail:
         cmd = 'set -o pipefail && ' + cmd
@@ -62,3 +95,475 @@ def local(cmd, capture=True, pipefail=False, log_method='debug', env=None,
     if raise_error and process.returncode:
         raise CommandError('Failed to execute: %s' % cmd)
     return process.returncode, ''.join(buffer_)
+
+
+class LocalStream(object):
+    """Output of a running local command, read line by line
+
+    Iterating yields lines as the command prints them. Only the last
+    tail_lines lines are kept in memory, for error messages.
+    returncode is set once all output was read.
+    """
+
+    def __init__(self, cmd, pipefail=False, log_method='debug', env=None,
+                 raise_error=False, tee=None, tail_lines=DEFAULT_TAIL_LINES):
+        self.log_method = getattr(LOG, log_method)
+        if _cwd():
+            cmd = 'cd %s && %s' % (_cwd(), cmd)
+        if pipefail:
+            cmd = 'set -o pipefail && ' + cmd
+        self.cmd = cmd
+        self.raise_error = raise_error
+        self.tee = tee
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.returncode = None
+
+        env_vars = dict(os.environ.items() + env.items()) if env \
+            else os.environ
+        self.log_method('[local] run: %s' % cmd)
+        self.process = subprocess.Popen(cmd, shell=True,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=env_vars, executable='/bin/bash')
+        self._lines = self._read()
+
+    def __iter__(self):
+        return self._lines
+
+    def _read(self):
+        tee = open(self.tee, 'wb') if isinstance(self.tee, basestring) \
+            else self.tee
+        complete = False
+        try:
+            for line in iter(self.process.stdout.readline, ''):
+                self.log_method('[local] out: %s' %
+                                unicode(line.rstrip(), errors='ignore'))
+                if tee is not None:
+                    tee.write(line)
+                self.tail.append(line)
+                yield line
+            complete = True
+        finally:
+            if tee is not None and tee is not self.tee:
+                tee.close()
+            self.process.stdout.close()
+            if not complete and self.process.poll() is None:
+                # The caller stopped reading early
+                self.process.terminate()
+            self.returncode = self.process.wait()
+        if self.raise_error and self.returncode:
+            raise CommandError('Failed to execute: %s\n%s' %
+                               (self.cmd, ''.join(self.tail)))
+
+    def wait(self):
+        """Read all remaining output and return the return code."""
+        for _ in self._lines:
+            pass
+        return self.returncode
+
+
+def local_stream(cmd, pipefail=False, log_method='debug', env=None,
+                 raise_error=False, tee=None, tail_lines=DEFAULT_TAIL_LINES):
+    """Run a command locally and stream its output.
+
+    Memory use does not depend on the amount of output::
+
+        stream = local_stream('testr list-tests', tee='tests.log')
+        for line in stream:
+            ...
+        stream.returncode
+
+    :param tee: path or file object the complete output is written to.
+    :param tail_lines: number of last lines kept for error messages.
+    :param raise_error: raise CommandError with the last lines of output
+                        once the output was read, if the command failed.
+    :returns: LocalStream instance.
+    """
+    return LocalStream(cmd, pipefail, log_method, env, raise_error, tee,
+                       tail_lines)
+
+
+class OutputBuffer(object):
+    """Collect output, keeping at most the last max_bytes bytes"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.max_bytes is None:
+            return
+        while self.size - len(self.chunks[0]) >= self.max_bytes:
+            self.size -= len(self.chunks[0])
+            self.dropped += len(self.chunks.popleft())
+
+    def getvalue(self):
+        value = ''.join(self.chunks)
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            self.dropped += len(value) - self.max_bytes
+            value = value[-self.max_bytes:]
+            self.chunks = collections.deque([value])
+            self.size = len(value)
+        return value
+
+
+class Command(object):
+    """A command for run_parallel() and its outcome"""
+
+    def __init__(self, cmd, cwd=None, env=None, timeout=None,
+                 pipefail=False, capture=True, max_output=None, name=None):
+        """
+        :param cmd: shell command, run by bash.
+        :param cwd: working directory, the one of cd() if None.
+        :param env: dict of extra environment variables.
+        :param timeout: seconds after which the command is killed.
+        :param capture: whether to keep output in memory.
+        :param max_output: keep only the last max_output bytes of output.
+        :param name: label used in logs, defaults to cmd.
+        """
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.pipefail = pipefail
+        self.capture = capture
+        self.name = name or cmd
+        self.buffer = OutputBuffer(max_output)
+        self.returncode = None
+        self.timed_out = False
+        self.seconds = None
+        self.process = None
+        self._start = None
+        self._kill_at = None
+        self._line = ''
+
+    @property
+    def output(self):
+        return self.buffer.getvalue()
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0 and not self.timed_out
+
+    def __repr__(self):
+        return '<Command %s returncode %s %.1fs%s>' % (
+            self.name, self.returncode, self.seconds or 0,
+            ' timed out' if self.timed_out else '')
+
+    def _launch(self, log, stdin=None):
+        cmd = self.cmd
+        if self.pipefail:
+            cmd = 'set -o pipefail && ' + cmd
+        env = dict(os.environ.items() + self.env.items()) if self.env \
+            else os.environ
+        log('[local] run: %s' % cmd)
+        self._start = time.time()
+        # A process group of its own, so a timeout kills all children
+        self.process = subprocess.Popen(
+            cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, env=env, executable='/bin/bash',
+            cwd=self.cwd, preexec_fn=os.setsid, stdin=stdin)
+
+    def _feed(self, data, log):
+        if self.capture:
+            self.buffer.append(data)
+        if log is None:
+            return
+        lines = (self._line + data).split('\n')
+        self._line = lines.pop()
+        if len(self._line) > MAX_LINE_LENGTH:
+            lines.append(self._line)
+            self._line = ''
+        for line in lines:
+            log('[local] out: %s' % unicode(line.rstrip(), errors='ignore'))
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _check_timeout(self, now):
+        if self.timeout is None:
+            return
+        if self._kill_at is None and now - self._start > self.timeout:
+            LOG.warning('[local] %s timed out after %s seconds, terminate',
+                        self.name, self.timeout)
+            self.timed_out = True
+            self._kill_at = now + KILL_GRACE
+            self._signal(signal.SIGTERM)
+        elif self._kill_at is not None and now > self._kill_at:
+            self._kill_at = float('inf')
+            self._signal(signal.SIGKILL)
+
+    def _close_output(self, log):
+        """Close stdout at its EOF, the process may still be running."""
+        if self._line and log is not None:
+            log('[local] out: %s' % unicode(self._line, errors='ignore'))
+        self._line = ''
+        self.process.stdout.close()
+
+    def _exited(self):
+        """Return whether the process exited, without waiting for it."""
+        if self.process.poll() is None:
+            return False
+        self.returncode = self.process.returncode
+        self.seconds = time.time() - self._start
+        return True
+
+    def _finish(self, log):
+        if not self.process.stdout.closed:
+            self._close_output(log)
+        self.returncode = self.process.wait()
+        self.seconds = time.time() - self._start
+
+
+def _reap(exiting, log):
+    """Return the commands of exiting that are still running."""
+    running = []
+    for command in exiting:
+        if command._exited():
+            log('[local] %s exited with %s after %.1fs' %
+                (command.name, command.returncode, command.seconds))
+        else:
+            running.append(command)
+    return running
+
+
+def run_parallel(commands, max_workers=DEFAULT_WORKERS, log_method='debug',
+                 raise_error=False, poll_interval=1.0):
+    """Run local commands concurrently from one thread
+
+    At most max_workers commands run at once, the next one starts as soon
+    as one finished. Output of all commands is read as it arrives.
+
+    :param commands: list of command strings or Command instances.
+    :param raise_error: raise CommandError after all commands finished if
+                        any failed or timed out.
+    :param poll_interval: longest wait for output, timeouts are checked at
+                          least this often.
+    :returns: list of Command in the order of commands.
+    """
+    log = getattr(LOG, log_method)
+    # Formatting every line is expensive for commands with huge output
+    log_lines = log if LOG.isEnabledFor(
+        getattr(logging, log_method.upper(), logging.DEBUG)) else None
+    commands = [c if isinstance(c, Command) else Command(c)
+                for c in commands]
+    for command in commands:
+        if command.cwd is None:
+            command.cwd = _cwd()
+    pending = collections.deque(commands)
+    running = {}
+    # Commands that closed stdout but did not exit yet
+    exiting = []
+    poller = select.poll()
+    try:
+        while pending or running or exiting:
+            while pending and len(running) + len(exiting) < max_workers:
+                command = pending.popleft()
+                command._launch(log)
+                fd = command.process.stdout.fileno()
+                running[fd] = command
+                poller.register(fd, select.POLLIN)
+            try:
+                events = poller.poll(
+                    (EXIT_POLL_INTERVAL if exiting else poll_interval) * 1000)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                events = []
+            for fd, event in events:
+                command = running[fd]
+                data = os.read(fd, READ_SIZE)
+                if data:
+                    command._feed(data, log_lines)
+                else:
+                    poller.unregister(fd)
+                    del running[fd]
+                    command._close_output(log_lines)
+                    exiting.append(command)
+            exiting = _reap(exiting, log)
+            now = time.time()
+            for command in running.values() + exiting:
+                command._check_timeout(now)
+    finally:
+        for command in running.values() + exiting:
+            command._signal(signal.SIGKILL)
+            command._finish(log_lines)
+    failed = [c.name for c in commands if not c.succeeded]
+    if raise_error and failed:
+        raise CommandError('Failed to execute: %s' % '; '.join(failed))
+    return commands
+
+
+class _Sink(object):
+    """Write end of a pipe to a tee() consumer, with pending bytes"""
+
+    def __init__(self, command):
+        self.command = command
+        self.pipe = command.process.stdin
+        self.fd = self.pipe.fileno()
+        flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.pending = collections.deque()
+        self.size = 0
+        self.closed = False
+
+    def append(self, data):
+        if not self.closed:
+            self.pending.append(data)
+            self.size += len(data)
+
+    def flush(self):
+        """Write as much pending data as the pipe takes."""
+        while self.pending:
+            try:
+                written = os.write(self.fd, self.pending[0])
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return
+                if e.errno != errno.EPIPE:
+                    raise
+                LOG.warning('[local] %s stopped reading its input',
+                            self.command.name)
+                self.close()
+                return
+            self.size -= written
+            if written == len(self.pending[0]):
+                self.pending.popleft()
+            else:
+                self.pending[0] = self.pending[0][written:]
+
+    def close(self):
+        self.pending.clear()
+        self.size = 0
+        if not self.closed:
+            self.closed = True
+            try:
+                self.pipe.close()
+            except IOError:
+                pass
+
+
+def tee(source, consumers, files=(), log_method='debug', raise_error=False,
+        max_pending=MAX_PENDING, poll_interval=1.0):
+    """Feed the output of one command to several commands at once
+
+    The output of source is read once and written to the stdin of every
+    consumer and to every file as it arrives, so all consumers run
+    concurrently and the whole takes about as long as the slowest of them.
+    When a consumer falls more than max_pending bytes behind, reading the
+    source pauses until it caught up.
+
+    :param source: command string or Command.
+    :param consumers: list of command strings or Command instances, which
+                      read the source output from stdin.
+    :param files: paths the source output is written to as well.
+    :param raise_error: raise CommandError after all commands finished if
+                        any failed.
+    :returns: list of Command, source first and then the consumers.
+    """
+    log = getattr(LOG, log_method)
+    log_lines = log if LOG.isEnabledFor(
+        getattr(logging, log_method.upper(), logging.DEBUG)) else None
+    commands = [c if isinstance(c, Command) else Command(c)
+                for c in [source] + list(consumers)]
+    for command in commands:
+        if command.cwd is None:
+            command.cwd = _cwd()
+    source = commands[0]
+    outputs = [open(path, 'wb') for path in files]
+    poller = select.poll()
+    running = {}
+    exiting = []
+    sinks = {}
+    # Sinks waiting for POLLOUT
+    registered = set()
+    try:
+        for command in commands[1:]:
+            command._launch(log, stdin=subprocess.PIPE)
+            sink = _Sink(command)
+            sinks[sink.fd] = sink
+        source._launch(log)
+        for command in commands:
+            running[command.process.stdout.fileno()] = command
+        source_fd = source.process.stdout.fileno()
+        source_done = False
+
+        while running or exiting:
+            for fd, command in running.items():
+                mask = select.POLLIN
+                if fd == source_fd and max(
+                        [s.size for s in sinks.values()] or [0]) > \
+                        max_pending:
+                    mask = 0
+                poller.register(fd, mask)
+            for fd, sink in sinks.items():
+                if sink.pending:
+                    poller.register(fd, select.POLLOUT)
+                    registered.add(fd)
+            try:
+                events = poller.poll(
+                    (EXIT_POLL_INTERVAL if exiting else poll_interval) * 1000)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                events = []
+            for fd, event in events:
+                if fd in sinks:
+                    sink = sinks[fd]
+                    poller.unregister(fd)
+                    registered.discard(fd)
+                    if event & (select.POLLERR | select.POLLHUP):
+                        sink.close()
+                    else:
+                        sink.flush()
+                    if sink.closed or (source_done and not sink.pending):
+                        sink.close()
+                        del sinks[fd]
+                    continue
+                command = running[fd]
+                data = os.read(fd, READ_SIZE)
+                if data:
+                    command._feed(data, log_lines)
+                    if fd == source_fd:
+                        for f in outputs:
+                            f.write(data)
+                        for sink in sinks.values():
+                            sink.append(data)
+                    continue
+                poller.unregister(fd)
+                del running[fd]
+                command._close_output(log_lines)
+                exiting.append(command)
+                if fd == source_fd:
+                    source_done = True
+                    for sink_fd, sink in sinks.items():
+                        if not sink.pending:
+                            if sink_fd in registered:
+                                poller.unregister(sink_fd)
+                                registered.discard(sink_fd)
+                            sink.close()
+                            del sinks[sink_fd]
+            exiting = _reap(exiting, log)
+            now = time.time()
+            for command in running.values() + exiting:
+                command._check_timeout(now)
+    finally:
+        for f in outputs:
+            f.close()
+        for sink in sinks.values():
+            sink.close()
+        for command in running.values() + exiting:
+            command._signal(signal.SIGKILL)
+            command._finish(log_lines)
+    failed = [c.name for c in commands if not c.succeeded]
+    if raise_error and failed:
+        raise CommandError('Failed to execute: %s' % '; '.join(failed))
+    return commands
@@ -13,6 +13,72 @@ class ShellTest(unittest.TestCase):
             code, output = shell.local("pwd")
             self.assertEqual(output, '/tmp\n')
 
+    def test_run_parallel(self):
+        with shell.cd("/tmp"):
+            commands = shell.run_parallel(
+                ['pwd',
+                 shell.Command('echo $FOO', env={'FOO': 'bar'}, cwd='/'),
+                 shell.Command('sleep 10', timeout=0.5),
+                 'exit 3'], max_workers=2, poll_interval=0.1)
+        self.assertEqual([c.output for c in commands[:2]],
+                         ['/tmp\n', 'bar\n'])
+        self.assertTrue(commands[2].timed_out)
+        self.assertEqual(commands[3].returncode, 3)
+        self.assertEqual([c.succeeded for c in commands],
+                         [True, True, False, False])
+
+    def test_run_parallel_closed_stdout(self):
+        commands = shell.run_parallel(
+            [shell.Command('echo bye; exec >&- 2>&-; sleep 600',
+                           timeout=0.5),
+             'sleep 0.2; echo done'], poll_interval=0.1)
+        self.assertTrue(commands[0].timed_out)
+        self.assertEqual(commands[0].output, 'bye\n')
+        self.assertEqual(commands[1].output, 'done\n')
+        self.assertLess(max(c.seconds for c in commands), 5)
+
+    def test_run_parallel_max_output(self):
+        command = shell.run_parallel(
+            [shell.Command('seq 1 10000', max_output=6)])[0]
+        self.assertEqual(command.output, '10000\n')
+
+    def test_local_stream(self):
+        stream = shell.local_stream('seq 1 5; exit 2', tail_lines=2)
+        self.assertEqual(list(stream), ['1\n', '2\n', '3\n', '4\n', '5\n'])
+        self.assertEqual(stream.returncode, 2)
+        self.assertEqual(list(stream.tail), ['4\n', '5\n'])
+
+    def test_local_stream_error(self):
+        stream = shell.local_stream('echo oops; false', raise_error=True)
+        with self.assertRaisesRegexp(shell.CommandError, 'oops'):
+            stream.wait()
+
+    def test_tee(self):
+        path = '/tmp/test_tee.txt'
+        commands = shell.tee('seq 1 100000',
+                             ['wc -l', 'tail -n 1', 'head -n 1'],
+                             files=[path], max_pending=1024)
+        self.assertEqual([c.output.strip() for c in commands[1:]],
+                         ['100000', '100000', '1'])
+        self.assertTrue(all(c.succeeded for c in commands))
+        with open(path) as f:
+            self.assertEqual(f.read(), commands[0].output)
+
+
+class OutputBufferTest(unittest.TestCase):
+    def test_unlimited(self):
+        buffer_ = shell.OutputBuffer()
+        for data in ('abc', 'def'):
+            buffer_.append(data)
+        self.assertEqual(buffer_.getvalue(), 'abcdef')
+
+    def test_keeps_tail(self):
+        buffer_ = shell.OutputBuffer(4)
+        for data in ('abc', 'def', 'gh'):
+            buffer_.append(data)
+        self.assertEqual(buffer_.getvalue(), 'efgh')
+        self.assertEqual(buffer_.dropped, 4)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,182 @@
+"""Run commands on many hosts reachable by SSH at once."""
+
+import collections
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from remote import RemoteClient
+from remote import RemoteError
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+
+
+class HostResult(object):
+    """Outcome of one command on one host"""
+
+    def __init__(self, host, cmd):
+        self.host = host
+        self.cmd = cmd
+        self.output = None
+        self.exit_status = None
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.exit_status == 0
+
+    def __repr__(self):
+        return '<HostResult %s exit %s %.1fs%s>' % (
+            self.host, self.exit_status, self.seconds,
+            ' error: %s' % self.error if self.error else '')
+
+
+class GroupResult(collections.OrderedDict):
+    """HostResult instances keyed by host, in the order of the group"""
+
+    @property
+    def succeeded(self):
+        return [host for host, result in self.items() if result.succeeded]
+
+    @property
+    def failed(self):
+        return [host for host, result in self.items()
+                if not result.succeeded]
+
+    @property
+    def seconds(self):
+        """Time of the slowest host."""
+        return max([result.seconds for result in self.values()] or [0.0])
+
+    def raise_for_status(self):
+        """Raise RemoteError if the command failed on any host."""
+        if self.failed:
+            raise RemoteError('Failed on hosts %s: %s' % (
+                ', '.join(self.failed),
+                '; '.join('%s: %s' % (host, self[host].error or
+                                      'exit status %s' %
+                                      self[host].exit_status)
+                          for host in self.failed)))
+
+
+class RemoteGroup(object):
+    """A set of hosts reachable by SSH
+
+    Every host keeps its own RemoteClient, so the SSH connection is set up
+    once and reused by later calls. Hosts are worked on concurrently by at
+    most max_workers threads, commands on one host run one after another.
+    """
+
+    def __init__(self, hosts, user=None, password=None,
+                 max_workers=DEFAULT_WORKERS, pooled=False):
+        """
+        :param hosts: list of IP addresses or RemoteClient instances. Use
+                      RemoteClient instances for hosts with other
+                      credentials.
+        :param user: Username of user to login with
+        :param password: Password of user to login with
+        :param max_workers: maximum number of hosts worked on at once.
+        :param pooled: use connections of the process-wide pool.
+        """
+        self.clients = collections.OrderedDict()
+        for host in hosts:
+            if not isinstance(host, RemoteClient):
+                host = RemoteClient(host, user, password, pooled=pooled)
+            self.clients[host.host_ip] = host
+        self.max_workers = max_workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.clients)
+
+    @property
+    def hosts(self):
+        return self.clients.keys()
+
+    def _map(self, func, hosts):
+        if not hosts:
+            return GroupResult()
+        pool = ThreadPool(min(self.max_workers, len(hosts)))
+        try:
+            results = pool.map(func, hosts)
+        finally:
+            pool.close()
+            pool.join()
+        group_result = GroupResult((r.host, r) for r in results)
+        LOG.debug('Finished on %d hosts in %.1fs, failed: %s',
+                  len(group_result), group_result.seconds,
+                  group_result.failed)
+        return group_result
+
+    def run(self, cmd, raise_error=False, **kwargs):
+        """Run commands on all hosts of the group concurrently
+
+        :param cmd: command to run on every host, or dict mapping host to
+                    the command to run on it. Hosts not in the dict are
+                    skipped.
+        :param raise_error: raise RemoteError after all hosts finished if
+                            the command failed on any of them.
+        :param kwargs: passed on to RemoteClient.run, e.g. sudo or
+                       env_vars.
+        :returns: GroupResult instance.
+        """
+        if isinstance(cmd, dict):
+            commands = cmd
+            hosts = [host for host in self.clients if host in commands]
+        else:
+            commands = dict.fromkeys(self.clients, cmd)
+            hosts = self.clients.keys()
+
+        def run(host):
+            result = HostResult(host, commands[host])
+            client = self.clients[host]
+            start = time.time()
+            try:
+                result.output = client.run(commands[host], **kwargs)
+                result.exit_status = client.last_exit_status
+            except Exception as e:
+                LOG.debug('[%s] run failed', host, exc_info=True)
+                result.error = e
+            result.seconds = time.time() - start
+            return result
+
+        group_result = self._map(run, hosts)
+        if raise_error:
+            group_result.raise_for_status()
+        return group_result
+
+    def scp(self, src, dest, raise_error=False, **kwargs):
+        """Transfer a local file to dest on all hosts concurrently
+
+        :returns: GroupResult instance.
+        """
+        def scp(host):
+            result = HostResult(host, 'scp %s %s' % (src, dest))
+            start = time.time()
+            try:
+                self.clients[host].scp(src, dest, **kwargs)
+                result.exit_status = 0
+            except Exception as e:
+                LOG.debug('[%s] scp failed', host, exc_info=True)
+                result.error = e
+            result.seconds = time.time() - start
+            return result
+
+        group_result = self._map(scp, self.clients.keys())
+        if raise_error:
+            group_result.raise_for_status()
+        return group_result
+
+    def close(self):
+        """Close the SSH connections of all hosts."""
+        for client in self.clients.values():
+            client.close()
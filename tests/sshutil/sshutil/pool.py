@@ -0,0 +1,200 @@
+"""Process-wide pool of reusable SSH connections"""
+
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+import paramiko
+
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between SSH keepalive messages on pooled transports
+KEEPALIVE_INTERVAL = 30
+# Channels open at once on one connection, sshd allows 10 by default
+MAX_SESSIONS = 8
+
+
+def connect(host, user, password=None):
+    """Return a connected paramiko.SSHClient."""
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(host, username=user, password=password)
+    return client
+
+
+def is_alive(client):
+    transport = client.get_transport() if client else None
+    return transport is not None and transport.is_active()
+
+
+class ChannelLimiter(object):
+    """Bound the channels open at once on one SSH connection.
+
+    Holders of idle channels, like SFTPSessions, register to be asked to
+    close them when no channel is left.
+    """
+
+    def __init__(self, limit=MAX_SESSIONS):
+        self.semaphore = threading.Semaphore(limit)
+        self.idle_holders = weakref.WeakSet()
+
+    def acquire(self, blocking=True):
+        if self.semaphore.acquire(False):
+            return True
+        for holder in list(self.idle_holders):
+            holder.close_idle()
+        return self.semaphore.acquire(blocking)
+
+    def release(self):
+        self.semaphore.release()
+
+
+_limiters = weakref.WeakKeyDictionary()
+_channels = weakref.WeakKeyDictionary()
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(client):
+    """Return the ChannelLimiter of the connection of client."""
+    transport = client.get_transport()
+    with _limiters_lock:
+        limiter = _limiters.get(transport)
+        if limiter is None:
+            limiter = _limiters[transport] = ChannelLimiter(MAX_SESSIONS)
+        return limiter
+
+
+def open_session(client, blocking=True):
+    """Open a channel, waiting while MAX_SESSIONS channels are open.
+
+    Channels must be closed with close_channel().
+
+    :returns: the channel, None if not blocking and no channel is left.
+    """
+    limiter = get_limiter(client)
+    if not limiter.acquire(blocking):
+        return None
+    try:
+        channel = client.get_transport().open_session()
+    except Exception:
+        limiter.release()
+        raise
+    with _limiters_lock:
+        _channels[channel] = limiter
+    return channel
+
+
+def close_channel(channel):
+    """Close a channel of open_session() and free its place."""
+    channel.close()
+    with _limiters_lock:
+        limiter = _channels.pop(channel, None)
+    if limiter is not None:
+        limiter.release()
+
+
+class PooledConnection(object):
+    """An SSH connection shared by all users of (host, user)."""
+
+    def __init__(self, host, user, password):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.client = None
+        self.connects = 0
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def get(self, keepalive_interval=KEEPALIVE_INTERVAL):
+        """Return the live client, connecting again if the transport died.
+
+        Only one thread connects, others wait for it.
+        """
+        with self.lock:
+            if not is_alive(self.client):
+                if self.client is not None:
+                    LOG.info('[%s] SSH connection lost, reconnect',
+                             self.host)
+                    self.client.close()
+                self.client = connect(self.host, self.user, self.password)
+                self.client.get_transport().set_keepalive(
+                    keepalive_interval)
+                self.connects += 1
+            self.last_used = time.time()
+            return self.client
+
+    def invalidate(self, client):
+        """Drop client if it is still the pooled one."""
+        with self.lock:
+            if client is self.client:
+                self.client.close()
+                self.client = None
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+
+class ConnectionPool(object):
+    """Share one SSH connection per (host, user) across the process.
+
+    Connections are opened on first checkout and carry SSH keepalives, so a
+    dead peer is noticed and the next checkout connects again. paramiko
+    transports multiplex channels, so any number of threads can run
+    commands over the same connection at once. Connections stay open until
+    close_all() is called, at the latest when the process exits.
+    """
+
+    def __init__(self, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.keepalive_interval = keepalive_interval
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def _connection(self, host, user, password):
+        key = (host, user)
+        with self.lock:
+            connection = self.connections.get(key)
+            if connection is None or connection.password != password:
+                if connection is not None:
+                    connection.close()
+                connection = PooledConnection(host, user, password)
+                self.connections[key] = connection
+            return connection
+
+    def acquire(self, host, user, password=None):
+        """Return a live paramiko.SSHClient for (host, user)."""
+        connection = self._connection(host, user, password)
+        return connection.get(self.keepalive_interval)
+
+    def invalidate(self, host, user, client):
+        """Close client so that the next acquire() connects again."""
+        with self.lock:
+            connection = self.connections.get((host, user))
+        if connection is not None:
+            connection.invalidate(client)
+
+    def close_all(self):
+        """Close all pooled connections."""
+        with self.lock:
+            connections, self.connections = self.connections.values(), {}
+        for connection in connections:
+            connection.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide ConnectionPool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close_all)
+        return _pool
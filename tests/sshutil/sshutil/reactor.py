@@ -0,0 +1,458 @@
+"""Non-blocking remote commands driven by a single-thread event loop
+
+A Reactor polls the channels of all running commands from one thread, so
+hundreds of commands can be in flight at once without a thread each.
+AsyncRemoteClient has the surface of RemoteClient but returns Operation
+objects instead of blocking::
+
+    reactor = Reactor()
+    ops = [AsyncRemoteClient(ip, 'viouser', 'vmware', reactor).run('uptime')
+           for ip in ips]
+    while not all(op.done() for op in ops):
+        reactor.poll(1.0)
+        ...  # poll REST APIs, vSphere tasks
+    outputs = [op.result() for op in ops]
+
+Either call poll() from the caller's own loop, or start() the reactor on a
+background thread and wait for operations with result() or wait().
+"""
+
+import collections
+import logging
+import select
+import threading
+import time
+
+import pool
+from remote import EXIT_DRAIN_TIMEOUT
+from remote import LineSplitter
+from remote import MAX_CHUNK_SIZE
+from remote import OutputBuffer
+from remote import RemoteClient
+from remote import RemoteError
+
+
+LOG = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5
+# Seconds between checks of commands which closed stdout but did not exit
+EXIT_POLL_INTERVAL = 0.1
+# Threads opening channels and starting commands, which may take a login
+START_WORKERS = 4
+
+
+class Operation(object):
+    """Result of a remote operation that may not have finished yet."""
+
+    def __init__(self, reactor, host, cmd):
+        self.reactor = reactor
+        self.host = host
+        self.cmd = cmd
+        self.output = None
+        self.exit_status = None
+        self.error = None
+        self.start = time.time()
+        self.seconds = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._event.is_set()
+
+    def add_done_callback(self, func):
+        """Call func with this operation once it finished."""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def result(self, timeout=None):
+        """Wait for the operation and return its output.
+
+        :raises: the error of the operation, RemoteError if it did not
+                 finish within timeout seconds.
+        """
+        if not self.reactor.wait([self], timeout):
+            raise RemoteError('In host %s %s did not finish in %s seconds' %
+                              (self.host, self.cmd, timeout))
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+    def _finish(self, output=None, error=None):
+        self.output = output
+        self.error = error
+        self.seconds = time.time() - self.start
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                LOG.exception('Callback of %s failed', self.cmd)
+
+    def __repr__(self):
+        state = 'exit %s' % self.exit_status if self.done() else 'running'
+        return '<Operation %s %s %s>' % (self.host, self.cmd, state)
+
+
+class _Command(object):
+    """Output handling of one command running on a channel"""
+
+    def __init__(self, op, channel, capture, raise_error, log, callback,
+                 max_output):
+        self.op = op
+        self.channel = channel
+        self.capture = capture
+        self.raise_error = raise_error
+        self.log = log
+        self.callback = callback
+        self.buffer = OutputBuffer(max_output)
+        self.splitter = LineSplitter()
+        # Time the command was seen exited with no output pending
+        self.idle_since = None
+
+    def handle(self, lines):
+        for line in lines:
+            self.log('[%s] out: %s' % (self.op.host, line.rstrip()))
+            if self.callback:
+                self.callback(line)
+
+    def feed(self, data):
+        self.idle_since = None
+        if self.capture:
+            self.buffer.append(data)
+        self.handle(self.splitter.feed(data))
+
+    def finish(self):
+        self.handle(self.splitter.close())
+        self.op.exit_status = self.channel.recv_exit_status()
+        pool.close_channel(self.channel)
+        error = None
+        if self.raise_error and self.op.exit_status:
+            error = RemoteError('In host %s failed to execute: %s' %
+                                (self.op.host, self.op.cmd))
+        self.op._finish(self.buffer.getvalue(), error)
+
+
+class Reactor(object):
+    """Event loop reading the output of many remote commands.
+
+    poll(), add() and wait() may be called from any thread, polls of
+    several threads run one after the other.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+        self.commands = {}
+        # Commands which closed stdout, waiting for their exit status
+        self.exiting = {}
+        # (op, start) of operations waiting for a free channel
+        self.pending = collections.deque()
+        # (op, start) of operations handed to the starter threads
+        self.starting = collections.deque()
+        self.starters = 0
+        self.in_start = 0
+        self.pending_lock = threading.Lock()
+        self.last_start = 0
+        self.poller = select.poll()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        with self.pending_lock:
+            waiting = len(self.pending) + len(self.starting) + self.in_start
+        return len(self.commands) + len(self.exiting) + waiting
+
+    def add(self, command):
+        fd = command.channel.fileno()
+        with self.lock:
+            self.commands[fd] = command
+            self.poller.register(fd, select.POLLIN)
+
+    def submit(self, op, start):
+        """Start an operation now or once its connection has a free channel.
+
+        :param start: function starting the operation and returning True,
+                      or False if no channel is free.
+        """
+        with self.pending_lock:
+            self.pending.append((op, start))
+        self._start_pending()
+
+    def _start_pending(self):
+        """Hand operations waiting for a channel to the starter threads.
+
+        Opening a channel may connect and starting a command may log in
+        with sudo, neither of which may hold up the polling thread.
+        """
+        with self.pending_lock:
+            self.last_start = time.time()
+            self.starting.extend(self.pending)
+            self.pending.clear()
+            threads = min(len(self.starting), START_WORKERS - self.starters)
+            self.starters += max(threads, 0)
+        for _ in range(threads):
+            thread = threading.Thread(target=self._run_starts,
+                                      name='sshutil-start')
+            thread.daemon = True
+            thread.start()
+
+    def _run_starts(self):
+        while True:
+            with self.pending_lock:
+                if not self.starting:
+                    self.starters -= 1
+                    return
+                op, start = self.starting.popleft()
+                self.in_start += 1
+            try:
+                if not start():
+                    with self.pending_lock:
+                        self.pending.append((op, start))
+            except Exception as e:
+                LOG.debug('[%s] start failed', op.host, exc_info=True)
+                op._finish(error=e)
+            finally:
+                with self.pending_lock:
+                    self.in_start -= 1
+
+    def _remove(self, fd):
+        with self.lock:
+            self.poller.unregister(fd)
+            return self.commands.pop(fd)
+
+    def poll(self, timeout=0):
+        """Read output of ready commands, waiting up to timeout seconds.
+
+        :returns: number of commands that finished.
+        """
+        with self.poll_lock:
+            return self._poll(timeout)
+
+    def _poll(self, timeout):
+        if self.pending and \
+                time.time() - self.last_start >= POLL_INTERVAL:
+            # Channels of the connection may have been freed by others
+            self._start_pending()
+        if self.exiting:
+            timeout = min(timeout, EXIT_POLL_INTERVAL)
+        finished = 0
+        if not self.commands:
+            # poll() with no registered fds returns at once
+            time.sleep(timeout)
+            ready = []
+        else:
+            ready = self.poller.poll(timeout * 1000)
+        for fd, event in ready:
+            command = self.commands.get(fd)
+            if command is None:
+                continue
+            try:
+                channel = command.channel
+                while channel.recv_ready():
+                    command.feed(channel.recv(MAX_CHUNK_SIZE))
+                if channel.eof_received:
+                    # The command may run on with stdout closed, wait for
+                    # its exit status without blocking the other commands
+                    self._remove(fd)
+                    if channel.exit_status_ready():
+                        command.finish()
+                        finished += 1
+                    else:
+                        self.exiting[fd] = command
+            except Exception as e:
+                LOG.debug('[%s] read failed', command.op.host, exc_info=True)
+                if fd in self.commands:
+                    self._remove(fd)
+                pool.close_channel(command.channel)
+                command.op._finish(error=e)
+                finished += 1
+        finished += self._finish_exited()
+        if finished and self.pending:
+            self._start_pending()
+        return finished
+
+    def _finish(self, command):
+        try:
+            command.finish()
+        except Exception as e:
+            pool.close_channel(command.channel)
+            command.op._finish(error=e)
+
+    def _finish_exited(self):
+        """Finish commands that exited but keep stdout open, or that
+        closed stdout and exited since.
+
+        A background process of the command may hold the channel open.
+        Like RemoteClient._read, output is read for EXIT_DRAIN_TIMEOUT
+        seconds after the exit.
+        """
+        finished = 0
+        for fd, command in self.exiting.items():
+            if command.channel.exit_status_ready():
+                del self.exiting[fd]
+                self._finish(command)
+                finished += 1
+        now = time.time()
+        for fd, command in self.commands.items():
+            channel = command.channel
+            if not channel.exit_status_ready() or channel.recv_ready():
+                continue
+            command.idle_since = command.idle_since or now
+            if now - command.idle_since < EXIT_DRAIN_TIMEOUT:
+                continue
+            self._remove(fd)
+            self._finish(command)
+            finished += 1
+        return finished
+
+    def wait(self, ops, timeout=None):
+        """Wait until all operations finished.
+
+        Polls the reactor unless it runs on its own thread.
+
+        :returns: True if all finished, False after timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for op in ops:
+            while not op.done():
+                remaining = POLL_INTERVAL
+                if deadline is not None:
+                    remaining = min(remaining, deadline - time.time())
+                    if remaining <= 0:
+                        return False
+                if self.running or op.reactor is not self or \
+                        not self.poll_lock.acquire(False):
+                    # Another thread polls
+                    op._event.wait(min(remaining, EXIT_POLL_INTERVAL))
+                    continue
+                try:
+                    self._poll(remaining)
+                finally:
+                    self.poll_lock.release()
+        return True
+
+    def run_in_thread(self, host, name, func, *args, **kwargs):
+        """Run a blocking func on a thread of its own.
+
+        For operations without a pollable channel, like SFTP transfers.
+
+        :returns: Operation with the return value of func as output.
+        """
+        op = Operation(self, host, name)
+
+        def run():
+            try:
+                op.exit_status = 0
+                op._finish(func(*args, **kwargs))
+            except Exception as e:
+                op._finish(error=e)
+
+        thread = threading.Thread(target=run, name='sshutil-%s' % name)
+        thread.daemon = True
+        thread.start()
+        return op
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Run the event loop on a background thread."""
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run_forever,
+                                        name='sshutil-reactor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_forever(self):
+        while not self._stopped.is_set():
+            self.poll(POLL_INTERVAL)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class AsyncRemoteClient(RemoteClient):
+    """RemoteClient whose run, scp and get return Operation objects.
+
+    Opening the channel and starting the command, which may connect or log
+    in with sudo, happen on up to START_WORKERS starter threads of the
+    reactor. Reading the output happens in the reactor. Clients are pooled
+    by default, so all clients of a host share one connection. Commands
+    beyond the pool.MAX_SESSIONS channels of a connection are queued in the
+    reactor and started as running ones finish.
+    """
+
+    def __init__(self, host_ip, user, password=None, reactor=None,
+                 pooled=True):
+        """
+        :param reactor: Reactor to run in, a new one if None.
+        Other parameters are those of RemoteClient.
+        """
+        super(AsyncRemoteClient, self).__init__(host_ip, user, password,
+                                                pooled=pooled)
+        self.reactor = reactor if reactor is not None else Reactor()
+
+    def run(self, cmd, capture=True, sudo=False, env_vars=None,
+            raise_error=False, log_method='debug', feed_input=None,
+            callback=None, max_output=None):
+        """Start a command on the host
+
+        Parameters are those of RemoteClient.run.
+
+        :returns: Operation, its result() is the output of the command.
+        """
+        log = getattr(LOG, log_method)
+        op = Operation(self.reactor, self.host_ip, cmd)
+        op.add_done_callback(self._set_exit_status)
+
+        def start():
+            channel = self._open_session(blocking=False)
+            if channel is None:
+                return False
+            try:
+                op.cmd = self._start(channel, cmd, sudo, env_vars,
+                                     feed_input, log)
+            except Exception:
+                pool.close_channel(channel)
+                raise
+            self.reactor.add(_Command(op, channel, capture, raise_error,
+                                      log, callback, max_output))
+            return True
+
+        self.reactor.submit(op, start)
+        return op
+
+    def _set_exit_status(self, op):
+        self.last_exit_status = op.exit_status
+
+    def scp(self, src, dest, log_method='debug', **kwargs):
+        """Start transferring a local file to the remote host
+
+        :returns: Operation, its result() is a TransferResult.
+        """
+        return self.reactor.run_in_thread(
+            self.host_ip, 'scp %s %s' % (src, dest),
+            super(AsyncRemoteClient, self).scp, src, dest, log_method,
+            **kwargs)
+
+    def get(self, src, dest, log_method='debug', **kwargs):
+        """Start transferring a remote file to the local host
+
+        :returns: Operation, its result() is a TransferResult.
+        """
+        return self.reactor.run_in_thread(
+            self.host_ip, 'get %s %s' % (src, dest),
+            super(AsyncRemoteClient, self).get, src, dest, log_method,
+            **kwargs)
@@ -1,26 +1,88 @@
 """This module contains class that represents a host reachable by SSH."""
 
 import logging
+import os
 import paramiko
+import pipes
 import re
 import select
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from shellutil.shell import OutputBuffer
+
+import pool
+import transfer
 
 
 LOG = logging.getLogger(__name__)
 
+MIN_CHUNK_SIZE = 4096
+MAX_CHUNK_SIZE = 256 * 1024
+MAX_LINE_LENGTH = 64 * 1024
+# Channels used at once by run_parallel
+MAX_CHANNELS = 8
+# Seconds output is still read after the command exited
+EXIT_DRAIN_TIMEOUT = 2
+# Seconds to wait for sudo to prompt or start the command
+SUDO_TIMEOUT = 60
+LINE_END = re.compile('\r\n|\r|\n')
+
 
 class RemoteError(Exception):
     """Remote command exceptions"""
 
 
+class LineSplitter(object):
+    """Split a byte stream into decoded lines
+
+    \\r\\n, \\r and \\n end a line, also when split across two chunks.
+    Lines longer than max_length are split so memory stays bounded.
+    """
+
+    def __init__(self, encoding='utf-8', max_length=MAX_LINE_LENGTH):
+        self.encoding = encoding
+        self.max_length = max_length
+        self.pending = ''
+
+    def _decode(self, text):
+        return text.decode(self.encoding, 'replace')
+
+    def feed(self, data):
+        """Return the lines completed by data."""
+        text = self.pending + data
+        lines = []
+        pos = 0
+        for match in LINE_END.finditer(text):
+            if match.group() == '\r' and match.end() == len(text):
+                # \r\n may be split across chunks
+                break
+            lines.append(self._decode(text[pos:match.end()]))
+            pos = match.end()
+        while len(text) - pos > self.max_length:
+            lines.append(self._decode(text[pos:pos + self.max_length]))
+            pos += self.max_length
+        self.pending = text[pos:]
+        return lines
+
+    def close(self):
+        """Return the unterminated last line, if any."""
+        text, self.pending = self.pending, ''
+        return [self._decode(text)] if text else []
+
+
 class RemoteClient(object):
     """Representation of a host reachable by SSH"""
 
-    def __init__(self, host_ip, user, password=None):
+    def __init__(self, host_ip, user, password=None, pooled=False):
         """
         :param host_ip: IP address of host
         :param user: Username of user to login with
         :param password: Password of user to login with
+        :param pooled: share the SSH connection of (host_ip, user) with all
+                       other pooled clients of the process. See pool.py.
         :param alt_logger: Alternative logger to use instead of this module's
                            logger. Used only in run() method.
         :param alt_log_method: Alternative logger method to use when
@@ -29,11 +91,15 @@ class RemoteClient(object):
         self.host_ip = host_ip
         self.user = user
         self.password = password
+        self.pooled = pooled
         self.client = None
+        self.lock = threading.RLock()
+        self.sftp_sessions = transfer.SFTPSessions(self._live_client)
         self.last_exit_status = None
 
     def run(self, cmd, capture=True, sudo=False, env_vars=None,
-            raise_error=False, log_method='debug', feed_input=None):
+            raise_error=False, log_method='debug', feed_input=None,
+            callback=None, max_output=None, output_file=None):
         """Run a command on the host and return its output
         :param cmd: Command to run on host
         :param capture: Whether to save and return output from command run
@@ -41,13 +107,172 @@ class RemoteClient(object):
         :param env_vars: dict that contains environment variable to be set
         :param raise_error: raise exception if exit status is not zero.
         :param log_method: log method of logger.
+        :param feed_input: text sent to the command after it started.
+        :param callback: function called with every decoded output line.
+        :param max_output: keep only the last max_output bytes of output in
+                           memory. Unlimited if None.
+        :param output_file: file object the complete raw output is written
+                            to, e.g. a tempfile for commands with huge
+                            output.
         """
-        log_method = getattr(LOG, log_method)
-        if not self.client:
-            self._set_client()
+        output, self.last_exit_status, cmd = self._run(
+            cmd, capture, sudo, env_vars, log_method, feed_input, callback,
+            max_output, output_file)
+        if raise_error and self.last_exit_status:
+            raise RemoteError('In host %s failed to execute: %s' %
+                              (self.host_ip, cmd))
+        return output
+
+    def run_parallel(self, cmds, max_channels=MAX_CHANNELS,
+                     raise_error=False, **kwargs):
+        """Run commands at the same time over the one SSH connection
+
+        Every command gets its own channel of the connection.
+        last_exit_status is not changed.
+
+        :param cmds: list of commands.
+        :param max_channels: maximum number of commands running at once.
+                             sshd allows 10 per connection by default.
+        :param raise_error: raise RemoteError after all commands finished
+                            if any exit status is not zero.
+        :param kwargs: passed on to run().
+        :returns: list of (exit status, output) in the order of cmds.
+        """
+        if not cmds:
+            return []
+        self.check_connection()
+
+        def run(cmd):
+            output, exit_status, cmd = self._run(cmd, **kwargs)
+            return exit_status, output
+
+        workers = ThreadPool(min(max_channels, len(cmds)))
+        try:
+            results = workers.map(run, cmds)
+        finally:
+            workers.close()
+            workers.join()
+        failed = [cmd for cmd, (exit_status, output) in zip(cmds, results)
+                  if exit_status]
+        if raise_error and failed:
+            raise RemoteError('In host %s failed to execute: %s' %
+                              (self.host_ip, '; '.join(failed)))
+        return results
+
+    def run_batch(self, cmds, sudo=False, env_vars=None, raise_error=False,
+                  stop_on_error=False, log_method='debug'):
+        """Run commands one after another as one remote shell script
+
+        The script is fed to sh over a single channel, so N commands cost
+        one round-trip. Every command runs in a subshell with stdin from
+        /dev/null. Its output and exit status are told apart by marker
+        lines. last_exit_status is that of the script.
+
+        :param cmds: list of commands.
+        :param sudo: run the script with sudo.
+        :param env_vars: dict of environment variables set for all
+                         commands.
+        :param raise_error: raise RemoteError if any command failed.
+        :param stop_on_error: skip the remaining commands after a command
+                              failed.
+        :returns: list of (exit status, output) in the order of cmds.
+                  Commands that did not run have exit status None.
+        """
+        if not cmds:
+            return []
+        marker = 'SSHUTIL-BATCH-%s' % uuid.uuid4().hex
+        script = ['export %s=%s' % (var, value)
+                  for var, value in (env_vars or {}).iteritems()]
+        for i, cmd in enumerate(cmds):
+            script.append('(\n%s\n) </dev/null 2>&1' % cmd)
+            script.append('status=$?')
+            script.append("printf '\\n%s %d %%d\\n' $status" % (marker, i))
+            if stop_on_error:
+                script.append('[ $status -eq 0 ] || exit $status')
+        script.append('exit 0')
+        output, self.last_exit_status, cmd = self._run(
+            'sh -s', sudo=sudo, log_method=log_method,
+            feed_input='\n'.join(script))
+
+        results = [(None, '')] * len(cmds)
+        pos = 0
+        for match in re.finditer('\n%s (\\d+) (\\d+)\n' % marker, output):
+            results[int(match.group(1))] = (int(match.group(2)),
+                                            output[pos:match.start()])
+            pos = match.end()
+        failed = [c for c, result in zip(cmds, results) if result[0] != 0]
+        if raise_error and (failed or self.last_exit_status):
+            raise RemoteError('In host %s failed to execute: %s' %
+                              (self.host_ip, '; '.join(failed) or cmd))
+        return results
+
+    def _run(self, cmd, capture=True, sudo=False, env_vars=None,
+             log_method='debug', feed_input=None, callback=None,
+             max_output=None, output_file=None):
+        log = getattr(LOG, log_method)
+        buffer_ = OutputBuffer(max_output)
+        splitter = LineSplitter()
+
+        def handle(lines):
+            for line in lines:
+                log('[%s] out: %s' % (self.host_ip, line.rstrip()))
+                if callback:
+                    callback(line)
+
+        channel, cmd = self._exec(cmd, sudo, env_vars, feed_input, log)
+        try:
+            for data in self._read(channel):
+                if capture:
+                    buffer_.append(data)
+                if output_file is not None:
+                    output_file.write(data)
+                handle(splitter.feed(data))
+            handle(splitter.close())
+            exit_status = channel.recv_exit_status()
+        finally:
+            pool.close_channel(channel)
+        output = buffer_.getvalue()
+        if buffer_.dropped:
+            LOG.debug('[%s] kept last %d of %d bytes of output' %
+                      (self.host_ip, max_output,
+                       buffer_.dropped + max_output))
+        return output, exit_status, cmd
+
+    def stream(self, cmd, sudo=False, env_vars=None, raise_error=False,
+               log_method='debug', feed_input=None):
+        """Run a command on the host and yield its output line by line
+
+        Lines are decoded and keep their line terminator. Memory use does
+        not depend on the amount of output. last_exit_status is set when
+        the generator is exhausted.
+        """
+        log = getattr(LOG, log_method)
+        splitter = LineSplitter()
+        channel, cmd = self._exec(cmd, sudo, env_vars, feed_input, log)
+        try:
+            for data in self._read(channel):
+                for line in splitter.feed(data):
+                    yield line
+            for line in splitter.close():
+                yield line
+            self.last_exit_status = channel.recv_exit_status()
+        finally:
+            pool.close_channel(channel)
+        if raise_error and self.last_exit_status:
+            raise RemoteError('In host %s failed to execute: %s' %
+                              (self.host_ip, cmd))
 
-        transport = self.client.get_transport()
-        channel = transport.open_session()
+    def _exec(self, cmd, sudo, env_vars, feed_input, log):
+        channel = self._open_session()
+        try:
+            return channel, self._start(channel, cmd, sudo, env_vars,
+                                        feed_input, log)
+        except Exception:
+            pool.close_channel(channel)
+            raise
+
+    def _start(self, channel, cmd, sudo, env_vars, feed_input, log):
+        """Start a command on an open channel and return the command."""
         channel.set_combine_stderr(True)
         env_cmd = ""
         if env_vars:
@@ -57,111 +282,237 @@ class RemoteClient(object):
 
         feed_password = False
         if sudo and self.user != "root":
-            cmd = "sudo -S -p '' %s" % cmd
             feed_password = self.password is not None and (
                 len(self.password) > 0)
-
-        log_method('[%s] run: %s' % (self.host_ip, cmd))
+            # The whole command is one argument of a shell run by sudo, so
+            # pipes, redirections and builtins run under sudo as well
+            if feed_password:
+                # sudo prompts only without a cached or NOPASSWD grant, so
+                # wait for its prompt or for the command being ready to
+                # read its stdin before sending anything
+                token = uuid.uuid4().hex
+                prompt = 'SSHUTIL-SUDO-%s:' % token
+                ready = 'SSHUTIL-READY-%s' % token
+                cmd = ("sudo -S -p '%s' sh -c 'echo %s >&2; read _; "
+                       "exec sh -c \"$1\"' sh %s" %
+                       (prompt, ready, pipes.quote(cmd)))
+            else:
+                cmd = "sudo -S -p '' sh -c %s" % pipes.quote(cmd)
+
+        log('[%s] run: %s' % (self.host_ip, cmd))
         channel.exec_command(cmd)
 
-        buffer_ = []  # This should probably be a limited-length buffer
-        line = []
-        seen_cr = False
-
-        def flush(text):
-            if isinstance(text, str):
-                log_method('[%s] out: %s' % (self.host_ip,
-                           unicode(text.rstrip(), errors='ignore')))
-
-        def has_newline(bytelist):
-            return '\r' in bytelist or '\n' in bytelist
-
         if feed_password:
-            channel.sendall(self.password + '\n')
+            self._sudo_login(channel, prompt, ready)
 
         if feed_input:
             channel.sendall(feed_input + '\n')
+        return cmd
 
-        while not channel.exit_status_ready():
-            rlist, wlist, xlist = select.select([channel], [], [], 10.0)
-            # wait until ready for reading
-            if len(rlist) > 0:
-                bytelist = channel.recv(512)
-                if capture:
-                    buffer_.append(bytelist)
-
-                # empty byte signifies EOS
-                if bytelist == '':
-                    if line:
-                        flush(''.join(line))
-                    break
-
-                if bytelist[-1] == '\r':
-                    seen_cr = True
-                if bytelist[0] == '\n' and seen_cr:
-                    bytelist = bytelist[1:]
-                    seen_cr = False
-
-                while has_newline(bytelist) and bytelist != '':
-                    # at most 1 split !
-                    cr = re.search('(\r\n|\r|\n)', bytelist)
-                    if cr is None:
-                        break
-                    end_of_line = bytelist[:cr.start(0)]
-                    bytelist = bytelist[cr.end(0):]
-
-                    if has_newline(end_of_line):
-                        end_of_line = ''
-
-                    flush(''.join(line) + end_of_line + '\n')
-                    line = []
-
-                line += [bytelist]
-        self.last_exit_status = channel.recv_exit_status()
-        if raise_error and self.last_exit_status:
-            raise RemoteError('In host %s failed to execute: %s' %
-                              (self.host_ip, cmd))
-        return ''.join(buffer_)
+    def _sudo_login(self, channel, prompt, ready):
+        """Send the password if sudo prompts for it.
 
-    def scp(self, src, dest, log_method='debug'):
+        Returns once the command printed the ready line, it then waits for
+        a line on stdin before it runs, so no output is read here.
+        """
+        output = ''
+        prompted = False
+        deadline = time.time() + SUDO_TIMEOUT
+        while True:
+            if ready + '\n' in output:
+                channel.sendall('\n')
+                return
+            if prompt in output:
+                if prompted:
+                    raise RemoteError('In host %s sudo rejected the password'
+                                      % self.host_ip)
+                channel.sendall(self.password + '\n')
+                prompted = True
+                output = output.partition(prompt)[2]
+                continue
+            if channel.recv_ready():
+                output += channel.recv(MIN_CHUNK_SIZE)
+                continue
+            if channel.eof_received or channel.exit_status_ready():
+                raise RemoteError('In host %s sudo failed: %s' %
+                                  (self.host_ip, output.strip()))
+            if time.time() > deadline:
+                raise RemoteError('In host %s sudo did not start in %s '
+                                  'seconds' % (self.host_ip, SUDO_TIMEOUT))
+            select.select([channel], [], [], 0.5)
+
+    def _read(self, channel):
+        """Yield raw output of a channel until the command closes it.
+
+        Once the command exited, reading stops after EXIT_DRAIN_TIMEOUT
+        seconds without output, so a background process still holding
+        stdout open is not waited for.
+
+        The read size grows while the command produces output faster than
+        it is read, up to MAX_CHUNK_SIZE.
+        """
+        chunk_size = MIN_CHUNK_SIZE
+        idle_since = None
+        while True:
+            if not channel.recv_ready():
+                if channel.eof_received:
+                    return
+                if channel.exit_status_ready():
+                    now = time.time()
+                    idle_since = idle_since or now
+                    if now - idle_since >= EXIT_DRAIN_TIMEOUT:
+                        LOG.debug('[%s] command exited, stdout still open' %
+                                  self.host_ip)
+                        return
+                # exit-status does not wake up select
+                select.select([channel], [], [], 0.5)
+                continue
+            data = channel.recv(chunk_size)
+            # empty byte signifies EOS
+            if data == '':
+                return
+            idle_since = None
+            if len(data) == chunk_size:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+            yield data
+
+    def scp(self, src, dest, log_method='debug', **kwargs):
         """Transfers a local file to the remote host. src is a relative or
         absolute path to a file. dest is the absolute path on the destination
-        host."""
+        host.
+        :param kwargs: passed on to transfer.put, e.g. window, verify or
+                       callback.
+        :returns: transfer.TransferResult
+        """
         log_method = getattr(LOG, log_method)
-        if not self.client:
-            self._set_client()
-
-        sftp = paramiko.SFTPClient.from_transport(self.client.get_transport())
         file_ = src.rpartition('/')[-1]
-        sftp.put(src, '/'.join([dest.rstrip('/'), file_]))
-        log_method('[%s] scp: %s to %s' % (self.host_ip, src, dest))
-        sftp.close()
-
-    def get(self, src, dest, log_method='debug'):
+        result = transfer.put(self, self.sftp_sessions, src,
+                              '/'.join([dest.rstrip('/'), file_]), **kwargs)
+        if not result.succeeded:
+            raise result.error
+        log_method('[%s] scp: %s to %s, %.2f MB/s' % (
+            self.host_ip, src, dest, result.throughput / transfer.MB))
+        return result
+
+    def get(self, src, dest, log_method='debug', **kwargs):
         """Transfers a remote file to the local host. src is a relative or
         absolute path to a file. dest is the absolute path on the destination
-        host."""
+        host.
+        :param kwargs: passed on to transfer.get, e.g. window, verify or
+                       callback.
+        :returns: transfer.TransferResult
+        """
         log_method = getattr(LOG, log_method)
-        if not self.client:
-            self._set_client()
-
-        sftp = paramiko.SFTPClient.from_transport(self.client.get_transport())
         file_ = src.rpartition('/')[-1]
-        sftp.get(src, '/'.join([dest.rstrip('/'), file_]))
-        log_method('[%s] get: %s to %s' % (self.host_ip, src, dest))
-        sftp.close()
+        result = transfer.get(self, self.sftp_sessions, src,
+                              os.path.join(dest, file_), **kwargs)
+        if not result.succeeded:
+            raise result.error
+        log_method('[%s] get: %s to %s, %.2f MB/s' % (
+            self.host_ip, src, dest, result.throughput / transfer.MB))
+        return result
+
+    def scp_many(self, srcs, dest, workers=transfer.DEFAULT_WORKERS,
+                 **kwargs):
+        """Transfer local files to the remote directory dest concurrently
+
+        :returns: list of transfer.TransferResult in the order of srcs.
+        """
+        pairs = [(src, '/'.join([dest.rstrip('/'), os.path.basename(src)]))
+                 for src in srcs]
+        return transfer.transfer_all(self._put, pairs, workers, **kwargs)
+
+    def scp_dir(self, src, dest, workers=transfer.DEFAULT_WORKERS,
+                **kwargs):
+        """Transfer the local directory src to the remote directory dest
+
+        Missing remote directories are created.
+
+        :returns: list of transfer.TransferResult, one per file.
+        """
+        pairs, dirs = transfer.local_files(src, dest)
+        sftp = self.sftp_sessions.acquire()
+        try:
+            for dir_ in dirs:
+                transfer.makedirs(sftp, dir_)
+        finally:
+            self.sftp_sessions.release(sftp)
+        return transfer.transfer_all(self._put, pairs, workers, **kwargs)
+
+    def get_dir(self, src, dest, workers=transfer.DEFAULT_WORKERS,
+                **kwargs):
+        """Transfer the remote directory src to the local directory dest
+
+        :returns: list of transfer.TransferResult, one per file.
+        """
+        sftp = self.sftp_sessions.acquire()
+        try:
+            pairs, dirs = transfer.remote_files(sftp, src, dest)
+        finally:
+            self.sftp_sessions.release(sftp)
+        for dir_ in dirs:
+            if not os.path.isdir(dir_):
+                os.makedirs(dir_)
+        return transfer.transfer_all(self._get, pairs, workers, **kwargs)
+
+    def _put(self, src, dest, **kwargs):
+        return transfer.put(self, self.sftp_sessions, src, dest, **kwargs)
+
+    def _get(self, src, dest, **kwargs):
+        return transfer.get(self, self.sftp_sessions, src, dest, **kwargs)
 
     def reload_client(self):
         if self.client:
-            self.client.close()
+            if self.pooled:
+                pool.get_pool().invalidate(self.host_ip, self.user,
+                                           self.client)
+            else:
+                self.client.close()
 
         self._set_client()
 
+    def close(self):
+        """Close the connection, pooled connections are kept open."""
+        self.sftp_sessions.close()
+        if self.client and not self.pooled:
+            self.client.close()
+        self.client = None
+
     def check_connection(self):
-        self._set_client()
+        """Connect unless the current connection is alive."""
+        with self.lock:
+            if not pool.is_alive(self.client):
+                self._set_client()
+
+    def _live_client(self):
+        self.check_connection()
+        return self.client
+
+    def _open_session(self, blocking=True):
+        """Open a channel, connecting again once if the connection died.
+
+        At most pool.MAX_SESSIONS channels are open on a connection at
+        once, see pool.open_session. A channel refused by sshd raises
+        paramiko.ChannelException, the connection and other channels on it
+        are kept.
+        """
+        self.check_connection()
+        try:
+            return pool.open_session(self.client, blocking)
+        except paramiko.ChannelException:
+            raise
+        except (paramiko.SSHException, EOFError, AttributeError):
+            if pool.is_alive(self.client):
+                raise
+            LOG.debug('[%s] open channel failed, reconnect' % self.host_ip,
+                      exc_info=True)
+            self.reload_client()
+            return pool.open_session(self.client, blocking)
 
     def _set_client(self):
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.client.connect(self.host_ip, username=self.user,
-                            password=self.password)
+        if self.pooled:
+            self.client = pool.get_pool().acquire(self.host_ip, self.user,
+                                                  self.password)
+        else:
+            self.client = pool.connect(self.host_ip, self.user,
+                                       self.password)
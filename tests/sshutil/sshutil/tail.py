@@ -0,0 +1,196 @@
+"""Incremental harvesting of remote log files"""
+
+import json
+import logging
+import os
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import transfer
+
+
+LOG = logging.getLogger(__name__)
+
+# Files read at once, every read takes a channel of the connection
+DEFAULT_WORKERS = 4
+
+
+class _GunzipWriter(object):
+    """File-like object decompressing gzip data written to it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.size = 0
+
+    def write(self, data):
+        data = self.decompressor.decompress(data)
+        self.f.write(data)
+        self.size += len(data)
+
+    def close(self):
+        data = self.decompressor.flush()
+        self.f.write(data)
+        self.size += len(data)
+
+
+class _CountingWriter(object):
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.size += len(data)
+
+    def close(self):
+        pass
+
+
+class LogHarvester(object):
+    """Copy what was appended to remote files since the last harvest
+
+    The offset and inode of every file are remembered, in state_file too if
+    given, so every harvest only transfers new bytes. A file that shrank or
+    got a new inode was rotated and is read from its start again. Files are
+    read in parallel over channels of the one connection of the client,
+    with sudo for files only root can read and optionally gzip compressed
+    on the wire.
+    """
+
+    def __init__(self, client, dest_dir, state_file=None, sudo=False,
+                 compress=False, workers=DEFAULT_WORKERS):
+        """
+        :param client: RemoteClient of the host.
+        :param dest_dir: local directory, remote paths are mirrored below
+                         it and new bytes appended to the local files.
+        :param state_file: JSON file keeping offsets between processes.
+        :param sudo: read files with sudo.
+        :param compress: gzip data on the host and decompress it locally.
+        :param workers: files read at once.
+        """
+        self.client = client
+        self.dest_dir = dest_dir
+        self.state_file = state_file
+        self.sudo = sudo
+        self.compress = compress
+        self.workers = workers
+        self.offsets = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                self.offsets = json.load(f)
+
+    def local_path(self, path):
+        return os.path.join(self.dest_dir, path.lstrip('/'))
+
+    def save(self):
+        if self.state_file:
+            with open(self.state_file, 'w') as f:
+                json.dump(self.offsets, f, indent=2, sort_keys=True)
+
+    def _stat(self, paths):
+        """Return {path: (inode, size)} of the existing files."""
+        results = self.client.run_batch(
+            ["stat -L -c '%%i %%s' '%s'" % path for path in paths],
+            sudo=self.sudo)
+        stats = {}
+        for path, (exit_status, output) in zip(paths, results):
+            if exit_status == 0:
+                inode, size = output.split()
+                stats[path] = (int(inode), int(size))
+            else:
+                LOG.debug('[%s] cannot stat %s: %s', self.client.host_ip,
+                          path, output.strip())
+        return stats
+
+    def _read(self, path, offset, length, f):
+        """Append length bytes of path starting at offset to f."""
+        if not self.sudo and not self.compress:
+            sftp = self.client.sftp_sessions.acquire()
+            broken = True
+            try:
+                remote = sftp.open(path, 'r')
+                try:
+                    remote.seek(offset)
+                    remote.prefetch(offset + length)
+                    transfer.copy_range(remote.read, f.write, length)
+                finally:
+                    remote.close()
+                broken = False
+            finally:
+                self.client.sftp_sessions.release(sftp, broken)
+            return length
+
+        cmd = "tail -c +%d '%s' | head -c %d" % (offset + 1, path, length)
+        if self.compress:
+            cmd += ' | gzip -c'
+            writer = _GunzipWriter(f)
+        else:
+            writer = _CountingWriter(f)
+        output, exit_status, cmd = self.client._run(
+            cmd, capture=False, sudo=self.sudo, output_file=writer)
+        writer.close()
+        if exit_status or writer.size != length:
+            raise IOError('Read %d of %d bytes of %s, exit status %s' %
+                          (writer.size, length, path, exit_status))
+        return length
+
+    def harvest(self, paths):
+        """Copy new bytes of remote files to dest_dir
+
+        :param paths: list of remote file paths.
+        :returns: list of transfer.TransferResult in the order of paths,
+                  size is the number of new bytes.
+        """
+        if not paths:
+            return []
+        stats = self._stat(paths)
+
+        def harvest(path):
+            local = self.local_path(path)
+            result = transfer.TransferResult(path, local)
+            start = time.time()
+            try:
+                if path not in stats:
+                    raise IOError('%s not found' % path)
+                inode, size = stats[path]
+                state = self.offsets.get(path, {})
+                offset = state.get('offset', 0)
+                if state.get('inode', inode) != inode or size < offset:
+                    LOG.info('[%s] %s was rotated, read it from the start',
+                             self.client.host_ip, path)
+                    offset = 0
+                if size > offset:
+                    if not os.path.isdir(os.path.dirname(local)):
+                        os.makedirs(os.path.dirname(local))
+                    kept = os.path.getsize(local) \
+                        if os.path.exists(local) else 0
+                    with open(local, 'ab') as f:
+                        try:
+                            result.size = self._read(path, offset,
+                                                     size - offset, f)
+                        except Exception:
+                            # Do not keep bytes that will be read again
+                            f.truncate(kept)
+                            raise
+                self.offsets[path] = {'inode': inode, 'offset': size}
+            except Exception as e:
+                result.error = e
+                LOG.warning('[%s] harvest of %s failed: %s',
+                            self.client.host_ip, path, e)
+            result.seconds = time.time() - start
+            return result
+
+        pool = ThreadPool(min(self.workers, len(paths)))
+        try:
+            results = pool.map(harvest, paths)
+        finally:
+            pool.close()
+            pool.join()
+        self.save()
+        LOG.info('[%s] harvested %d new bytes of %d files',
+                 self.client.host_ip, sum(r.size for r in results),
+                 len(results))
+        return results
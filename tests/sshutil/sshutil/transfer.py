@@ -0,0 +1,510 @@
+"""Parallel, resumable SFTP transfers over one SSH connection"""
+
+import hashlib
+import logging
+import os
+import socket
+import stat
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import paramiko
+
+import pool
+
+
+LOG = logging.getLogger(__name__)
+
+# Bytes of a file transferred by one channel, transferred in parallel
+CHUNK_SIZE = 32 * 1024 * 1024
+# Channels used at once for the chunks of one file
+DEFAULT_WINDOW = 4
+# Files transferred at once by directory and bulk transfers
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+# Largest read or write of a single SFTP request
+BLOCK_SIZE = 32768
+# Idle SFTP sessions kept open per connection
+MAX_IDLE_SESSIONS = 2
+PARTIAL_SUFFIX = '.part'
+# Log of the complete chunks of a .part file
+CHUNK_LOG_SUFFIX = '.chunks'
+MB = 1024 * 1024
+
+RETRY_ERRORS = (IOError, EOFError, socket.error, paramiko.SSHException)
+
+
+class ChecksumError(IOError):
+    """Checksums of source and destination differ"""
+
+
+class TransferResult(object):
+    """Outcome of transferring one file."""
+
+    def __init__(self, src, dest):
+        self.src = src
+        self.dest = dest
+        self.size = 0
+        self.seconds = 0.0
+        self.retries = 0
+        self.checksum = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+    @property
+    def throughput(self):
+        """Bytes per second."""
+        if not self.seconds:
+            return 0.0
+        return self.size / self.seconds
+
+    def __repr__(self):
+        return '<TransferResult %s %d bytes %.1f MB/s%s>' % (
+            self.src, self.size, self.throughput / MB,
+            ' error: %s' % self.error if self.error else '')
+
+
+class SFTPSessions(object):
+    """Idle SFTP sessions of one SSH connection, kept open for reuse.
+
+    Every session is a channel of its own, so sessions checked out by
+    different threads transfer in parallel. Sessions count against the
+    channel limit of the connection, see pool.open_session. At most
+    MAX_IDLE_SESSIONS are kept, and idle ones are closed when another
+    channel is waiting for a free place.
+    """
+
+    def __init__(self, get_client):
+        """
+        :param get_client: function returning the live paramiko.SSHClient.
+        """
+        self.get_client = get_client
+        self.lock = threading.Lock()
+        self.idle = []
+        self.client = None
+
+    def acquire(self):
+        client = self.get_client()
+        with self.lock:
+            if client is not self.client:
+                # Sessions of an older connection are useless
+                self._close_idle()
+                self.client = client
+            if self.idle:
+                return self.idle.pop()
+        pool.get_limiter(client).idle_holders.add(self)
+        channel = pool.open_session(client)
+        try:
+            channel.invoke_subsystem('sftp')
+            return paramiko.SFTPClient(channel)
+        except Exception:
+            pool.close_channel(channel)
+            raise
+
+    def release(self, sftp, broken=False):
+        with self.lock:
+            if broken or len(self.idle) >= MAX_IDLE_SESSIONS or \
+                    sftp.get_channel().get_transport() is not \
+                    self.client.get_transport():
+                _close_session(sftp)
+            else:
+                self.idle.append(sftp)
+
+    def _close_idle(self):
+        for sftp in self.idle:
+            _close_session(sftp)
+        self.idle = []
+
+    def close_idle(self):
+        with self.lock:
+            self._close_idle()
+
+    def close(self):
+        with self.lock:
+            self._close_idle()
+            self.client = None
+
+
+def _close_session(sftp):
+    try:
+        sftp.close()
+    except Exception:
+        pass
+    pool.close_channel(sftp.get_channel())
+
+
+def _chunks(size, chunk_size):
+    return [(offset, min(chunk_size, size - offset))
+            for offset in range(0, size, chunk_size)]
+
+
+def _done_chunks(text, source_id, chunk_size):
+    """Return offsets of complete chunks listed in a chunk log."""
+    lines = text.split('\n')
+    if lines[0] != source_id:
+        return set()
+    # The last line is unterminated if writing it was interrupted
+    return set(int(line) for line in lines[1:-1]
+               if line.isdigit() and int(line) % chunk_size == 0)
+
+
+def _resume(open_, part, source_id, chunk_size):
+    """Return offsets of the chunks of part complete from an earlier try.
+
+    The chunk log part + '.chunks' lists the complete chunks of a source,
+    identified by source_id. Without a matching log part is started over.
+
+    :param open_: open for local files, SFTPClient.open for remote ones.
+    """
+    log_path = part + CHUNK_LOG_SUFFIX
+    try:
+        with open_(log_path, 'r') as f:
+            done = _done_chunks(f.read(), source_id, chunk_size)
+        open_(part, 'r').close()
+    except IOError:
+        done = set()
+    if not done:
+        open_(part, 'w').close()
+        with open_(log_path, 'w') as f:
+            f.write(source_id + '\n')
+    return done
+
+
+def _done_size(size, chunk_size, done):
+    return sum(length for offset, length in _chunks(size, chunk_size)
+               if offset in done)
+
+
+def _log_chunk(open_, part, offset, lock):
+    with lock:
+        with open_(part + CHUNK_LOG_SUFFIX, 'a') as f:
+            f.write('%d\n' % offset)
+
+
+def _copy_chunks(sessions, size, chunk_size, window, retries, copy, name,
+                 done=()):
+    """Run copy(sftp, offset, length) for all chunks of a file.
+
+    A failed chunk is copied again from its start on a new session.
+    Pipelined writes are not acknowledged one by one, so bytes written
+    before the failure may be missing on the server.
+
+    :param done: offsets of chunks not to copy.
+    :returns: number of retries.
+    """
+    retried = [0]
+
+    def run(chunk):
+        offset, length = chunk
+        for attempt in range(retries + 1):
+            sftp = None
+            broken = True
+            try:
+                sftp = sessions.acquire()
+                copy(sftp, offset, length)
+                broken = False
+                return
+            except RETRY_ERRORS as e:
+                if attempt == retries:
+                    raise
+                retried[0] += 1
+                LOG.warning('Transfer of %s interrupted in chunk at %d, '
+                            'retry: %s', name, offset, e)
+            finally:
+                # A session that failed in any way is not reused
+                if sftp is not None:
+                    sessions.release(sftp, broken)
+
+    chunks = [chunk for chunk in _chunks(size, chunk_size) or [(0, 0)]
+              if chunk[0] not in done]
+    if done:
+        LOG.info('Resume transfer of %s, %d chunks left', name, len(chunks))
+    if len(chunks) <= 1 or window <= 1:
+        for chunk in chunks:
+            run(chunk)
+        return retried[0]
+    workers = ThreadPool(min(window, len(chunks)))
+    try:
+        workers.map(run, chunks)
+    finally:
+        workers.close()
+        workers.join()
+    return retried[0]
+
+
+def copy_range(read, write, length, callback=None):
+    """Copy length bytes from read to write in BLOCK_SIZE blocks.
+
+    :param read: function returning at most the given number of bytes.
+    :param write: function taking the bytes.
+    :param callback: function called with the number of bytes of every
+                     block, and with minus the bytes copied if it failed.
+    :raises: EOFError if read ran out of data early.
+    """
+    done = 0
+    try:
+        while done < length:
+            data = read(min(BLOCK_SIZE, length - done))
+            if not data:
+                raise EOFError('File ended after %d bytes' % done)
+            write(data)
+            done += len(data)
+            if callback:
+                callback(len(data))
+    except RETRY_ERRORS:
+        # The chunk is copied again from its start
+        if callback and done:
+            callback(-done)
+        raise
+
+
+def local_checksum(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(MB), ''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def remote_checksum(client, path, algorithm):
+    """Checksum a remote file with md5sum, sha1sum or sha256sum."""
+    output, exit_status, cmd = client._run("%ssum '%s'" % (algorithm, path))
+    if exit_status:
+        raise IOError('%s failed: %s' % (cmd, output.strip()))
+    return output.split()[0]
+
+
+def _verify(client, local_path, remote_path, algorithm):
+    local = local_checksum(local_path, algorithm)
+    remote = remote_checksum(client, remote_path, algorithm)
+    if local != remote:
+        raise ChecksumError('%s of %s is %s but %s on %s' % (
+            algorithm, local_path, local, remote, remote_path))
+    return local
+
+
+def _replace(sftp, src, dest):
+    try:
+        sftp.remove(dest)
+    except IOError:
+        pass
+    sftp.rename(src, dest)
+
+
+def _progress(size, callback):
+    """Return a thread safe function counting transferred bytes."""
+    lock = threading.Lock()
+    done = [0]
+
+    def progress(count):
+        with lock:
+            done[0] += count
+            if callback:
+                callback(done[0], size)
+    return progress
+
+
+def _finish(result, start, verb):
+    if not result.seconds:
+        result.seconds = time.time() - start
+    if result.succeeded:
+        LOG.info('%s %s: %.1f MB in %.1fs, %.2f MB/s', verb, result.src,
+                 float(result.size) / MB, result.seconds,
+                 result.throughput / MB)
+    else:
+        LOG.error('%s %s failed: %s', verb, result.src, result.error)
+    return result
+
+
+def put(client, sessions, src, dest, window=DEFAULT_WINDOW,
+        chunk_size=CHUNK_SIZE, retries=DEFAULT_RETRIES, verify=None,
+        callback=None):
+    """Upload a local file to the remote path dest.
+
+    Chunks of chunk_size bytes are uploaded to dest + '.part' over up to
+    window sessions at once, which is renamed to dest when complete.
+    Complete chunks are logged next to it, so uploading a file again
+    after a failure only uploads the missing chunks.
+
+    :param client: RemoteClient, used for checksums.
+    :param sessions: SFTPSessions of the client.
+    :param verify: compare checksums of both files with this hashlib
+                   algorithm, one of 'md5', 'sha1' or 'sha256'.
+    :param callback: function called with bytes done and total size.
+    :returns: TransferResult, error is set if the upload failed.
+    """
+    result = TransferResult(src, dest)
+    start = time.time()
+    part = dest + PARTIAL_SUFFIX
+    try:
+        st = os.stat(src)
+        size = st.st_size
+        source_id = '%s %d %d %d' % (src, size, st.st_mtime, chunk_size)
+        progress = _progress(size, callback)
+        log_lock = threading.Lock()
+        sftp = sessions.acquire()
+        try:
+            done = _resume(sftp.open, part, source_id, chunk_size)
+        finally:
+            sessions.release(sftp)
+        progress(_done_size(size, chunk_size, done))
+
+        def copy(sftp, offset, length):
+            with open(src, 'rb') as local:
+                local.seek(offset)
+                remote = sftp.open(part, 'r+')
+                try:
+                    remote.set_pipelined(True)
+                    remote.seek(offset)
+                    copy_range(local.read, remote.write, length, progress)
+                finally:
+                    # Waits for the server to acknowledge all writes
+                    remote.close()
+            _log_chunk(sftp.open, part, offset, log_lock)
+
+        result.retries = _copy_chunks(sessions, size, chunk_size, window,
+                                      retries, copy, src, done)
+        sftp = sessions.acquire()
+        try:
+            _replace(sftp, part, dest)
+            sftp.remove(part + CHUNK_LOG_SUFFIX)
+        finally:
+            sessions.release(sftp)
+        result.size = size
+        # The rate excludes checksumming
+        result.seconds = time.time() - start
+        if verify:
+            result.checksum = _verify(client, src, dest, verify)
+    except Exception as e:
+        result.error = e
+    return _finish(result, start, 'Uploaded')
+
+
+def get(client, sessions, src, dest, window=DEFAULT_WINDOW,
+        chunk_size=CHUNK_SIZE, retries=DEFAULT_RETRIES, verify=None,
+        callback=None):
+    """Download the remote file src to the local path dest.
+
+    Chunks of chunk_size bytes are downloaded to dest + '.part' over up to
+    window sessions at once, which is renamed to dest when complete.
+    Like put(), a download after a failure only copies missing chunks.
+    Parameters are those of put().
+
+    :returns: TransferResult, error is set if the download failed.
+    """
+    result = TransferResult(src, dest)
+    start = time.time()
+    part = dest + PARTIAL_SUFFIX
+    try:
+        sftp = sessions.acquire()
+        try:
+            st = sftp.stat(src)
+        finally:
+            sessions.release(sftp)
+        size = st.st_size
+        source_id = '%s %d %d %d' % (src, size, st.st_mtime, chunk_size)
+        progress = _progress(size, callback)
+        log_lock = threading.Lock()
+        done = _resume(open, part, source_id, chunk_size)
+        progress(_done_size(size, chunk_size, done))
+        with open(part, 'r+b') as local:
+            local.truncate(size)
+
+        def copy(sftp, offset, length):
+            with open(part, 'r+b') as local:
+                local.seek(offset)
+                remote = sftp.open(src, 'r')
+                try:
+                    remote.seek(offset)
+                    remote.prefetch(offset + length)
+                    copy_range(remote.read, local.write, length, progress)
+                finally:
+                    remote.close()
+            _log_chunk(open, part, offset, log_lock)
+
+        result.retries = _copy_chunks(sessions, size, chunk_size, window,
+                                      retries, copy, src, done)
+        os.rename(part, dest)
+        os.remove(part + CHUNK_LOG_SUFFIX)
+        result.size = size
+        # The rate excludes checksumming
+        result.seconds = time.time() - start
+        if verify:
+            result.checksum = _verify(client, dest, src, verify)
+    except Exception as e:
+        result.error = e
+    return _finish(result, start, 'Downloaded')
+
+
+def transfer_all(func, pairs, workers=DEFAULT_WORKERS, **kwargs):
+    """Run put or get for many (src, dest) pairs concurrently.
+
+    :returns: list of TransferResult in the order of pairs.
+    """
+    if not pairs:
+        return []
+
+    def run(pair):
+        return func(pair[0], pair[1], **kwargs)
+
+    pool = ThreadPool(min(workers, len(pairs)))
+    try:
+        results = pool.map(run, pairs)
+    finally:
+        pool.close()
+        pool.join()
+    size = sum(r.size for r in results)
+    seconds = max(r.seconds for r in results)
+    failed = [r.src for r in results if not r.succeeded]
+    LOG.info('Transferred %d files, %.1f MB, %.2f MB/s, %d failed %s',
+             len(results), float(size) / MB,
+             size / seconds / MB if seconds else 0.0, len(failed),
+             failed or '')
+    return results
+
+
+def local_files(src_dir, dest_dir):
+    """Return (local file, remote file) pairs and remote directories."""
+    pairs = []
+    dirs = [dest_dir]
+    for root, subdirs, files in os.walk(src_dir):
+        rel = os.path.relpath(root, src_dir)
+        remote_root = dest_dir if rel == '.' else \
+            '/'.join([dest_dir.rstrip('/'), rel.replace(os.sep, '/')])
+        dirs.extend('/'.join([remote_root, d]) for d in sorted(subdirs))
+        pairs.extend((os.path.join(root, f), '/'.join([remote_root, f]))
+                     for f in sorted(files))
+    return pairs, dirs
+
+
+def remote_files(sftp, src_dir, dest_dir):
+    """Return (remote file, local file) pairs and local directories."""
+    pairs = []
+    dirs = [dest_dir]
+    for attr in sftp.listdir_attr(src_dir):
+        src = '/'.join([src_dir.rstrip('/'), attr.filename])
+        dest = os.path.join(dest_dir, attr.filename)
+        if stat.S_ISDIR(attr.st_mode):
+            sub_pairs, sub_dirs = remote_files(sftp, src, dest)
+            pairs.extend(sub_pairs)
+            dirs.extend(sub_dirs)
+        elif stat.S_ISREG(attr.st_mode):
+            pairs.append((src, dest))
+    return pairs, dirs
+
+
+def makedirs(sftp, path):
+    """Create a remote directory and its parents if missing."""
+    try:
+        if stat.S_ISDIR(sftp.stat(path).st_mode):
+            return
+    except IOError:
+        pass
+    parent = path.rstrip('/').rpartition('/')[0]
+    if parent:
+        makedirs(sftp, parent)
+    sftp.mkdir(path)
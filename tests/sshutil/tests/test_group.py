@@ -0,0 +1,60 @@
+import time
+import unittest
+
+from sshutil import group
+from sshutil import remote
+from tests.test_remote import LocalClient
+
+
+class UnreachableClient(LocalClient):
+    def _run(self, cmd, *args, **kwargs):
+        raise remote.RemoteError('%s unreachable' % self.host_ip)
+
+
+class RemoteGroupTest(unittest.TestCase):
+    hosts = ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4']
+
+    def create_group(self, max_workers=group.DEFAULT_WORKERS):
+        return group.RemoteGroup([LocalClient(host) for host in self.hosts],
+                                 max_workers=max_workers)
+
+    def test_results_in_group_order(self):
+        with self.create_group() as hosts:
+            result = hosts.run('echo out; exit 2')
+        self.assertEqual(result.keys(), self.hosts)
+        for host, host_result in result.items():
+            self.assertEqual(host_result.host, host)
+            self.assertEqual(host_result.output, 'out\n')
+            self.assertEqual(host_result.exit_status, 2)
+        self.assertEqual(result.failed, self.hosts)
+        self.assertRaises(remote.RemoteError, result.raise_for_status)
+
+    def test_hosts_run_concurrently(self):
+        start = time.time()
+        result = self.create_group().run('sleep 0.5')
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(result.succeeded, self.hosts)
+
+    def test_max_workers(self):
+        start = time.time()
+        self.create_group(max_workers=2).run('sleep 0.3')
+        self.assertGreaterEqual(time.time() - start, 0.6)
+
+    def test_command_per_host(self):
+        result = self.create_group().run({'10.0.0.3': 'echo three',
+                                          '10.0.0.1': 'echo one'})
+        self.assertEqual(result.keys(), ['10.0.0.1', '10.0.0.3'])
+        self.assertEqual(result['10.0.0.3'].output, 'three\n')
+
+    def test_error_of_one_host(self):
+        clients = [LocalClient('10.0.0.1'), UnreachableClient('10.0.0.2')]
+        result = group.RemoteGroup(clients).run('true')
+        self.assertEqual(result.succeeded, ['10.0.0.1'])
+        self.assertEqual(result.failed, ['10.0.0.2'])
+        self.assertIsInstance(result['10.0.0.2'].error, remote.RemoteError)
+        self.assertRaises(remote.RemoteError, group.RemoteGroup(clients).run,
+                          'true', raise_error=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
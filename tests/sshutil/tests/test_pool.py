@@ -0,0 +1,120 @@
+import unittest
+
+import paramiko
+
+from sshutil import pool
+from sshutil import remote
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.refuse = False
+        self.channels = []
+
+    def is_active(self):
+        return True
+
+    def open_session(self):
+        if self.refuse:
+            raise paramiko.ChannelException(2, 'Connect failed')
+        channel = FakeChannel()
+        self.channels.append(channel)
+        return channel
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+class IdleHolder(object):
+    def __init__(self, limiter, idle):
+        self.limiter = limiter
+        self.idle = idle
+
+    def close_idle(self):
+        while self.idle:
+            self.idle -= 1
+            self.limiter.release()
+
+
+class ChannelLimiterTest(unittest.TestCase):
+    def test_slots(self):
+        limiter = pool.ChannelLimiter(2)
+        self.assertTrue(limiter.acquire(False))
+        self.assertTrue(limiter.acquire(False))
+        self.assertFalse(limiter.acquire(False))
+        limiter.release()
+        self.assertTrue(limiter.acquire(False))
+        self.assertFalse(limiter.acquire(False))
+
+    def test_idle_holders_asked_when_full(self):
+        limiter = pool.ChannelLimiter(2)
+        limiter.acquire()
+        limiter.acquire()
+        holder = IdleHolder(limiter, 2)
+        limiter.idle_holders.add(holder)
+        self.assertTrue(limiter.acquire(False))
+        self.assertEqual(holder.idle, 0)
+        self.assertTrue(limiter.acquire(False))
+        self.assertFalse(limiter.acquire(False))
+
+
+class OpenSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def open_all(self):
+        return [pool.open_session(self.client)
+                for _ in range(pool.MAX_SESSIONS)]
+
+    def test_limit_per_connection(self):
+        channels = self.open_all()
+        self.assertIsNone(pool.open_session(self.client, blocking=False))
+        self.assertIsNotNone(pool.open_session(FakeClient(),
+                                               blocking=False))
+        pool.close_channel(channels[0])
+        self.assertTrue(channels[0].closed)
+        self.assertIsNotNone(pool.open_session(self.client, blocking=False))
+
+    def test_close_twice_frees_one_slot(self):
+        channels = self.open_all()
+        pool.close_channel(channels[0])
+        pool.close_channel(channels[0])
+        self.assertIsNotNone(pool.open_session(self.client, blocking=False))
+        self.assertIsNone(pool.open_session(self.client, blocking=False))
+
+    def test_refused_channel_frees_slot(self):
+        self.client.transport.refuse = True
+        for _ in range(pool.MAX_SESSIONS + 1):
+            self.assertRaises(paramiko.ChannelException, pool.open_session,
+                              self.client, False)
+        self.client.transport.refuse = False
+        self.assertEqual(len(self.open_all()), pool.MAX_SESSIONS)
+
+    def test_refused_channel_keeps_connection(self):
+        rc = remote.RemoteClient('127.0.0.1', 'user')
+        rc.client = self.client
+        self.client.transport.refuse = True
+        self.assertRaises(paramiko.ChannelException, rc._open_session)
+        self.assertIs(rc.client, self.client)
+        self.assertFalse(self.client.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+import re
+import shlex
+import subprocess
 import unittest
 
 from sshutil import remote
@@ -14,6 +17,140 @@ class RemoteTest(unittest.TestCase):
                                  'vio-autouser', '!ya6u4uWY2u@egYvU')
         self.assertEqual(rc.run('pwd', capture=False), '')
 
+    def test_stream(self):
+        rc = remote.RemoteClient('nimbus-gateway.eng.vmware.com',
+                                 'vio-autouser', '!ya6u4uWY2u@egYvU')
+        self.assertEqual(list(rc.stream('printf "a\\nb"')), [u'a\n', u'b'])
+        self.assertEqual(rc.last_exit_status, 0)
+
+
+class LineSplitterTest(unittest.TestCase):
+    def test_split_line_endings(self):
+        splitter = remote.LineSplitter()
+        self.assertEqual(splitter.feed('a\r\nb\rc\nd'),
+                         [u'a\r\n', u'b\r', u'c\n'])
+        self.assertEqual(splitter.close(), [u'd'])
+
+    def test_crlf_across_chunks(self):
+        splitter = remote.LineSplitter()
+        self.assertEqual(splitter.feed('a\r'), [])
+        self.assertEqual(splitter.feed('\nb\n'), [u'a\r\n', u'b\n'])
+        self.assertEqual(splitter.close(), [])
+
+    def test_long_line(self):
+        splitter = remote.LineSplitter(max_length=4)
+        self.assertEqual(splitter.feed('abcdefghij'), [u'abcd', u'efgh'])
+        self.assertEqual(splitter.close(), [u'ij'])
+
+
+class FakeChannel(object):
+    """Channel of a command whose sudo needs no password."""
+
+    def __init__(self):
+        self.cmd = None
+        self.output = ''
+        self.sent = []
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def exec_command(self, cmd):
+        self.cmd = cmd
+        ready = re.search(r'echo (SSHUTIL-READY-\w+)', cmd)
+        if ready:
+            self.output = ready.group(1) + '\n'
+
+    def recv_ready(self):
+        return bool(self.output)
+
+    def recv(self, size):
+        data, self.output = self.output[:size], self.output[size:]
+        return data
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+
+class SudoTest(unittest.TestCase):
+    cmd = 'cd /tmp && echo abc | tr a-z A-Z; pwd'
+
+    def start(self, password):
+        rc = remote.RemoteClient('127.0.0.1', 'user', password)
+        channel = FakeChannel()
+        rc._start(channel, self.cmd, True, None, None, lambda msg: None)
+        return shlex.split(channel.cmd), channel
+
+    def test_command_is_one_argument(self):
+        args, _ = self.start(None)
+        self.assertEqual(args, ['sudo', '-S', '-p', '', 'sh', '-c',
+                                self.cmd])
+
+    def test_pipe_with_password(self):
+        args, channel = self.start('secret')
+        self.assertEqual(args[:3], ['sudo', '-S', '-p'])
+        self.assertEqual(args[4:6], ['sh', '-c'])
+        self.assertEqual(args[7:], ['sh', self.cmd])
+        self.assertEqual(channel.sent, ['\n'])
+        # Run what sudo would run
+        process = subprocess.Popen(args[4:], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output, _ = process.communicate('\n')
+        self.assertEqual(output, 'ABC\n/tmp\n')
+
+
+class LocalClient(remote.RemoteClient):
+    """RemoteClient running its commands with the local sh."""
+
+    def __init__(self, host_ip='127.0.0.1'):
+        remote.RemoteClient.__init__(self, host_ip, 'user')
+        self.cmds = []
+
+    def _run(self, cmd, capture=True, sudo=False, env_vars=None,
+             log_method='debug', feed_input=None, callback=None,
+             max_output=None, output_file=None):
+        self.cmds.append(cmd)
+        process = subprocess.Popen(['sh', '-c', cmd], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output, _ = process.communicate(feed_input or '')
+        if output_file is not None:
+            output_file.write(output)
+        return output if capture else '', process.returncode, cmd
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.rc = LocalClient()
+
+    def test_results_in_order(self):
+        results = self.rc.run_batch(['echo a', 'printf b; exit 3',
+                                     'echo c >&2', 'true'])
+        self.assertEqual(results, [(0, 'a\n'), (3, 'b'), (0, 'c\n'),
+                                   (0, '')])
+        self.assertEqual(self.rc.cmds, ['sh -s'])
+        self.assertEqual(self.rc.last_exit_status, 0)
+
+    def test_output_like_marker(self):
+        results = self.rc.run_batch(["printf '\\nSSHUTIL-BATCH-x 1 1\\n'",
+                                     'echo ok'])
+        self.assertEqual(results, [(0, '\nSSHUTIL-BATCH-x 1 1\n'),
+                                   (0, 'ok\n')])
+
+    def test_env_vars_and_stdin(self):
+        results = self.rc.run_batch(['echo $NAME', 'cat'],
+                                    env_vars={'NAME': 'value'})
+        self.assertEqual(results, [(0, 'value\n'), (0, '')])
+
+    def test_stop_on_error(self):
+        results = self.rc.run_batch(['false', 'echo skipped'],
+                                    stop_on_error=True)
+        self.assertEqual(results, [(1, ''), (None, '')])
+        self.assertEqual(self.rc.last_exit_status, 1)
+        self.assertRaises(remote.RemoteError, self.rc.run_batch,
+                          ['false', 'echo skipped'], stop_on_error=True,
+                          raise_error=True)
+
 
 if __name__ == '__main__':
     unittest.main()
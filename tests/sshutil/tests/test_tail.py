@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sshutil import tail
+from tests.test_remote import LocalClient
+
+
+class BrokenReadClient(LocalClient):
+    """Client whose reads of file contents stop after half the bytes."""
+
+    def _run(self, cmd, capture=True, sudo=False, env_vars=None,
+             log_method='debug', feed_input=None, callback=None,
+             max_output=None, output_file=None):
+        if not cmd.startswith('tail '):
+            return LocalClient._run(self, cmd, capture, sudo, env_vars,
+                                    log_method, feed_input, callback,
+                                    max_output, output_file)
+        output, exit_status, cmd = LocalClient._run(self, cmd)
+        output_file.write(output[:len(output) // 2])
+        return '', 1, cmd
+
+
+class LogHarvesterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'remote', 'app.log')
+        os.makedirs(os.path.dirname(self.src))
+        self.dest_dir = os.path.join(self.tmp, 'harvest')
+        self.state_file = os.path.join(self.tmp, 'offsets.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def harvester(self, client=None, compress=False):
+        # sudo reads with tail like on a host, without it SFTP is used
+        return tail.LogHarvester(client or LocalClient(), self.dest_dir,
+                                 state_file=self.state_file, sudo=True,
+                                 compress=compress)
+
+    def append(self, data):
+        with open(self.src, 'a') as f:
+            f.write(data)
+
+    def harvested(self, harvester):
+        with open(harvester.local_path(self.src)) as f:
+            return f.read()
+
+    def test_only_new_bytes(self):
+        harvester = self.harvester()
+        self.append('one\n')
+        result, = harvester.harvest([self.src])
+        self.assertIsNone(result.error)
+        self.assertEqual(result.size, 4)
+        self.append('two\n')
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 4)
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 0)
+        self.assertEqual(self.harvested(harvester), 'one\ntwo\n')
+
+    def test_offsets_kept_in_state_file(self):
+        self.append('one\n')
+        self.harvester().harvest([self.src])
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f)[self.src]['offset'], 4)
+        self.append('two\n')
+        harvester = self.harvester(compress=True)
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 4)
+        self.assertEqual(self.harvested(harvester), 'one\ntwo\n')
+
+    def test_rotated_file_read_from_start(self):
+        harvester = self.harvester()
+        self.append('old line\n')
+        harvester.harvest([self.src])
+        os.rename(self.src, self.src + '.1')
+        self.append('new\n')
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 4)
+        self.assertEqual(self.harvested(harvester), 'old line\nnew\n')
+
+    def test_truncated_file_read_from_start(self):
+        harvester = self.harvester()
+        self.append('old line\n')
+        harvester.harvest([self.src])
+        with open(self.src, 'w') as f:
+            f.write('new\n')
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 4)
+        self.assertEqual(self.harvested(harvester), 'old line\nnew\n')
+
+    def test_failed_read_truncated(self):
+        self.append('one\n')
+        self.harvester().harvest([self.src])
+        self.append('two three\n')
+        result, = self.harvester(BrokenReadClient()).harvest([self.src])
+        self.assertIsInstance(result.error, IOError)
+        harvester = self.harvester()
+        self.assertEqual(self.harvested(harvester), 'one\n')
+        result, = harvester.harvest([self.src])
+        self.assertEqual(result.size, 10)
+        self.assertEqual(self.harvested(harvester), 'one\ntwo three\n')
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmp, 'remote', 'missing.log')
+        self.append('one\n')
+        results = self.harvester().harvest([missing, self.src])
+        self.assertIsInstance(results[0].error, IOError)
+        self.assertIsNone(results[1].error)
+        self.assertEqual(results[1].size, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
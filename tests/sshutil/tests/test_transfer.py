@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import paramiko
+
+from sshutil import transfer
+
+
+class FakeSessions(object):
+    def __init__(self):
+        self.acquired = 0
+        self.released = []
+
+    def acquire(self):
+        self.acquired += 1
+        return object()
+
+    def release(self, sftp, broken=False):
+        self.released.append(broken)
+
+
+class CopyChunksTest(unittest.TestCase):
+    def test_retries_chunk_from_start(self):
+        sessions = FakeSessions()
+        copied = []
+
+        def copy(sftp, offset, length):
+            if offset == 4 and 4 not in copied:
+                copied.append(offset)
+                raise EOFError('connection lost')
+            copied.append(offset)
+
+        retries = transfer._copy_chunks(sessions, 10, 4, 1, 2, copy, 'f')
+        self.assertEqual(retries, 1)
+        self.assertEqual(copied, [0, 4, 4, 8])
+        self.assertEqual(sessions.released, [False, True, False, False])
+
+    def test_releases_session_on_other_errors(self):
+        sessions = FakeSessions()
+
+        def copy(sftp, offset, length):
+            raise paramiko.SFTPError('no space left')
+
+        self.assertRaises(paramiko.SFTPError, transfer._copy_chunks,
+                          sessions, 10, 4, 1, 2, copy, 'f')
+        self.assertEqual(sessions.acquired, 1)
+        self.assertEqual(sessions.released, [True])
+
+    def test_skips_done_chunks(self):
+        sessions = FakeSessions()
+        copied = []
+        transfer._copy_chunks(sessions, 10, 4, 1, 0,
+                              lambda sftp, offset, length:
+                              copied.append((offset, length)),
+                              'f', done=set([0]))
+        self.assertEqual(copied, [(4, 4), (8, 2)])
+
+
+class ResumeTest(unittest.TestCase):
+    source_id = 'src 10 1500000000 4'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.part = os.path.join(self.tmp, 'f' + transfer.PARTIAL_SUFFIX)
+        self.log = self.part + transfer.CHUNK_LOG_SUFFIX
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_chunks(self):
+        self.assertEqual(transfer._chunks(10, 4), [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual(transfer._chunks(8, 4), [(0, 4), (4, 4)])
+        self.assertEqual(transfer._chunks(0, 4), [])
+
+    def test_done_chunks(self):
+        text = '%s\n0\n8\n' % self.source_id
+        self.assertEqual(transfer._done_chunks(text, self.source_id, 4),
+                         set([0, 8]))
+        # Interrupted while writing the last line
+        self.assertEqual(transfer._done_chunks(text + '4', self.source_id,
+                                               4), set([0, 8]))
+        self.assertEqual(transfer._done_chunks(text, 'src 10 1 4', 4),
+                         set())
+        # Offsets of another chunk size
+        self.assertEqual(transfer._done_chunks(text, self.source_id, 8),
+                         set([0, 8]))
+        self.assertEqual(transfer._done_chunks(text, self.source_id, 16),
+                         set([0]))
+
+    def test_start_over_without_log(self):
+        with open(self.part, 'w') as f:
+            f.write('stale')
+        self.assertEqual(transfer._resume(open, self.part, self.source_id,
+                                          4), set())
+        self.assertEqual(os.path.getsize(self.part), 0)
+        with open(self.log) as f:
+            self.assertEqual(f.read(), self.source_id + '\n')
+
+    def test_resume_logged_chunks(self):
+        transfer._resume(open, self.part, self.source_id, 4)
+        lock = threading.Lock()
+        with open(self.part, 'r+') as f:
+            f.seek(8)
+            f.write('ij')
+        transfer._log_chunk(open, self.part, 8, lock)
+        self.assertEqual(transfer._resume(open, self.part, self.source_id,
+                                          4), set([8]))
+        self.assertEqual(os.path.getsize(self.part), 10)
+        self.assertEqual(transfer._done_size(10, 4, set([8])), 2)
+
+    def test_start_over_for_changed_source(self):
+        transfer._resume(open, self.part, self.source_id, 4)
+        transfer._log_chunk(open, self.part, 0, threading.Lock())
+        self.assertEqual(transfer._resume(open, self.part,
+                                          'src 12 1500000001 4', 4),
+                         set())
+        with open(self.log) as f:
+            self.assertEqual(f.read(), 'src 12 1500000001 4\n')
+
+    def test_start_over_without_part(self):
+        transfer._resume(open, self.part, self.source_id, 4)
+        transfer._log_chunk(open, self.part, 0, threading.Lock())
+        os.remove(self.part)
+        self.assertEqual(transfer._resume(open, self.part, self.source_id,
+                                          4), set())
+        self.assertTrue(os.path.exists(self.part))
+
+
+if __name__ == '__main__':
+    unittest.main()